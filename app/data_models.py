@@ -1,4 +1,6 @@
-from pydantic import BaseModel
+from typing import Optional
+
+from pydantic import BaseModel, Field
 
 
 class ProcessedActivity(BaseModel):
@@ -10,3 +12,37 @@ class ProcessedActivity(BaseModel):
     story_title: str
     story_content: str
     # image_link: Optional[str] = None
+
+
+# processed activities are read from MongoDB with exactly these fields and returned without the model round trip
+PROCESSED_ACTIVITY_FIELDS = list(ProcessedActivity.model_fields)
+
+
+class StoryBatchRequest(BaseModel):
+    activity_ids: list[int] = []
+    all_unprocessed: bool = False
+    limit: int = Field(default=100, ge=1, le=1000)
+    concurrency: int = Field(default=4, ge=1, le=32)
+    timeout_seconds: float = Field(default=60.0, gt=0)
+
+
+class StoryBatchItem(BaseModel):
+    activity_id: int
+    status: str
+    story_title: Optional[str] = None
+    story_content: Optional[str] = None
+    detail: Optional[str] = None
+
+
+class Job(BaseModel):
+    job_id: str
+    activity_id: int
+    athlete_id: Optional[int] = None
+    status: str
+    attempts: int
+    result: Optional[ProcessedActivity] = None
+    error: Optional[str] = None
+
+
+class AthleteAuthorization(BaseModel):
+    code: str
@@ -0,0 +1,212 @@
+import asyncio
+import functools
+import os
+import threading
+from typing import Callable, Optional, TypeVar
+
+from fastapi import Depends, HTTPException
+
+from src.cache import StoryCache
+from src.gateway import AsyncMongoDBGateway, MongoDBGateway
+from src.generation_pool import GenerationPool
+from src.generators import AIGenerator, AIStoryGenerator
+from src.jobs import JobQueue
+from src.strava_client import (
+    AsyncStravaClient,
+    AthleteNotAuthorizedError,
+    StravaClient,
+    StravaClientPool,
+)
+
+T = TypeVar("T")
+
+
+def built_once(build: Callable[[], T]) -> Callable[[], T]:
+    """
+    Caches the instance of a dependency like `functools.lru_cache` and serializes its first call. Otherwise concurrent
+    first requests of the threadpool would each build their own instance, e.g. their own generation pool or MongoDB
+    client, and only one of them would ever be closed. Exposes `cache_clear` and `cache_info` of the cache.
+
+    """
+    cached = functools.lru_cache(maxsize=None)(build)
+    lock = threading.Lock()
+
+    @functools.wraps(build)
+    def dependency() -> T:
+        # double-checked, the lock is only taken until the instance is built
+        if not cached.cache_info().currsize:
+            with lock:
+                return cached()
+        return cached()
+
+    dependency.cache_clear = cached.cache_clear
+    dependency.cache_info = cached.cache_info
+    return dependency
+
+
+# every dependency below is built on its first use, so that a worker starts without MongoDB, Strava or the model
+
+
+def story_pool_workers() -> int:
+    return int(os.getenv("STORY_POOL_WORKERS", "0"))
+
+
+@built_once
+def get_story_generator() -> AIGenerator:
+    """
+    Returns the process-wide story generator. It is built on the first call and reused by every request afterwards,
+    so the model client and its connections are not re-created per request.
+
+    With STORY_POOL_WORKERS > 0 stories are generated by a pool of that many worker processes, each holding its own
+    generator, see `GenerationPool`. STORY_POOL_QUEUE_SIZE (default 16) stories wait for a worker at most and a story
+    fails after STORY_POOL_TASK_TIMEOUT seconds (default 120).
+
+    """
+    if story_pool_workers() > 0:
+        return GenerationPool(
+            num_workers=story_pool_workers(),
+            max_queue_size=int(os.getenv("STORY_POOL_QUEUE_SIZE", "16")),
+            task_timeout_seconds=float(os.getenv("STORY_POOL_TASK_TIMEOUT", "120")),
+            warm_up=os.getenv("STORY_GENERATOR_WARM_UP", "false").lower() == "true",
+        )
+    return AIStoryGenerator()
+
+
+@built_once
+def get_gateway() -> MongoDBGateway:
+    """
+    Returns the process-wide gateway, indexes are created on the first call.
+
+    """
+    return MongoDBGateway(
+        uri=os.getenv("MONGO_URI", "mongodb://localhost:27017"),
+        db_name="activities",
+        collection_name="activity_collection",
+    )
+
+
+@built_once
+def get_story_cache() -> StoryCache:
+    """
+    Returns the process-wide story cache of the sync routes. Persistent tier uses the gateway.
+
+    """
+    return StoryCache(
+        max_size=int(os.getenv("STORY_CACHE_SIZE", "1024")),
+        store=get_gateway()
+        if os.getenv("STORY_CACHE_PERSISTENT", "false").lower() == "true"
+        else None,
+    )
+
+
+@built_once
+def get_strava_client() -> StravaClient:
+    """
+    Returns the single-athlete Strava client configured through the environment. Access token is refreshed on the
+    first Strava call, not on startup.
+
+    """
+    return StravaClient()
+
+
+@built_once
+def get_strava_client_pool() -> StravaClientPool:
+    """
+    Returns the process-wide pool of per-athlete Strava clients.
+
+    """
+    return StravaClientPool(
+        get_gateway(), max_size=int(os.getenv("STRAVA_CLIENT_POOL_SIZE", "1000"))
+    )
+
+
+@built_once
+def get_async_gateway() -> AsyncMongoDBGateway:
+    """
+    Returns the process-wide async gateway, its Motor client pools connections to MongoDB.
+
+    """
+    return AsyncMongoDBGateway(
+        uri=os.getenv("MONGO_URI", "mongodb://localhost:27017"),
+        db_name="activities",
+        collection_name="activity_collection",
+    )
+
+
+@built_once
+def get_async_strava_client() -> AsyncStravaClient:
+    """
+    Returns the process-wide async Strava client, its httpx client pools connections to Strava API.
+
+    """
+    return AsyncStravaClient()
+
+
+@built_once
+def get_async_story_cache() -> StoryCache:
+    """
+    Returns the process-wide story cache of the async routes. Persistent tier uses the async gateway.
+
+    """
+    return StoryCache(
+        max_size=int(os.getenv("STORY_CACHE_SIZE", "1024")),
+        store=get_async_gateway()
+        if os.getenv("STORY_CACHE_PERSISTENT", "false").lower() == "true"
+        else None,
+    )
+
+
+@built_once
+def get_job_queue() -> JobQueue:
+    """
+    Returns the process-wide story generation job queue.
+
+    """
+    return JobQueue(
+        uri=os.getenv("MONGO_URI", "mongodb://localhost:27017"),
+        db_name="activities",
+    )
+
+
+def strava_client_of_athlete(
+    athlete_id: Optional[int] = None,
+    strava_client: StravaClient = Depends(get_strava_client),
+    strava_client_pool: StravaClientPool = Depends(get_strava_client_pool),
+) -> StravaClient:
+    """
+    Returns the Strava client of the athlete given by the `athlete_id` query parameter. Requests without an athlete
+    are served by the single-athlete client configured through the environment. Responds with 404 if the athlete has
+    not authorized the app, see POST /athletes/.
+
+    """
+    if athlete_id is None:
+        return strava_client
+    return _client_of_athlete(athlete_id, strava_client_pool)
+
+
+async def async_strava_client_of_athlete(
+    athlete_id: Optional[int] = None,
+    strava_client: AsyncStravaClient = Depends(get_async_strava_client),
+    strava_client_pool: StravaClientPool = Depends(get_strava_client_pool),
+) -> AsyncStravaClient:
+    """
+    Async version of `strava_client_of_athlete`, the client of the athlete shares the connections of the
+    process-wide async client.
+
+    """
+    if athlete_id is None:
+        return strava_client
+    # the pool reads the tokens of the athlete from MongoDB
+    client = await asyncio.to_thread(_client_of_athlete, athlete_id, strava_client_pool)
+    return strava_client.for_athlete(client)
+
+
+def _client_of_athlete(
+    athlete_id: int, strava_client_pool: StravaClientPool
+) -> StravaClient:
+    try:
+        return strava_client_pool.get(athlete_id)
+    except AthleteNotAuthorizedError:
+        raise HTTPException(
+            status_code=404, detail=f"Athlete {athlete_id} is not authorized"
+        )
@@ -1,9 +1,171 @@
-from app.routers import activities
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
 
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 
-from fastapi import FastAPI
+from app.dependencies import (
+    get_async_gateway,
+    get_async_strava_client,
+    get_gateway,
+    get_story_generator,
+    get_strava_client,
+    get_strava_client_pool,
+    story_pool_workers,
+)
+from app.middleware import ProfilingMiddleware
+from app.routers import activities, async_activities, athletes, jobs, metrics
+from src.gateway import ActivityConflict
+from src.generation_pool import (
+    GenerationPool,
+    GenerationPoolFull,
+    GenerationWorkerError,
+)
+from src.profiling import StackSampler, build_profile_store
+from src.rate_limiter import RateLimitExceededError
+from src.strava_client import ActivityBadRequestError, StravaServerError
+from src.token_manager import ClientAuthenticationError
 
+logger = logging.getLogger(__name__)
+
+
+def _resolve(app: FastAPI, dependency):
+    # honour dependency overrides so that tests and benchmarks can swap the shared instances
+    return app.dependency_overrides.get(dependency, dependency)()
+
+
+def _built(app: FastAPI, dependency):
+    # instance of the dependency if it is overridden or was built by a request, None otherwise
+    if dependency in app.dependency_overrides:
+        return app.dependency_overrides[dependency]()
+    if dependency.cache_info().currsize:
+        return dependency()
+    return None
+
+
+def preload() -> None:
+    """
+    Builds the story generator before the workers are forked, so that the imported libraries and a local model are
+    loaded once and shared by all workers. Clients holding connections are not fork-safe, they are still built by
+    every worker on their first use. See `app.serve`.
+
+    Generation pool is not preloaded, its worker processes and dispatcher thread would not survive the fork.
+
+    """
+    if story_pool_workers() > 0:
+        return
+    get_story_generator()
+
+
+async def _ensure_indexes(gateway) -> None:
+    try:
+        await gateway.ensure_indexes()
+    except Exception:
+        # API still serves the routes that do not need MongoDB, indexes are created again on the next start
+        logger.exception("Could not create MongoDB indexes")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # nothing is connected on startup, gateway, Strava clients and story generator are built on their first use
+    if os.getenv("STORY_GENERATOR_WARM_UP", "false").lower() == "true":
+        await asyncio.to_thread(_resolve(app, get_story_generator).warm_up)
+    indexes = asyncio.create_task(_ensure_indexes(_resolve(app, get_async_gateway)))
+    yield
+    indexes.cancel()
+    story_generator = _built(app, get_story_generator)
+    if isinstance(story_generator, GenerationPool):
+        story_generator.close()
+    async_strava_client = _built(app, get_async_strava_client)
+    if async_strava_client is not None:
+        await async_strava_client.aclose()
+    for dependency in (
+        get_async_gateway,
+        get_strava_client,
+        get_strava_client_pool,
+        get_gateway,
+    ):
+        instance = _built(app, dependency)
+        if instance is not None:
+            instance.close()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.exception_handler(GenerationPoolFull)
+async def generation_pool_full(request: Request, exc: GenerationPoolFull):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after_seconds)},
+    )
+
+
+@app.exception_handler(ActivityConflict)
+async def activity_conflict(request: Request, exc: ActivityConflict):
+    return JSONResponse(status_code=409, content={"detail": str(exc)})
+
+
+@app.exception_handler(RateLimitExceededError)
+async def strava_rate_limit_exceeded(request: Request, exc: RateLimitExceededError):
+    headers = {}
+    if exc.retry_after_seconds is not None:
+        headers["Retry-After"] = str(exc.retry_after_seconds)
+    return JSONResponse(status_code=429, content={"detail": str(exc)}, headers=headers)
+
+
+@app.exception_handler(StravaServerError)
+async def strava_server_error(request: Request, exc: StravaServerError):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": f"Strava is unavailable: {exc}"},
+        headers={"Retry-After": str(exc.retry_after_seconds)},
+    )
+
+
+@app.exception_handler(ClientAuthenticationError)
+async def strava_authentication_failed(
+    request: Request, exc: ClientAuthenticationError
+):
+    # the credentials of the app or of the athlete are rejected by Strava, not the ones of the caller
+    return JSONResponse(
+        status_code=502,
+        content={"detail": f"Strava rejected the credentials of the athlete: {exc}"},
+    )
+
+
+@app.exception_handler(ActivityBadRequestError)
+async def strava_bad_request(request: Request, exc: ActivityBadRequestError):
+    return JSONResponse(
+        status_code=502, content={"detail": f"Strava rejected the request: {exc}"}
+    )
+
+
+@app.exception_handler(GenerationWorkerError)
+async def generation_worker_error(request: Request, exc: GenerationWorkerError):
+    return JSONResponse(
+        status_code=502, content={"detail": f"Story generation failed: {exc}"}
+    )
 
-app = FastAPI()
 
 app.include_router(activities.router, prefix="/activities", tags=["Activities"])
+app.include_router(
+    async_activities.router, prefix="/async/activities", tags=["Async Activities"]
+)
+app.include_router(athletes.router, prefix="/athletes", tags=["Athletes"])
+app.include_router(jobs.router, prefix="/jobs", tags=["Jobs"])
+app.include_router(metrics.router, prefix="/metrics", tags=["Metrics"])
+
+if os.getenv("PROFILE_REQUESTS", "false").lower() == "true":
+    app.add_middleware(
+        ProfilingMiddleware,
+        store=build_profile_store(),
+        sample_rate=float(os.getenv("PROFILE_SAMPLE_RATE", "0.01")),
+        slow_ms=float(os.getenv("PROFILE_SLOW_MS", "1000")),
+        sampler=StackSampler(
+            interval_seconds=float(os.getenv("PROFILE_INTERVAL_MS", "10")) / 1000
+        ),
+    )
@@ -0,0 +1,86 @@
+import asyncio
+import logging
+import random
+import time
+import uuid
+from datetime import datetime, timezone
+
+from src.metrics import timing_recorder
+from src.profiling import RequestProfile, StackSampler
+
+logger = logging.getLogger(__name__)
+
+
+class ProfilingMiddleware:
+    """
+    Opt-in request profiler. Every request is profiled, see `RequestProfile`, and the profile is saved to `store` if
+    the request is picked with `sample_rate` probability or if it takes longer than `slow_ms`. A saved profile holds
+    the request, its duration, the time spent in every stage (MongoDB, Strava, LLM, parsing) and a sampled stack
+    profile. Use `python -m app.slow_requests` to print the slowest requests.
+
+    """
+
+    def __init__(
+        self,
+        app,
+        store,
+        sample_rate: float = 0.01,
+        slow_ms: float = 1000.0,
+        sampler: StackSampler = None,
+    ):
+        self._app = app
+        self._store = store
+        self._sample_rate = sample_rate
+        self._slow_ms = slow_ms
+        self._sampler = sampler if sampler is not None else StackSampler()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self._app(scope, receive, send)
+
+        profile = RequestProfile()
+        status_code = None
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        started_at = datetime.now(timezone.utc)
+        token = timing_recorder.set(profile)
+        # the task of the request is sampled for the whole request, threads only inside instrumented blocks
+        profile.enter()
+        self._sampler.start(profile)
+        try:
+            await self._app(scope, receive, send_with_status)
+        finally:
+            self._sampler.stop(profile)
+            profile.exit()
+            timing_recorder.reset(token)
+            duration_ms = (time.perf_counter() - profile.started) * 1000
+            reason = None
+            if duration_ms >= self._slow_ms:
+                reason = "slow"
+            elif random.random() < self._sample_rate:
+                reason = "sampled"
+            if reason is not None:
+                document = {
+                    "request_id": uuid.uuid4().hex,
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "query": scope["query_string"].decode(),
+                    "status_code": status_code,
+                    "started_at": started_at.isoformat(),
+                    "duration_ms": round(duration_ms, 3),
+                    "reason": reason,
+                    **profile.to_document(),
+                }
+                # response is already sent, saving does not delay it
+                asyncio.get_running_loop().run_in_executor(None, self._save, document)
+
+    def _save(self, document: dict) -> None:
+        try:
+            self._store.save(document)
+        except Exception:
+            logger.exception("Could not save the profile of %s", document["path"])
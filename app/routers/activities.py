@@ -1,11 +1,44 @@
-from fastapi import APIRouter, HTTPException
+import json
+from typing import Iterator, Optional
 
-from app.data_models import ProcessedActivity
-from src.gateway import MongoDBGateway, NoResultFound
-from src.generators import AIStoryGenerator
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse
+
+from app.data_models import (
+    PROCESSED_ACTIVITY_FIELDS,
+    ProcessedActivity,
+    StoryBatchRequest,
+    StoryBatchItem,
+)
+from app.dependencies import (
+    async_strava_client_of_athlete,
+    get_async_gateway,
+    get_async_story_cache,
+    get_gateway,
+    get_job_queue,
+    get_story_cache,
+    get_story_generator,
+    get_strava_client,
+    strava_client_of_athlete,
+)
+from src.batch import BatchStoryGenerator
+from src.cache import StoryCache
+from src.gateway import (
+    AsyncMongoDBGateway,
+    BulkSaveResult,
+    MongoDBGateway,
+    NoResultFound,
+    stamp_athlete,
+)
+from src.generation_pool import GenerationPool
+from src.generators import AIStoryGenerator, Story
+from src.jobs import JobQueue
+from src.metrics import STAGE_SECONDS, timed
+from src.story_parser import parse_story, streamed_title
 from src.strava_client import (
+    AsyncStravaClient,
     StravaClient,
-    ClientAuthenticationError,
     ActivityNotFoundError,
 )
 
@@ -15,42 +48,86 @@ router = APIRouter(
         500: {"description": "Internal Server Error"},
     }
 )
-gateway = MongoDBGateway(
-    uri="mongodb://localhost:27017",
-    db_name="activities",
-    collection_name="activity_collection",
-)
-strava_client = StravaClient()
-strava_client.refresh_token()
 
 
-@router.get("/processed/")
-def get_all_processed_activities() -> list[ProcessedActivity]:
+@router.get("/processed/", response_model=list[ProcessedActivity])
+def get_all_processed_activities(
+    limit: Optional[int] = Query(default=None, ge=1),
+    after: Optional[int] = None,
+    stream: bool = False,
+    batch_size: int = Query(default=1000, ge=1),
+    fields: Optional[list[str]] = Query(default=None),
+    athlete_id: Optional[int] = None,
+    gateway: MongoDBGateway = Depends(get_gateway),
+):
     """
     Reads all processed activities. Processed activity is the one that has a story and title generated.
 
+    Activities are sorted by activity ID. With `limit` a page of activities is returned and `X-Next-After` header
+    holds the `after` value of the next page. With `stream` activities are streamed as NDJSON straight from DB,
+    `batch_size` activities at a time. Only the fields of `ProcessedActivity` are returned, with `fields` only the
+    given ones, e.g. `fields=activity_id&fields=story_title` for list views. With `athlete_id` only the activities of that athlete are
+    returned.
+
+    Activities are validated when they are written, rows are serialized as they are read with orjson instead of being
+    converted to `ProcessedActivity` models and validated again by the response model.
+
     """
-    all_activities = gateway.get_processed_activities()
+    if fields:
+        unknown_fields = set(fields) - set(ProcessedActivity.model_fields)
+        if unknown_fields:
+            raise HTTPException(
+                status_code=422, detail=f"Unknown fields: {sorted(unknown_fields)}"
+            )
+    # documents also hold Strava fields and the athlete, both paths only read the fields of the response
+    fields = fields or PROCESSED_ACTIVITY_FIELDS
+
+    if stream:
+        rows = gateway.iter_processed_activities(
+            batch_size=batch_size, after=after, fields=fields, athlete_id=athlete_id
+        )
+        return StreamingResponse(
+            (orjson.dumps(row, default=str) + b"\n" for row in rows),
+            media_type="application/x-ndjson",
+        )
+
+    all_activities = gateway.get_processed_activities(
+        limit=limit or 0,
+        after=after,
+        fields=fields,
+        athlete_id=athlete_id,
+    )
     if not all_activities:
         raise HTTPException(status_code=404, detail="No processed activities")
-    return [ProcessedActivity(**activity) for activity in all_activities]
+    headers = {}
+    if limit and len(all_activities) == limit and "activity_id" in all_activities[-1]:
+        headers["X-Next-After"] = str(all_activities[-1]["activity_id"])
+    return ORJSONResponse(all_activities, headers=headers)
 
 
 @router.post("/", status_code=201, response_model=dict)
-def save_recent_strava_activities():
+def save_recent_strava_activities(
+    since_last_sync: bool = False,
+    athlete_id: Optional[int] = None,
+    client: StravaClient = Depends(strava_client_of_athlete),
+    gateway: MongoDBGateway = Depends(get_gateway),
+):
     """
     Creates activities from Strava API for a particular user.
 
+    With `since_last_sync` only the activities started after the last synced activity are fetched and saved. With
+    `athlete_id` activities of that athlete are fetched with the tokens stored through POST /athletes/.
+
+    Activities saved for another athlete are not overwritten, they are counted in `conflicts` of the response.
+
     """
-    try:
-        activities = strava_client.get_most_recent_activities()
-    except ClientAuthenticationError:
-        StravaClient.refresh_token()
-        activities = strava_client.get_most_recent_activities()
+    if since_last_sync:
+        return _save_activities_since_last_sync(client, gateway)
+
+    activities = stamp_athlete(client.get_most_recent_activities(), athlete_id)
 
     if activities:
-        gateway.bulk_save(activities)
-        return {"message": f"Successfully saved {len(activities)} activities."}
+        return _saved(gateway.bulk_save(activities))
     else:
         raise HTTPException(
             status_code=500,
@@ -58,27 +135,256 @@ def save_recent_strava_activities():
         )
 
 
+def _save_activities_since_last_sync(
+    client: StravaClient, gateway: MongoDBGateway
+) -> dict:
+    athlete_id = client.get_athlete_id()
+
+    watermark = gateway.get_watermark(athlete_id)
+    after = watermark["start_date"] if watermark else 0
+    activities = stamp_athlete(list(client.iter_activities_after(after)), athlete_id)
+
+    if not activities:
+        return _saved(BulkSaveResult())
+    result = gateway.bulk_save(activities)
+    latest_activity = max(activities, key=lambda x: x["start_date"])
+    gateway.set_watermark(
+        athlete_id, latest_activity["start_date"], latest_activity["activity_id"]
+    )
+    return _saved(result)
+
+
+def _saved(result: BulkSaveResult) -> dict:
+    return {
+        "message": f"Successfully saved {result.saved} activities.",
+        "saved": result.saved,
+        "conflicts": result.conflicts,
+    }
+
+
 @router.put("/{activity_id}/")
-def update_activity_with_story(activity_id: int) -> ProcessedActivity:
+def update_activity_with_story(
+    activity_id: int,
+    response: Response,
+    use_cache: bool = True,
+    athlete_id: Optional[int] = None,
+    story_generator: AIStoryGenerator = Depends(get_story_generator),
+    client: StravaClient = Depends(strava_client_of_athlete),
+    gateway: MongoDBGateway = Depends(get_gateway),
+    story_cache: StoryCache = Depends(get_story_cache),
+) -> ProcessedActivity:
     """
     Updates the activity with a title and a story. Story and title is generated by an LLM.
+
+    Stories are cached by model, prompt and activity metrics. `X-Story-Cache` header tells whether the story came
+    from the cache, `use_cache=false` always generates a new story. With `athlete_id` only an activity of that
+    athlete is updated.
+    """
+    activity = _get_or_fetch_activity(activity_id, athlete_id, client, gateway)
+    cache_key = story_generator.cache_key(activity)
+    story = story_cache.get(cache_key) if use_cache else None
+    response.headers["X-Story-Cache"] = "HIT" if story else "MISS"
+    if story is None:
+        story = story_generator.generate(activity)
+        story_cache.set(cache_key, story)
+    with timed(STAGE_SECONDS, stage="mongo_update"):
+        updated_activity = gateway.update(activity, story.__dict__)
+    return ProcessedActivity(**updated_activity)
+
+
+@router.get("/{activity_id}/story/stream")
+def stream_activity_story(
+    activity_id: int,
+    use_cache: bool = True,
+    athlete_id: Optional[int] = None,
+    story_generator: AIStoryGenerator = Depends(get_story_generator),
+    client: StravaClient = Depends(strava_client_of_athlete),
+    gateway: MongoDBGateway = Depends(get_gateway),
+    story_cache: StoryCache = Depends(get_story_cache),
+) -> StreamingResponse:
+    """
+    Streams the generation of the title and story of the activity as Server-Sent Events:
+        - `token`: `{"text": ...}` chunk of the model output as soon as it is generated
+        - `title`: `{"story_title": ...}` parsed title as soon as its line is complete
+        - `story`: the processed activity once the stream completes and the story is saved
+        - `error`: `{"detail": ...}` if the generation fails, nothing is saved
+
+    A cached story is sent as `title` and `story` events without calling the model. Streamed stories are not
+    generated again on low parse confidence since their tokens are already sent. Models that do not stream, e.g. the
+    default huggingface_hub backend, send their whole output as a single `token` event.
+
     """
+    activity = _get_or_fetch_activity(activity_id, athlete_id, client, gateway)
+    cache_key = story_generator.cache_key(activity)
+    story = story_cache.get(cache_key) if use_cache else None
+    # a generation pool submits the story here, so that a full pool is answered with 429 before the response starts,
+    # AIStoryGenerator is lazy and only starts generating when the response reads the first chunk
+    chunks = story_generator.stream(activity) if story is None else None
+    return StreamingResponse(
+        _story_events(activity, chunks, cache_key, story, gateway, story_cache),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Story-Cache": "HIT" if story else "MISS",
+        },
+    )
+
+
+def _story_events(
+    activity: dict,
+    chunks: Optional[Iterator[str]],
+    cache_key: str,
+    story: Optional[Story],
+    gateway: MongoDBGateway,
+    story_cache: StoryCache,
+) -> Iterator[str]:
+    if story is None:
+        text = ""
+        title = None
+        try:
+            for chunk in chunks:
+                text += chunk
+                yield _sse("token", {"text": chunk})
+                if title is None:
+                    title = streamed_title(text)
+                    if title is not None:
+                        yield _sse("title", {"story_title": title})
+        except Exception as e:
+            # response has already started, the error can only be reported as an event
+            yield _sse("error", {"detail": f"Story generation failed: {e}"})
+            return
+        parsed = parse_story(text)
+        story = Story(
+            story_title=parsed.story_title, story_content=parsed.story_content
+        )
+        story_cache.set(cache_key, story)
+    else:
+        yield _sse("title", {"story_title": story.story_title})
+    with timed(STAGE_SECONDS, stage="mongo_update"):
+        updated_activity = gateway.update(activity, story.__dict__)
+    yield _sse("story", ProcessedActivity(**updated_activity).model_dump())
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def _get_or_fetch_activity(
+    activity_id: int,
+    athlete_id: Optional[int],
+    client: StravaClient,
+    gateway: MongoDBGateway,
+) -> dict:
+    # an activity of another athlete raises ActivityConflict, answered with 409
     try:
-        activity = gateway.get(activity_id)
+        with timed(STAGE_SECONDS, stage="mongo_get"):
+            return gateway.get(activity_id, athlete_id=athlete_id)
     except NoResultFound:
         try:
-            activity = strava_client.get_activity(activity_id)
-            gateway.save_one(activity)
-        except ClientAuthenticationError:
-            strava_client.refresh_token()
-            activity = strava_client.get_activity(activity_id)
-            gateway.save_one(activity)
+            with timed(STAGE_SECONDS, stage="strava_get_activity"):
+                activity = client.get_activity(activity_id)
         except ActivityNotFoundError:
             raise HTTPException(
                 status_code=404,
                 detail=f"Activity {activity_id} not found in database nor in Strava Client",
             )
-    story_generator = AIStoryGenerator()
-    story = story_generator.generate(activity)
-    updated_activity = gateway.update(activity, story.__dict__)
-    return ProcessedActivity(**updated_activity)
+        stamp_athlete([activity], athlete_id)
+        gateway.save_one(activity)
+        return activity
+
+
+@router.post(
+    "/{activity_id}/story-jobs/",
+    status_code=status.HTTP_202_ACCEPTED,
+    # rejects unauthorized athletes before their job is queued
+    dependencies=[Depends(strava_client_of_athlete)],
+)
+def enqueue_story_job(
+    activity_id: int,
+    response: Response,
+    athlete_id: Optional[int] = None,
+    job_queue: JobQueue = Depends(get_job_queue),
+) -> dict:
+    """
+    Queues generation of the title and story of the activity and returns immediately. Story is generated by the
+    worker processes, job status and result are available through GET /jobs/{job_id}. With `athlete_id` only an
+    activity of that athlete is updated.
+
+    """
+    job = job_queue.enqueue(activity_id, athlete_id=athlete_id)
+    response.headers["Location"] = f"/jobs/{job['job_id']}"
+    return {"job_id": job["job_id"], "status": job["status"]}
+
+
+@router.get("/story-cache/stats/", response_model=dict)
+def get_story_cache_stats(story_cache: StoryCache = Depends(get_story_cache)):
+    """
+    Reads hit-rate and latency metrics of the story cache.
+
+    """
+    return story_cache.stats()
+
+
+@router.get("/story-pool/health/", response_model=dict)
+def get_story_pool_health(
+    story_generator: AIStoryGenerator = Depends(get_story_generator),
+):
+    """
+    Reads the liveness of the story generation workers and the load of their queue. Responds with 503 when no worker
+    can generate stories and with 404 when stories are not generated by a pool, see STORY_POOL_WORKERS.
+
+    """
+    if not isinstance(story_generator, GenerationPool):
+        raise HTTPException(
+            status_code=404, detail="Story generation pool is not enabled"
+        )
+    health = story_generator.health()
+    if not health["ready_workers"]:
+        return JSONResponse(health, status_code=503)
+    return health
+
+
+@router.post("/stories:batch")
+async def generate_stories_in_batch(
+    batch_request: StoryBatchRequest,
+    athlete_id: Optional[int] = None,
+    gateway: AsyncMongoDBGateway = Depends(get_async_gateway),
+    strava_client: AsyncStravaClient = Depends(async_strava_client_of_athlete),
+    story_generator: AIStoryGenerator = Depends(get_story_generator),
+    story_cache: StoryCache = Depends(get_async_story_cache),
+) -> list[StoryBatchItem]:
+    """
+    Generates stories of the given activities or of all unprocessed activities in DB. Activities missing from DB are
+    fetched from Strava. At most `concurrency` stories are generated at once and each one is bounded by
+    `timeout_seconds`. Returns the status of every activity. With `athlete_id` only the activities of that athlete
+    are read and updated, activities of other athletes get the `conflict` status.
+
+    """
+    if not batch_request.activity_ids and not batch_request.all_unprocessed:
+        raise HTTPException(
+            status_code=422,
+            detail="Either activity_ids or all_unprocessed must be provided",
+        )
+    batch_generator = BatchStoryGenerator(
+        gateway=gateway,
+        strava_client=strava_client,
+        story_generator=story_generator,
+        story_cache=story_cache,
+        concurrency=batch_request.concurrency,
+        timeout=batch_request.timeout_seconds,
+        athlete_id=athlete_id,
+    )
+    if batch_request.all_unprocessed:
+        return await batch_generator.generate_unprocessed(limit=batch_request.limit)
+    return await batch_generator.generate(batch_request.activity_ids)
+
+
+@router.get("/strava-rate-limit/stats/", response_model=dict)
+def get_strava_rate_limit_stats(
+    strava_client: StravaClient = Depends(get_strava_client),
+):
+    """
+    Reads remaining Strava API budget and throttling metrics.
+
+    """
+    return strava_client.rate_limit_metrics()
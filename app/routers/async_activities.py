@@ -0,0 +1,111 @@
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Response
+from fastapi.responses import ORJSONResponse
+
+from app.data_models import PROCESSED_ACTIVITY_FIELDS, ProcessedActivity
+from app.dependencies import (
+    async_strava_client_of_athlete,
+    get_async_gateway,
+    get_async_story_cache,
+    get_story_generator,
+)
+from src.cache import StoryCache
+from src.gateway import AsyncMongoDBGateway, NoResultFound, stamp_athlete
+from src.generators import AIStoryGenerator
+from src.metrics import STAGE_SECONDS, timed
+from src.strava_client import (
+    AsyncStravaClient,
+    ActivityNotFoundError,
+)
+
+router = APIRouter(
+    responses={
+        404: {"description": "Not found"},
+        500: {"description": "Internal Server Error"},
+    }
+)
+
+
+@router.get("/processed/", response_model=list[ProcessedActivity])
+async def get_all_processed_activities(
+    athlete_id: Optional[int] = None,
+    gateway: AsyncMongoDBGateway = Depends(get_async_gateway),
+):
+    """
+    Async version of GET /activities/processed/.
+
+    """
+    all_activities = await gateway.get_processed_activities(
+        fields=PROCESSED_ACTIVITY_FIELDS, athlete_id=athlete_id
+    )
+    if not all_activities:
+        raise HTTPException(status_code=404, detail="No processed activities")
+    return ORJSONResponse(all_activities)
+
+
+@router.post("/", status_code=201, response_model=dict)
+async def save_recent_strava_activities(
+    athlete_id: Optional[int] = None,
+    gateway: AsyncMongoDBGateway = Depends(get_async_gateway),
+    strava_client: AsyncStravaClient = Depends(async_strava_client_of_athlete),
+):
+    """
+    Async version of POST /activities/.
+
+    """
+    activities = stamp_athlete(
+        await strava_client.get_most_recent_activities(), athlete_id
+    )
+
+    if activities:
+        result = await gateway.bulk_save(activities)
+        return {
+            "message": f"Successfully saved {result.saved} activities.",
+            "saved": result.saved,
+            "conflicts": result.conflicts,
+        }
+    else:
+        raise HTTPException(
+            status_code=500,
+            detail="Internal Server Error when getting activities from Strava",
+        )
+
+
+@router.put("/{activity_id}/")
+async def update_activity_with_story(
+    activity_id: int,
+    response: Response,
+    use_cache: bool = True,
+    athlete_id: Optional[int] = None,
+    gateway: AsyncMongoDBGateway = Depends(get_async_gateway),
+    strava_client: AsyncStravaClient = Depends(async_strava_client_of_athlete),
+    story_generator: AIStoryGenerator = Depends(get_story_generator),
+    story_cache: StoryCache = Depends(get_async_story_cache),
+) -> ProcessedActivity:
+    """
+    Async version of PUT /activities/{activity_id}/. The worker is not blocked while the LLM generates the story.
+
+    """
+    try:
+        with timed(STAGE_SECONDS, stage="mongo_get"):
+            activity = await gateway.get(activity_id, athlete_id=athlete_id)
+    except NoResultFound:
+        try:
+            with timed(STAGE_SECONDS, stage="strava_get_activity"):
+                activity = await strava_client.get_activity(activity_id)
+        except ActivityNotFoundError:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Activity {activity_id} not found in database nor in Strava Client",
+            )
+        await gateway.save_one(stamp_athlete([activity], athlete_id)[0])
+    cache_key = story_generator.cache_key(activity)
+    story = await story_cache.aget(cache_key) if use_cache else None
+    response.headers["X-Story-Cache"] = "HIT" if story else "MISS"
+    if story is None:
+        story = await story_generator.agenerate(activity)
+        await story_cache.aset(cache_key, story)
+    with timed(STAGE_SECONDS, stage="mongo_update"):
+        updated_activity = await gateway.update(activity, story.__dict__)
+    return ProcessedActivity(**updated_activity)
@@ -0,0 +1,32 @@
+from fastapi import APIRouter, Depends, HTTPException
+
+from app.data_models import AthleteAuthorization
+from app.dependencies import get_strava_client_pool
+from src.strava_client import (
+    ClientAuthenticationError,
+    ActivityBadRequestError,
+    StravaClientPool,
+)
+
+router = APIRouter(
+    responses={
+        401: {"description": "Unauthorized"},
+    }
+)
+
+
+@router.post("/", status_code=201, response_model=dict)
+def authorize_athlete(
+    authorization: AthleteAuthorization,
+    strava_client_pool: StravaClientPool = Depends(get_strava_client_pool),
+):
+    """
+    Exchanges the authorization code of an athlete for a Strava token pair and stores it. Activities of the athlete
+    are then served by passing `athlete_id` to the activity routes.
+
+    """
+    try:
+        athlete_id = strava_client_pool.authenticate(authorization.code)
+    except (ClientAuthenticationError, ActivityBadRequestError):
+        raise HTTPException(status_code=401, detail="Invalid authorization code")
+    return {"athlete_id": athlete_id}
@@ -0,0 +1,24 @@
+from fastapi import APIRouter, Depends, HTTPException
+
+from app.data_models import Job
+from app.dependencies import get_job_queue
+from src.jobs import JobQueue, JobNotFound
+
+router = APIRouter(
+    responses={
+        404: {"description": "Not found"},
+    }
+)
+
+
+@router.get("/{job_id}")
+def get_job(job_id: str, job_queue: JobQueue = Depends(get_job_queue)) -> Job:
+    """
+    Reads the status of a story generation job. Succeeded jobs contain the processed activity as result.
+
+    """
+    try:
+        job = job_queue.get(job_id)
+    except JobNotFound:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return Job(**job)
@@ -0,0 +1,16 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from src.metrics import REGISTRY
+
+router = APIRouter()
+
+
+@router.get("", response_class=PlainTextResponse)
+def get_metrics() -> PlainTextResponse:
+    """
+    Exposes latency histograms of story generation stages, LLM generations and MongoDB operations, and counters of
+    Strava calls by status code, generated tokens and story cache lookups in Prometheus text format.
+
+    """
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,61 @@
+"""
+Pre-fork API server. The listening socket is opened once and `--workers` processes are forked to serve it. With
+`--preload` the story generator is built before forking, see `app.main.preload`, so workers start serving right away
+and share the memory of the imported libraries and of a local model.
+
+Run from the repository root (needs `fork`, so Linux or macOS):
+    python -m app.serve --workers 4 --preload
+
+"""
+import argparse
+import os
+import signal
+import socket
+import sys
+
+import uvicorn
+
+from app.main import app, preload
+
+
+def serve(sock: socket.socket) -> None:
+    server = uvicorn.Server(uvicorn.Config(app, lifespan="on"))
+    server.run(sockets=[sock])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--preload", action="store_true")
+    args = parser.parse_args()
+
+    if args.preload:
+        preload()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.set_inheritable(True)
+
+    pids = []
+    for _ in range(args.workers):
+        pid = os.fork()
+        if pid == 0:
+            serve(sock)
+            sys.exit(0)
+        pids.append(pid)
+
+    def stop(signum, frame):
+        for pid in pids:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    for pid in pids:
+        os.waitpid(pid, 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Prints the slowest profiled requests with the time spent in every stage and their most sampled stacks. Profiles are
+read from the store configured for the API with PROFILE_STORE, PROFILE_DIR and MONGO_URI, see `build_profile_store`.
+
+Run from the repository root:
+    python -m app.slow_requests --limit 10 --stacks 3
+
+"""
+import argparse
+
+from src.profiling import build_profile_store
+
+# leaf frames of a folded stack that are printed, the root frames are the same for every request
+STACK_FRAMES = 4
+
+
+def format_profile(rank: int, profile: dict, num_stacks: int) -> str:
+    lines = [
+        f"{rank:>3}. {profile['duration_ms']:>10.1f} ms  {profile['method']} {profile['path']}"
+        f"{'?' + profile['query'] if profile.get('query') else ''}  {profile['status_code']}  "
+        f"{profile['reason']}  {profile['started_at']}"
+    ]
+    stages = sorted(profile["stages"].items(), key=lambda x: x[1]["ms"], reverse=True)
+    for name, stage in stages:
+        share = stage["ms"] / profile["duration_ms"] if profile["duration_ms"] else 0
+        lines.append(
+            f"       {name:<36} {stage['count']:>4} x {stage['ms']:>10.1f} ms {share:>6.1%}"
+        )
+    for stack, count in profile["stacks"][:num_stacks]:
+        frames = stack.split(";")
+        leaf = ";".join(frames[-STACK_FRAMES:])
+        prefix = "...;" if len(frames) > STACK_FRAMES else ""
+        lines.append(f"       {count:>5} samples  {prefix}{leaf}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--stacks", type=int, default=3)
+    args = parser.parse_args()
+
+    store = build_profile_store()
+    for rank, profile in enumerate(store.slowest(args.limit), start=1):
+        print(format_profile(rank, profile, args.stacks))
+
+
+if __name__ == "__main__":
+    main()
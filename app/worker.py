@@ -0,0 +1,78 @@
+"""
+Story generation worker processes that drain the job queue.
+
+Run from the repository root:
+    python -m app.worker --processes 4
+
+"""
+import argparse
+import multiprocessing
+import os
+import signal
+import threading
+
+from src.gateway import MongoDBGateway
+from src.generators import AIStoryGenerator
+from src.jobs import JobQueue, StoryJobWorker
+from src.strava_client import StravaClient, StravaClientPool
+
+
+def run_worker(poll_interval: float) -> None:
+    # every process builds its own clients, MongoClient is not fork-safe
+    uri = os.getenv("MONGO_URI", "mongodb://localhost:27017")
+    gateway = MongoDBGateway(
+        uri=uri,
+        db_name="activities",
+        collection_name="activity_collection",
+    )
+    queue = JobQueue(uri=uri, db_name="activities")
+    strava_client = StravaClient()
+    strava_client_pool = StravaClientPool(gateway)
+    worker = StoryJobWorker(
+        queue=queue,
+        gateway=gateway,
+        strava_client=strava_client,
+        strava_client_pool=strava_client_pool,
+        story_generator=AIStoryGenerator(),
+        poll_interval=poll_interval,
+    )
+    # SIGTERM finishes the running job, Ctrl+C interrupts it, it is leased again once its lease expires
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    try:
+        worker.run(stop_event)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for client in (queue, strava_client, strava_client_pool, gateway):
+            client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--poll-interval", type=float, default=1.0)
+    args = parser.parse_args()
+
+    processes = [
+        multiprocessing.Process(target=run_worker, args=(args.poll_interval,))
+        for _ in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    # workers finish their running job and close their clients
+    signal.signal(
+        signal.SIGTERM,
+        lambda signum, frame: [process.terminate() for process in processes],
+    )
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # Ctrl+C reaches the workers too
+        for process in processes:
+            process.join()
+
+
+if __name__ == "__main__":
+    main()
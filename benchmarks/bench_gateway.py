@@ -0,0 +1,92 @@
+"""
+Measures ingest and `activity_id` lookup latency of `MongoDBGateway`.
+
+Run from the repository root against a local mongod (recommended, indexes are only effective on a real server):
+    python -m benchmarks.bench_gateway --uri mongodb://localhost:27017 --num-documents 1000000
+
+Without `--uri` the benchmark runs on mongomock, which is an in-memory fake that scans collections linearly, use a
+smaller `--num-documents` there.
+
+"""
+import argparse
+import random
+import time
+from unittest.mock import patch
+
+import mongomock
+
+from src.gateway import MongoDBGateway
+
+
+def build_gateway(uri: str, batch_size: int) -> MongoDBGateway:
+    kwargs = dict(
+        db_name="benchmarks",
+        collection_name="bench_activity_collection",
+        watermark_collection_name="bench_sync_watermarks",
+        batch_size=batch_size,
+    )
+    if uri:
+        return MongoDBGateway(uri=uri, **kwargs)
+    with patch("src.gateway.MongoClient", mongomock.MongoClient):
+        return MongoDBGateway(uri="mongodb://localhost:27017", **kwargs)
+
+
+def activities(num_documents: int) -> list[dict]:
+    return [
+        {
+            "activity_id": idx,
+            "speed": 5.0,
+            "distance": 1000.0 + idx,
+            "time": 600,
+            "elevation": 10.0,
+        }
+        for idx in range(num_documents)
+    ]
+
+
+def time_lookups(
+    gateway: MongoDBGateway, num_documents: int, num_lookups: int
+) -> float:
+    ids = [random.randrange(num_documents) for _ in range(num_lookups)]
+    start = time.perf_counter()
+    for activity_id in ids:
+        gateway.get(activity_id)
+    return (time.perf_counter() - start) * 1000 / num_lookups
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--uri", default=None)
+    parser.add_argument("--num-documents", type=int, default=1_000_000)
+    parser.add_argument("--num-lookups", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    gateway = build_gateway(args.uri, args.batch_size)
+    collection = gateway._collection
+    collection.drop()
+    documents = activities(args.num_documents)
+
+    start = time.perf_counter()
+    collection.insert_many([document.copy() for document in documents])
+    print(f"insert_many ingest: {time.perf_counter() - start:.2f}s")
+    print(
+        f"lookup without index: {time_lookups(gateway, args.num_documents, args.num_lookups):.3f}ms"
+    )
+
+    collection.drop()
+    gateway._ensure_indexes()
+    start = time.perf_counter()
+    result = gateway.bulk_save(documents)
+    print(f"bulk_save ingest: {time.perf_counter() - start:.2f}s {result}")
+    start = time.perf_counter()
+    result = gateway.bulk_save(documents)
+    print(f"bulk_save re-ingest: {time.perf_counter() - start:.2f}s {result}")
+    print(
+        f"lookup with unique index: {time_lookups(gateway, args.num_documents, args.num_lookups):.3f}ms"
+    )
+    collection.drop()
+
+
+if __name__ == "__main__":
+    main()
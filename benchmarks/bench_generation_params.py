@@ -0,0 +1,69 @@
+"""
+Reports generated tokens and latency per story of an LLM backend with the generation parameters of the story
+generator: without limits, with `--max-new-tokens`, with `--stop` sequences and with streaming that stops reading after
+the title and two sentences. Tokens are approximated with words, see `count_tokens`.
+
+The stub backend keeps writing `--continuation-paragraphs` paragraphs after the story like a chatty model and takes
+`--token-latency` seconds per token. Run from the repository root:
+    python -m benchmarks.bench_generation_params --num-stories 20
+    STORY_LLM_MODEL=sshleifer/tiny-gpt2 python -m benchmarks.bench_generation_params --backend transformers
+
+"""
+import argparse
+import os
+import time
+from unittest.mock import patch
+
+from benchmarks.bench_story_backends import synthetic_activities
+from src.generators import AIStoryGenerator
+from src.llm_backends import LLM_BACKENDS, build_llm, count_tokens
+from src.story_parser import parse_story
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", choices=sorted(LLM_BACKENDS), default="stub")
+    parser.add_argument("--num-stories", type=int, default=20)
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--stop", default='["\\n\\nThe next day"]')
+    parser.add_argument("--token-latency", type=float, default=0.005)
+    parser.add_argument("--continuation-paragraphs", type=int, default=5)
+    args = parser.parse_args()
+
+    stub_env = {
+        "STORY_LLM_STUB_TOKEN_LATENCY": str(args.token_latency),
+        "STORY_LLM_STUB_CONTINUATION_PARAGRAPHS": str(args.continuation_paragraphs),
+    }
+    # large enough to never cut the output
+    unlimited = {"STORY_LLM_MAX_NEW_TOKENS": "4096"}
+    settings = (
+        ("baseline", unlimited),
+        ("max_new_tokens", {"STORY_LLM_MAX_NEW_TOKENS": str(args.max_new_tokens)}),
+        ("stop", {**unlimited, "STORY_LLM_STOP": args.stop}),
+        ("stream", {**unlimited, "STORY_LLM_STREAM": "true"}),
+    )
+    activities = synthetic_activities(args.num_stories)
+
+    print(
+        f"{'setting':>15} {'stories':>8} {'parsed':>7} {'tokens/story':>13} {'ms/story':>9}"
+    )
+    for name, env in settings:
+        with patch.dict(os.environ, {**stub_env, **env}):
+            story_generator = AIStoryGenerator(llm=build_llm(args.backend))
+            tokens = parsed = 0
+            start = time.perf_counter()
+            for activity in activities:
+                text = story_generator._complete(
+                    story_generator._render_metrics(activity)
+                )
+                tokens += count_tokens(text)
+                parsed += parse_story(text).confidence >= 0.5
+            elapsed = time.perf_counter() - start
+        print(
+            f"{name:>15} {len(activities):>8} {parsed:>7} "
+            f"{tokens / len(activities):>13.1f} {elapsed / len(activities) * 1000:>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Measures story throughput of CPU-bound generation, like local model inference, in the API process and in a
+`GenerationPool`. In the API process concurrent requests share the GIL, the pool runs one generator per core.
+
+Run from the repository root:
+    python -m benchmarks.bench_generation_pool --num-stories 64 --workers 4 --cpu-ms 50
+
+"""
+import argparse
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src.generation_pool import GenerationPool
+from src.generators import AIGenerator, Story
+
+
+class CpuBoundStoryGenerator(AIGenerator):
+    def __init__(self, cpu_ms: float):
+        self._cpu_seconds = cpu_ms / 1000
+
+    def generate(self, activity: dict) -> Story:
+        deadline = time.thread_time() + self._cpu_seconds
+        while time.thread_time() < deadline:
+            pass
+        return Story(story_title="A CPU Story", story_content="Busy.")
+
+    def cache_params(self) -> dict:
+        return {"llm": "cpu"}
+
+
+def stories_per_second(generator, num_stories: int, concurrency: int) -> float:
+    activities = [{"activity_id": idx, "speed": 1.0} for idx in range(num_stories)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(generator.generate, activities))
+    return num_stories / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-stories", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--cpu-ms", type=float, default=50.0)
+    args = parser.parse_args()
+
+    in_process = stories_per_second(
+        CpuBoundStoryGenerator(args.cpu_ms), args.num_stories, args.workers
+    )
+    print(f"{'in process':>12} {in_process:>8.1f} stories/s")
+
+    pool = GenerationPool(
+        num_workers=args.workers,
+        max_queue_size=args.num_stories,
+        generator_factory=functools.partial(CpuBoundStoryGenerator, args.cpu_ms),
+    )
+    # every worker builds its generator before the measurement
+    while pool.health()["ready_workers"] < args.workers:
+        time.sleep(0.05)
+    pooled = stories_per_second(pool, args.num_stories, args.workers)
+    pool.close()
+    print(
+        f"{'pool':>12} {pooled:>8.1f} stories/s ({pooled / in_process:.1f}x, {args.workers} workers)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Compares per-request latency of fetching activities with a new connection per request and with a pooled keep-alive
+session, against a local TLS Strava stub. 100 requests are made sequentially and then 100 concurrently.
+
+Run from the repository root (needs the openssl command line tool for the self-signed certificate):
+    python -m benchmarks.bench_http_session
+
+"""
+import math
+import os
+import statistics
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks.strava_stub import StravaStubServer
+from src.http_session import PooledSession
+from src.strava_client import StravaClient
+from src.token_manager import StravaTokenManager
+
+NUM_REQUESTS = 100
+CONCURRENCY = 10
+
+
+def create_certificate(directory: str) -> tuple[str, str]:
+    certfile = os.path.join(directory, "cert.pem")
+    keyfile = os.path.join(directory, "key.pem")
+    subprocess.run(
+        [
+            "openssl",
+            "req",
+            "-x509",
+            "-newkey",
+            "rsa:2048",
+            "-nodes",
+            "-days",
+            "1",
+            "-subj",
+            "/CN=127.0.0.1",
+            "-addext",
+            "subjectAltName=IP:127.0.0.1",
+            "-keyout",
+            keyfile,
+            "-out",
+            certfile,
+        ],
+        check=True,
+        capture_output=True,
+    )
+    return certfile, keyfile
+
+
+def timed_get_activity(client: StravaClient, activity_id: int) -> float:
+    start = time.perf_counter()
+    client.get_activity(activity_id)
+    return (time.perf_counter() - start) * 1000
+
+
+def run(client: StravaClient, concurrent: bool) -> list[float]:
+    activity_ids = range(1, NUM_REQUESTS + 1)
+    if not concurrent:
+        return [timed_get_activity(client, i) for i in activity_ids]
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as executor:
+        return list(executor.map(lambda i: timed_get_activity(client, i), activity_ids))
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        certfile, keyfile = create_certificate(directory)
+        # both module level requests functions and sessions trust the stub certificate through this variable
+        os.environ["REQUESTS_CA_BUNDLE"] = certfile
+        print(
+            f"{'mode':>11} {'session':>10} {'connections':>12} {'mean_ms':>8} {'p50_ms':>7} {'p95_ms':>7} "
+            f"{'total_ms':>9}"
+        )
+        for concurrent in (False, True):
+            for name, session in (
+                ("per-call", requests),
+                ("pooled", PooledSession(pool_size=CONCURRENCY)),
+            ):
+                with StravaStubServer(
+                    NUM_REQUESTS, certfile=certfile, keyfile=keyfile
+                ) as stub:
+                    client = StravaClient(
+                        stub.activity_uri,
+                        stub.athlete_activities_uri,
+                        token_manager=StravaTokenManager(
+                            access_token="stub", expires_at=math.inf
+                        ),
+                        session=session,
+                    )
+                    start = time.perf_counter()
+                    latencies = run(client, concurrent)
+                    total = (time.perf_counter() - start) * 1000
+                    p95 = statistics.quantiles(latencies, n=100)[94]
+                    print(
+                        f"{'concurrent' if concurrent else 'sequential':>11} {name:>10} "
+                        f"{stub.connection_count:>12} {statistics.mean(latencies):>8.2f} "
+                        f"{statistics.median(latencies):>7.2f} {p95:>7.2f} {total:>9.1f}"
+                    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Measures the overhead of the metrics instrumentation: cost per call of `Counter.inc`, `Histogram.observe`, a `timed`
+block and a `timed` decorated function against a bare call, and the share of it in the fastest instrumented
+operation, a gateway lookup on mongomock.
+
+Run from the repository root:
+    python -m benchmarks.bench_metrics --repeat 200000
+
+"""
+import argparse
+import time
+
+from benchmarks.bench_gateway import build_gateway
+from src.metrics import MetricsRegistry, timed
+
+
+def per_call_us(func, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=200_000)
+    args = parser.parse_args()
+
+    registry = MetricsRegistry()
+    counter = registry.counter("calls_total", "Calls", ("status_code",))
+    histogram = registry.histogram("stage_seconds", "Stages", ("stage",))
+
+    def bare():
+        return None
+
+    @timed(histogram, stage="decorated")
+    def decorated():
+        return None
+
+    def block():
+        with timed(histogram, stage="block"):
+            return None
+
+    baseline = per_call_us(bare, args.repeat)
+    print(f"{'operation':>20} {'us/call':>8} {'overhead_us':>12}")
+    for name, func in (
+        ("bare call", bare),
+        ("Counter.inc", lambda: counter.inc(status_code=200)),
+        ("Histogram.observe", lambda: histogram.observe(0.01, stage="observe")),
+        ("timed block", block),
+        ("timed decorator", decorated),
+    ):
+        cost = per_call_us(func, args.repeat)
+        print(f"{name:>20} {cost:>8.3f} {cost - baseline:>12.3f}")
+
+    gateway = build_gateway(None, batch_size=1000)
+    gateway.save_one({"activity_id": 1, "speed": 1.0})
+    lookups = args.repeat // 100
+    # gateway.get is decorated, the undecorated function is kept by functools.wraps
+    undecorated_get = type(gateway).get.__wrapped__
+    plain = per_call_us(lambda: undecorated_get(gateway, 1), lookups)
+    instrumented = per_call_us(lambda: gateway.get(1), lookups)
+    print(
+        f"gateway.get on mongomock: {plain:.1f} us plain, {instrumented:.1f} us instrumented "
+        f"({(instrumented - plain) / plain:+.1%})"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Measures listing time of processed activities with and without the processed activities partial index, and with a
+projection of the list view fields.
+
+Run from the repository root against a local mongod (mongomock ignores indexes, numbers are only indicative there):
+    python -m benchmarks.bench_processed_query --uri mongodb://localhost:27017 --num-documents 1000000
+
+"""
+import argparse
+import time
+
+from benchmarks.bench_gateway import build_gateway
+from src.gateway import _processed_activities_filter
+
+
+def time_query(fn, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) * 1000 / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--uri", default=None)
+    parser.add_argument("--num-documents", type=int, default=100_000)
+    parser.add_argument("--processed-ratio", type=float, default=0.1)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    gateway = build_gateway(args.uri, batch_size=10_000)
+    collection = gateway._collection
+    collection.drop()
+    every = max(1, int(1 / args.processed_ratio))
+    documents = [
+        {"activity_id": idx, "speed": 5.0, "distance": 1000.0, "time": 600}
+        | (
+            {"story_title": f"Title {idx}", "story_content": "content " * 20}
+            if idx % every == 0
+            else {}
+        )
+        for idx in range(args.num_documents)
+    ]
+    collection.insert_many(documents)
+
+    queries = {
+        "full page": lambda: gateway.get_processed_activities(limit=args.limit),
+        "projected page": lambda: gateway.get_processed_activities(
+            limit=args.limit, fields=["activity_id", "story_title"]
+        ),
+        "count all": lambda: len(
+            gateway.get_processed_activities(fields=["activity_id", "story_title"])
+        ),
+    }
+    collection.drop_indexes()
+    for name, query in queries.items():
+        print(f"without index, {name}: {time_query(query, args.repeat):.2f}ms")
+    gateway._ensure_indexes()
+    for name, query in queries.items():
+        print(f"with index, {name}: {time_query(query, args.repeat):.2f}ms")
+    if args.uri:
+        plan = collection.find(
+            _processed_activities_filter(),
+            {"_id": 0, "activity_id": 1, "story_title": 1},
+            sort=[("activity_id", 1)],
+        ).explain()["queryPlanner"]["winningPlan"]
+        print(f"winning plan: {plan}")
+    collection.drop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Measures the per-row cost of serializing processed activities into a GET /activities/processed/ response body:
+- models: a `ProcessedActivity` per row, validated and serialized again by the `list[ProcessedActivity]` response
+  model and rendered by `JSONResponse`, as the route did before
+- json: rows as read from MongoDB rendered by `JSONResponse`
+- orjson: rows as read from MongoDB rendered by `ORJSONResponse`, as the route does now
+
+Run from the repository root:
+    python -m benchmarks.bench_serialization --num-rows 10000 100000 --repeat 3
+
+"""
+import argparse
+import asyncio
+import time
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import APIRoute, serialize_response
+
+from app.data_models import ProcessedActivity
+from app.main import app
+
+
+def rows(num_rows: int) -> list[dict]:
+    return [
+        {
+            "activity_id": idx,
+            "speed": 5.0 + idx % 7,
+            "distance": 1000.0 + idx,
+            "elevation": 10.5,
+            "time": 600.0,
+            "story_title": f"Morning run number {idx}",
+            "story_content": "A steady run along the river with a strong finish. " * 4,
+        }
+        for idx in range(num_rows)
+    ]
+
+
+def models_body(activities: list[dict]) -> bytes:
+    route = next(
+        route
+        for route in app.routes
+        if isinstance(route, APIRoute) and route.path == "/activities/processed/"
+    )
+    content = [ProcessedActivity(**activity) for activity in activities]
+    # same steps FastAPI runs for a route returning models through a response model
+    content = asyncio.run(
+        serialize_response(field=route.response_field, response_content=content)
+    )
+    return JSONResponse(content).body
+
+
+def json_body(activities: list[dict]) -> bytes:
+    return JSONResponse(activities).body
+
+
+def orjson_body(activities: list[dict]) -> bytes:
+    return ORJSONResponse(activities).body
+
+
+def best_seconds(func, activities: list[dict], repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(activities)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-rows", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'rows':>8} {'path':>8} {'total_ms':>10} {'us/row':>8} {'speedup':>8}")
+    for num_rows in args.num_rows:
+        activities = rows(num_rows)
+        baseline = None
+        for name, func in (
+            ("models", models_body),
+            ("json", json_body),
+            ("orjson", orjson_body),
+        ):
+            seconds = best_seconds(func, activities, args.repeat)
+            baseline = baseline or seconds
+            print(
+                f"{num_rows:>8} {name:>8} {seconds * 1000:>10.1f} "
+                f"{seconds / num_rows * 1e6:>8.2f} {baseline / seconds:>7.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
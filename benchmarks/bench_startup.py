@@ -0,0 +1,119 @@
+"""
+Measures cold start of the API in fresh interpreters: time to import `app.main` and time from process start to the
+first 200 response, with a single worker and with pre-forked workers started by `app.serve` with and without
+`--preload`. Runs offline, the stub LLM backend is used and no MongoDB or Strava is needed. Results are written as
+JSON to `--output` to be tracked across revisions.
+
+Run from the repository root:
+    python -m benchmarks.bench_startup --repeat 5 --output startup.json
+
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import requests
+
+IMPORT_APP = (
+    "import time; start = time.perf_counter(); import app.main; "
+    "print(time.perf_counter() - start)"
+)
+
+
+def import_seconds(env: dict) -> float:
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_APP],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def first_200_seconds(command: list[str], port: int, path: str, env: dict) -> float:
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while True:
+            try:
+                response = requests.get(
+                    f"http://127.0.0.1:{port}{path}",
+                    timeout=1,
+                )
+                if response.status_code == 200:
+                    return time.perf_counter() - start
+            except requests.ConnectionError:
+                pass
+            if process.poll() is not None:
+                raise RuntimeError(f"{' '.join(command)} exited before serving")
+            time.sleep(0.01)
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--port", type=int, default=8767)
+    # preloading only pays off for the first request that needs the story generator
+    parser.add_argument("--path", default="/activities/story-cache/stats/")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    env = {**os.environ, "STORY_LLM_BACKEND": "stub"}
+    serve = [sys.executable, "-m", "app.serve", "--port", str(args.port)]
+    scenarios = {
+        "import app.main": lambda: import_seconds(env),
+        "first 200, uvicorn": lambda: first_200_seconds(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(args.port)],
+            args.port,
+            args.path,
+            env,
+        ),
+        f"first 200, {args.workers} workers": lambda: first_200_seconds(
+            serve + ["--workers", str(args.workers)], args.port, args.path, env
+        ),
+        f"first 200, {args.workers} workers preloaded": lambda: first_200_seconds(
+            serve + ["--workers", str(args.workers), "--preload"],
+            args.port,
+            args.path,
+            env,
+        ),
+    }
+
+    results = {}
+    print(f"{'scenario':>36} {'median_s':>9} {'max_s':>7}")
+    for name, measure in scenarios.items():
+        samples = [measure() for _ in range(args.repeat)]
+        results[name] = {
+            "median_s": round(statistics.median(samples), 3),
+            "max_s": round(max(samples), 3),
+        }
+        print(f"{name:>36} {results[name]['median_s']:>9} {results[name]['max_s']:>7}")
+
+    if args.output:
+        revision = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True
+        ).stdout.strip()
+        report = {
+            "revision": revision or "unknown",
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "config": vars(args),
+            "results": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Reports story generation throughput of an LLM backend, generating the stories one by one and in a single batch, and
+how many of the generated stories were parsed with confidence. Model loading is reported separately, it happens once per process.
+
+Run from the repository root, e.g. with a tiny local model on CPU (needs `transformers` and `torch`):
+    STORY_LLM_MODEL=sshleifer/tiny-gpt2 python -m benchmarks.bench_story_backends --backend transformers
+
+"""
+import argparse
+import time
+
+from src.generators import AIStoryGenerator
+from src.llm_backends import LLM_BACKENDS, build_llm
+from src.story_parser import parse_story
+
+
+def synthetic_activities(num_stories: int) -> list[dict]:
+    return [
+        {
+            "activity_id": idx,
+            "speed": 5.0 + idx % 10,
+            "distance": 1000.0 + idx,
+            "time": 600 + idx,
+            "elevation": float(idx % 500),
+        }
+        for idx in range(num_stories)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", choices=sorted(LLM_BACKENDS), default="stub")
+    parser.add_argument("--num-stories", type=int, default=32)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    story_generator = AIStoryGenerator(llm=build_llm(args.backend))
+    print(f"model loaded in {time.perf_counter() - start:.2f}s")
+
+    prompts = [
+        {"metrics": story_generator._render_metrics(activity)}
+        for activity in synthetic_activities(args.num_stories)
+    ]
+    chain = story_generator._story_llm_chain
+    print(
+        f"{'strategy':>10} {'stories':>8} {'parsed':>7} {'elapsed_s':>10} {'stories/s':>10}"
+    )
+    for name, generate in (
+        ("one-by-one", lambda: [chain.run(prompt["metrics"]) for prompt in prompts]),
+        ("batched", lambda: [result["text"] for result in chain.apply(prompts)]),
+    ):
+        start = time.perf_counter()
+        texts = generate()
+        elapsed = time.perf_counter() - start
+        print(
+            f"{name:>10} {len(texts):>8} {sum(map(_parses, texts)):>7} {elapsed:>10.2f} "
+            f"{len(texts) / elapsed:>10.2f}"
+        )
+
+
+def _parses(text: str) -> bool:
+    # small local models do not always follow the prompt format
+    return parse_story(text).confidence >= 0.5
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Compares the previous split-and-sort story parser with `parse_story` on the corpus of recorded LLM outputs in
+benchmarks/data/llm_outputs.json: parse time, outputs that could not be parsed and outputs that would be generated
+again because of low confidence.
+
+Run from the repository root:
+    python -m benchmarks.bench_story_parser --repeat 10000
+
+"""
+import argparse
+import json
+import time
+
+from src.story_parser import parse_story
+
+
+def split_and_sort(story: str) -> tuple[str, str]:
+    # previous parser: fails when the model omits the "Title: " prefix
+    title = story.split("Title: ")[1].split("\n")[0]
+    content = sorted(story.split("\n\n"), key=lambda x: len(x), reverse=True)[0]
+    return title, content
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=10_000)
+    parser.add_argument("--min-confidence", type=float, default=0.5)
+    args = parser.parse_args()
+
+    with open("benchmarks/data/llm_outputs.json") as f:
+        outputs = json.load(f)
+
+    failed = 0
+    for output in outputs:
+        try:
+            split_and_sort(output)
+        except IndexError:
+            failed += 1
+    low_confidence = sum(
+        parse_story(output).confidence < args.min_confidence for output in outputs
+    )
+
+    print(
+        f"{'parser':>15} {'outputs':>8} {'failed':>7} {'regenerated':>12} {'us/parse':>9}"
+    )
+    # every failure of the previous parser meant generating the story again
+    for name, parse, failures, regenerated in (
+        ("split-and-sort", split_and_sort, failed, failed),
+        ("parse_story", parse_story, 0, low_confidence),
+    ):
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for output in outputs:
+                try:
+                    parse(output)
+                except IndexError:
+                    pass
+        elapsed = time.perf_counter() - start
+        per_parse = elapsed / (args.repeat * len(outputs)) * 1e6
+        print(
+            f"{name:>15} {len(outputs):>8} {failures:>7} "
+            f"{regenerated:>12} {per_parse:>9.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Compares fetching activity details one by one with the concurrent fan-out of `StravaClient.get_activities` against a
+local Strava stub that delays every response to simulate the round trip to Strava API.
+
+Run from the repository root:
+    python -m benchmarks.bench_strava_fanout --num-activities 500 --latency-ms 100
+
+"""
+import argparse
+import math
+import time
+
+from benchmarks.strava_stub import StravaStubServer
+from src.http_session import PooledSession
+from src.rate_limiter import StravaRateLimiter
+from src.strava_client import StravaClient
+from src.token_manager import StravaTokenManager
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-activities", type=int, default=500)
+    parser.add_argument("--latency-ms", type=float, default=100)
+    args = parser.parse_args()
+
+    activity_ids = list(range(1, args.num_activities + 1))
+    print(f"{'strategy':>14} {'requests':>9} {'errors':>7} {'elapsed_s':>10}")
+    for name, concurrency in (
+        ("sequential", 1),
+        ("fan-out x10", 10),
+        ("fan-out x20", 20),
+    ):
+        with StravaStubServer(
+            args.num_activities, latency_seconds=args.latency_ms / 1000
+        ) as stub:
+            client = StravaClient(
+                stub.activity_uri,
+                stub.athlete_activities_uri,
+                rate_limiter=StravaRateLimiter(
+                    short_limit=10**6, daily_limit=10**7
+                ),
+                token_manager=StravaTokenManager(
+                    access_token="stub", expires_at=math.inf
+                ),
+                session=PooledSession(pool_size=concurrency),
+            )
+            start = time.perf_counter()
+            if concurrency == 1:
+                results = [client.get_activity(i) for i in activity_ids]
+            else:
+                results = client.get_activities(activity_ids, concurrency=concurrency)
+            elapsed = time.perf_counter() - start
+            errors = sum(isinstance(result, Exception) for result in results)
+            print(f"{name:>14} {stub.request_count:>9} {errors:>7} {elapsed:>10.2f}")
+            client.close()
+
+
+if __name__ == "__main__":
+    main()
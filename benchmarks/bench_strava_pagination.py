@@ -0,0 +1,59 @@
+"""
+Compares request count and latency of fetching the 3 most recent activities for histories of different sizes.
+
+Run from the repository root:
+    python -m benchmarks.bench_strava_pagination
+
+"""
+import math
+import time
+
+import requests
+
+from benchmarks.strava_stub import StravaStubServer
+from src.strava_client import StravaClient
+from src.token_manager import StravaTokenManager
+
+
+def fetch_full_history(client: StravaClient, num_recent_activities: int) -> list[dict]:
+    # previous behaviour: read every page until an empty one, then slice
+    activities = []
+    page_number = 1
+    while True:
+        response = requests.get(
+            f"{client._athlete_activities_uri}?page={page_number}&per_page=30"
+        )
+        data = response.json()
+        if len(data) == 0:
+            break
+        activities.extend(data)
+        page_number += 1
+    return [client._parse_response(a) for a in activities[:num_recent_activities]]
+
+
+def main():
+    print(f"{'history':>8} {'strategy':>12} {'requests':>9} {'latency_ms':>11}")
+    for num_activities in (10, 1_000, 50_000):
+        with StravaStubServer(num_activities) as stub:
+            client = StravaClient(
+                stub.activity_uri,
+                stub.athlete_activities_uri,
+                token_manager=StravaTokenManager(
+                    access_token="stub", expires_at=math.inf
+                ),
+            )
+            for name, fetch in (
+                ("full", lambda: fetch_full_history(client, 3)),
+                ("stop-early", lambda: client.get_most_recent_activities(3)),
+            ):
+                stub.request_count = 0
+                start = time.perf_counter()
+                fetch()
+                elapsed = (time.perf_counter() - start) * 1000
+                print(
+                    f"{num_activities:>8} {name:>12} {stub.request_count:>9} {elapsed:>11.1f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""
+Load test of the sync API without HuggingFace, Strava or MongoDB. The app runs in-process on uvicorn with:
+    - a Strava stub server serving `--num-activities` synthetic activities
+    - the stub LLM backend with `--llm-latency` seconds latency and `--llm-error-rate` failures
+    - mongomock, or the MongoDB at `--mongo-uri`
+
+POST /activities/, PUT /activities/{activity_id}/ and GET /activities/processed/ are fired with `--concurrency`
+requests in flight. p50/p95/p99 latencies, RPS and errors per endpoint are printed and written as JSON to `--output`,
+a previous result passed as `--baseline` is compared against.
+
+Run from the repository root:
+    python -m benchmarks.load_test_api --requests 300 --concurrency 20 --output results.json
+    python -m benchmarks.load_test_api --requests 300 --concurrency 20 --baseline results.json
+
+"""
+import argparse
+import asyncio
+import json
+import math
+import platform
+import subprocess
+import threading
+import time
+from datetime import datetime, timezone
+
+import httpx
+import uvicorn
+
+from app.dependencies import (
+    get_async_gateway,
+    get_gateway,
+    get_story_cache,
+    get_story_generator,
+    get_strava_client,
+    get_strava_client_pool,
+)
+from app.main import app
+from benchmarks.bench_gateway import build_gateway
+from benchmarks.load_test_async import InMemoryAsyncGateway
+from benchmarks.strava_stub import StravaStubServer
+from src.cache import StoryCache
+from src.generators import AIStoryGenerator
+from src.llm_backends import StubLLM
+from src.rate_limiter import StravaRateLimiter
+from src.strava_client import StravaClient, StravaClientPool
+from src.token_manager import StravaTokenManager
+
+
+def percentile(sorted_values: list[float], percent: float) -> float:
+    # nearest-rank percentile
+    rank = max(math.ceil(percent / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def summarize(samples: list[tuple[float, bool]], elapsed: float) -> dict:
+    latencies = sorted(latency for latency, _ in samples)
+    if not latencies:
+        return {"requests": 0}
+    return {
+        "requests": len(samples),
+        "errors": sum(not ok for _, ok in samples),
+        "rps": round(len(samples) / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+async def run_scenario(
+    base_uri: str, num_requests: int, concurrency: int, num_activities: int
+) -> dict:
+    # every 10 requests: 1 POST, 3 PUTs and 6 GETs
+    def request(idx: int) -> tuple[str, str, str]:
+        kind = idx % 10
+        if kind == 0:
+            return "POST /activities/", "POST", "/activities/"
+        if kind <= 3:
+            activity_id = idx % num_activities + 1
+            return "PUT /activities/{id}/", "PUT", f"/activities/{activity_id}/"
+        return "GET /activities/processed/", "GET", "/activities/processed/?limit=50"
+
+    samples: dict[str, list[tuple[float, bool]]] = {}
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(
+        base_url=base_uri, limits=limits, timeout=60
+    ) as client:
+
+        async def fire(idx: int) -> None:
+            name, method, path = request(idx)
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    response = await client.request(method, path)
+                    status_code = response.status_code
+                except httpx.TransportError:
+                    # server drops the connection of some unhandled errors
+                    status_code = None
+                latency = time.perf_counter() - start
+            # an empty processed activities list is a valid answer while the first stories are generated
+            ok = status_code is not None and (
+                status_code < 400 or (method == "GET" and status_code == 404)
+            )
+            samples.setdefault(name, []).append((latency, ok))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(fire(idx) for idx in range(num_requests)))
+        elapsed = time.perf_counter() - start
+
+    results = {name: summarize(values, elapsed) for name, values in samples.items()}
+    results["total"] = summarize(
+        [sample for values in samples.values() for sample in values], elapsed
+    )
+    return results
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_results(results: dict, baseline: dict = None) -> None:
+    print(
+        f"{'endpoint':>28} {'requests':>9} {'errors':>7} {'rps':>8} {'p50_ms':>8} {'p95_ms':>8} {'p99_ms':>8}"
+    )
+    for name, stats in results.items():
+        print(
+            f"{name:>28} {stats['requests']:>9} {stats['errors']:>7} {stats['rps']:>8} "
+            f"{stats['p50_ms']:>8} {stats['p95_ms']:>8} {stats['p99_ms']:>8}"
+        )
+        previous = (baseline or {}).get(name)
+        if previous:
+            changes = " ".join(
+                f"{key} {(stats[key] - previous[key]) / previous[key]:+.1%}"
+                for key in ("rps", "p50_ms", "p95_ms", "p99_ms")
+                if previous.get(key)
+            )
+            print(f"{'vs baseline':>28} {changes}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--num-activities", type=int, default=1000)
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mongo-uri", default=None)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--baseline", default=None)
+    args = parser.parse_args()
+
+    with StravaStubServer(args.num_activities) as stub:
+        gateway = build_gateway(args.mongo_uri, batch_size=1000)
+        story_cache = StoryCache(max_size=0)
+        strava_client = StravaClient(
+            stub.activity_uri,
+            stub.athlete_activities_uri,
+            stub.athlete_uri,
+            rate_limiter=StravaRateLimiter(short_limit=10**6, daily_limit=10**7),
+            token_manager=StravaTokenManager(access_token="stub", expires_at=math.inf),
+        )
+        story_generator = AIStoryGenerator(
+            llm=StubLLM(
+                latency_seconds=args.llm_latency,
+                error_rate=args.llm_error_rate,
+                seed=args.seed,
+            )
+        )
+        strava_client_pool = StravaClientPool(gateway)
+        app.dependency_overrides[get_gateway] = lambda: gateway
+        app.dependency_overrides[get_story_cache] = lambda: story_cache
+        app.dependency_overrides[get_strava_client] = lambda: strava_client
+        app.dependency_overrides[get_strava_client_pool] = lambda: strava_client_pool
+        app.dependency_overrides[get_story_generator] = lambda: story_generator
+        app.dependency_overrides[get_async_gateway] = lambda: InMemoryAsyncGateway(0)
+
+        server = uvicorn.Server(
+            uvicorn.Config(app, port=args.port, log_level="warning", workers=1)
+        )
+        thread = threading.Thread(target=server.run, daemon=True)
+        thread.start()
+        while not server.started:
+            time.sleep(0.05)
+        try:
+            results = asyncio.run(
+                run_scenario(
+                    f"http://127.0.0.1:{args.port}",
+                    args.requests,
+                    args.concurrency,
+                    args.num_activities,
+                )
+            )
+        finally:
+            server.should_exit = True
+            thread.join()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+    print_results(results, baseline)
+
+    if args.output:
+        report = {
+            "revision": git_revision(),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "config": vars(args),
+            "results": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
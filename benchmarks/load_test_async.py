@@ -0,0 +1,182 @@
+"""
+Load test of the async PUT /async/activities/{activity_id}/ route with the real `AIStoryGenerator` on top of a
+`StubLLM` that takes `--llm-latency` seconds per story. Runs a single uvicorn worker in-process and fires
+`--concurrency` concurrent PUTs.
+
+With `--llm async` (default) the stub sleeps on the event loop through its `_acall`, like an LLM with an async client.
+With `--llm executor` the stub has no `_acall`, like HuggingFaceHub, so LangChain runs its blocking `_call` in the
+default executor of the loop. The report shows the peak number of LLM calls in flight against the size of that
+executor; when the peak equals the executor size, the executor is saturated and the remaining stories queue for a
+thread.
+
+Run from the repository root:
+    python -m benchmarks.load_test_async --concurrency 200
+    python -m benchmarks.load_test_async --concurrency 200 --llm executor
+
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import threading
+import time
+
+import httpx
+import uvicorn
+from langchain_core.language_models.llms import LLM
+
+from app.dependencies import (
+    get_async_gateway,
+    get_async_story_cache,
+    get_story_generator,
+    get_strava_client_pool,
+)
+from app.main import app
+from src.cache import StoryCache
+from src.gateway import NoResultFound
+from src.generators import AIStoryGenerator
+from src.llm_backends import StubLLM
+
+
+class InFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._count = 0
+        self.peak = 0
+        self.threads = set()
+
+    def __enter__(self):
+        with self._lock:
+            self._count += 1
+            self.peak = max(self.peak, self._count)
+            self.threads.add(threading.get_ident())
+
+    def __exit__(self, *exc_info):
+        with self._lock:
+            self._count -= 1
+
+
+IN_FLIGHT = InFlight()
+
+
+class AsyncStubLLM(StubLLM):
+    async def _acall(self, *args, **kwargs) -> str:
+        with IN_FLIGHT:
+            return await super()._acall(*args, **kwargs)
+
+
+class ExecutorStubLLM(StubLLM):
+    def _call(self, *args, **kwargs) -> str:
+        with IN_FLIGHT:
+            return super()._call(*args, **kwargs)
+
+    # LangChain runs `_call` in the default executor, see HuggingFaceHub
+    _acall = LLM._acall
+
+
+LLMS = {"async": AsyncStubLLM, "executor": ExecutorStubLLM}
+
+
+class InMemoryAsyncGateway:
+    def __init__(self, num_activities: int):
+        self._documents = {
+            idx: {
+                "activity_id": idx,
+                "speed": 5.0,
+                "distance": 1000.0,
+                "time": 600,
+                "elevation": 10.0,
+            }
+            for idx in range(num_activities)
+        }
+
+    async def ensure_indexes(self):
+        pass
+
+    def close(self):
+        pass
+
+    async def get(self, document_id: int, athlete_id=None) -> dict:
+        if document_id not in self._documents:
+            raise NoResultFound(f"Activity {document_id} not found")
+        return self._documents[document_id].copy()
+
+    async def update(self, document: dict, update_dict: dict) -> dict:
+        self._documents[document["activity_id"]].update(update_dict)
+        document.update(update_dict)
+        return document
+
+
+async def fire(base_uri: str, concurrency: int) -> list[float]:
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(
+        base_url=base_uri, limits=limits, timeout=600
+    ) as client:
+
+        async def put(activity_id: int) -> float:
+            start = time.perf_counter()
+            response = await client.put(f"/async/activities/{activity_id}/")
+            response.raise_for_status()
+            return time.perf_counter() - start
+
+        return await asyncio.gather(*(put(idx) for idx in range(concurrency)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--llm-latency", type=float, default=2.0)
+    parser.add_argument("--llm", choices=sorted(LLMS), default="async")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    gateway = InMemoryAsyncGateway(args.concurrency)
+    story_generator = AIStoryGenerator(
+        llm=LLMS[args.llm](latency_seconds=args.llm_latency)
+    )
+    app.dependency_overrides[get_async_gateway] = lambda: gateway
+    app.dependency_overrides[get_story_generator] = lambda: story_generator
+    app.dependency_overrides[get_async_story_cache] = lambda: StoryCache(max_size=0)
+    # every activity is in the gateway, no athlete client is ever needed
+    app.dependency_overrides[get_strava_client_pool] = lambda: None
+
+    server = uvicorn.Server(
+        uvicorn.Config(app, port=args.port, log_level="warning", workers=1)
+    )
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+
+    start = time.perf_counter()
+    latencies = asyncio.run(fire(f"http://127.0.0.1:{args.port}", args.concurrency))
+    elapsed = time.perf_counter() - start
+    server.should_exit = True
+    thread.join()
+
+    # size of the default executor of asyncio, see `concurrent.futures.ThreadPoolExecutor`
+    executor_size = min(32, (os.cpu_count() or 1) + 4)
+    latencies = sorted(latencies)
+    print(
+        f"requests: {args.concurrency}, llm: {args.llm}, llm latency: {args.llm_latency}s"
+    )
+    print(
+        f"wall time: {elapsed:.2f}s, throughput: {args.concurrency / elapsed:.1f} req/s"
+    )
+    print(
+        f"p50: {statistics.median(latencies):.2f}s, "
+        f"p99: {latencies[int(len(latencies) * 0.99) - 1]:.2f}s"
+    )
+    print(
+        f"peak llm calls in flight: {IN_FLIGHT.peak} on {len(IN_FLIGHT.threads)} threads, "
+        f"default executor size: {executor_size}"
+        + (
+            " (saturated)"
+            if args.llm == "executor" and IN_FLIGHT.peak >= executor_size
+            else ""
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
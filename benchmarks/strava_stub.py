@@ -0,0 +1,182 @@
+import json
+import re
+import ssl
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import urlparse, parse_qs
+
+
+def synthetic_activity(activity_id: int) -> dict:
+    """
+    Builds a raw Strava activity with the keys `StravaClient` parses plus some filler.
+
+    """
+    return {
+        "id": activity_id,
+        "name": f"Activity {activity_id}",
+        "max_speed": 5.0 + activity_id % 10,
+        "distance": 1000.0 + activity_id,
+        "moving_time": 600 + activity_id % 3600,
+        "total_elevation_gain": float(activity_id % 500),
+        "start_date": activity_id * 3600,
+        "description": "x" * 200,
+    }
+
+
+class StravaStubServer:
+    """
+    Local HTTP server that mimics the subset of Strava API used by `StravaClient`. Serves a synthetic history of
+    `num_activities` activities where activity ids also act as start timestamps (`start_date = id * 3600`).
+
+    Like Strava, it reports `X-RateLimit-Limit` and `X-RateLimit-Usage` headers and responds with 429 once more than
+    `short_limit` requests are made within a `window_seconds` window aligned to wall clock time.
+
+    Connections are kept alive between requests and counted in `connection_count`. With `certfile` and `keyfile` the
+    stub serves HTTPS, clients have to trust the certificate e.g. through `REQUESTS_CA_BUNDLE`. Every response is delayed
+    by `latency_seconds` to simulate the round trip to Strava API.
+
+    Usage
+    -----
+    with StravaStubServer(num_activities=1000) as stub:
+        client = StravaClient(stub.activity_uri, stub.athlete_activities_uri)
+
+    """
+
+    def __init__(
+        self,
+        num_activities: int,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        short_limit: int = 10**9,
+        window_seconds: float = 15 * 60,
+        certfile: Optional[str] = None,
+        keyfile: Optional[str] = None,
+        latency_seconds: float = 0.0,
+    ):
+        self.num_activities = num_activities
+        self.request_count = 0
+        self.connection_count = 0
+        self.latency_seconds = latency_seconds
+        self.throttled_count = 0
+        self.short_limit = short_limit
+        self.window_seconds = window_seconds
+        self._window = None
+        self._window_usage = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._scheme = "http"
+        if certfile is not None:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certfile, keyfile)
+            self._server.socket = context.wrap_socket(
+                self._server.socket, server_side=True
+            )
+            self._scheme = "https"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_uri(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"{self._scheme}://{host}:{port}"
+
+    @property
+    def activity_uri(self) -> str:
+        return f"{self.base_uri}/api/v3/activities/"
+
+    @property
+    def athlete_uri(self) -> str:
+        return f"{self.base_uri}/api/v3/athlete"
+
+    @property
+    def athlete_activities_uri(self) -> str:
+        return f"{self.base_uri}/api/v3/athlete/activities"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _count_request(self) -> bool:
+        # returns False when the request is rate limited
+        with self._lock:
+            self.request_count += 1
+            window = int(time.time() // self.window_seconds)
+            if window != self._window:
+                self._window = window
+                self._window_usage = 0
+            self._window_usage += 1
+            if self._window_usage > self.short_limit:
+                self.throttled_count += 1
+                return False
+            return True
+
+    def rate_limit_headers(self) -> dict:
+        with self._lock:
+            return {
+                "X-RateLimit-Limit": f"{self.short_limit},{self.short_limit * 100}",
+                "X-RateLimit-Usage": f"{self._window_usage},{self.request_count}",
+            }
+
+    def list_activities(self, query: dict) -> list[dict]:
+        page = int(query.get("page", ["1"])[0])
+        per_page = int(query.get("per_page", ["30"])[0])
+        ids = range(1, self.num_activities + 1)
+        if "after" in query:
+            after = int(query["after"][0])
+            ids = [i for i in ids if i * 3600 > after]
+        else:
+            ids = list(reversed(ids))
+        start = (page - 1) * per_page
+        return [synthetic_activity(i) for i in ids[start : start + per_page]]
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # HTTP/1.1 keeps the connection open for the next request
+            protocol_version = "HTTP/1.1"
+            # headers and body are written separately, Nagle's algorithm would delay the body of kept-alive responses
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                with stub._lock:
+                    stub.connection_count += 1
+
+            def do_GET(self):
+                # simulates the round trip to Strava API
+                time.sleep(stub.latency_seconds)
+                if not stub._count_request():
+                    self._send(429, {"message": "Rate Limit Exceeded"})
+                    return
+                parsed = urlparse(self.path)
+                query = parse_qs(parsed.query)
+                match = re.fullmatch(r"/api/v3/activities/(\d+)", parsed.path)
+                if parsed.path == "/api/v3/athlete/activities":
+                    self._send(200, stub.list_activities(query))
+                elif parsed.path == "/api/v3/athlete":
+                    self._send(200, {"id": 1})
+                elif match and 0 < int(match.group(1)) <= stub.num_activities:
+                    self._send(200, synthetic_activity(int(match.group(1))))
+                else:
+                    self._send(404, {"message": "Record Not Found"})
+
+            def _send(self, status: int, body):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for header, value in stub.rate_limit_headers().items():
+                    self.send_header(header, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,176 @@
+import asyncio
+from typing import Optional, Union
+
+from src.cache import StoryCache
+from src.gateway import ActivityConflict, AsyncMongoDBGateway, stamp_athlete
+from src.generators import AIStoryGenerator, Story
+from src.strava_client import AsyncStravaClient, ActivityNotFoundError
+
+
+class BatchStoryGenerator:
+    """
+    Generates stories of many activities at once. Activities are read from DB in a single query, the missing ones are
+    fetched from Strava, stories are generated with at most `concurrency` LLM calls in flight and every generation is
+    bounded by `timeout` seconds. Generated stories are written with a single bulk update. With `athlete_id` only the
+    activities of that athlete are read and updated, `strava_client` must be the client of that athlete.
+
+    """
+
+    def __init__(
+        self,
+        gateway: AsyncMongoDBGateway,
+        strava_client: AsyncStravaClient,
+        story_generator: AIStoryGenerator,
+        story_cache: Optional[StoryCache] = None,
+        concurrency: int = 4,
+        timeout: float = 60.0,
+        athlete_id: Optional[int] = None,
+    ):
+        self._gateway = gateway
+        self._strava_client = strava_client
+        self._story_generator = story_generator
+        self._story_cache = story_cache
+        self._concurrency = concurrency
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._timeout = timeout
+        self._athlete_id = athlete_id
+
+    async def generate(self, activity_ids: list[int]) -> list[dict]:
+        """
+        Generates stories of the given activities.
+
+        Parameters
+        ----------
+        activity_ids : list[int]
+            IDs of the activities, duplicates are ignored
+
+        Returns
+        -------
+        list[dict]
+            one result per activity in input order with `activity_id`, `status` (one of `generated`, `cached`,
+            `not_found`, `conflict`, `timeout`, `failed`) and `story_title`, `story_content` or `detail` keys
+
+        """
+        activity_ids = list(dict.fromkeys(activity_ids))
+        activities = await self._resolve_activities(activity_ids)
+        return await self._generate_stories(activity_ids, activities)
+
+    async def generate_unprocessed(self, limit: int = 100) -> list[dict]:
+        """
+        Generates stories of the activities in DB that do not have a story yet.
+
+        Parameters
+        ----------
+        limit : int
+            maximum number of activities processed in one batch
+
+        Returns
+        -------
+        list[dict]
+            one result per activity, see `generate`
+
+        """
+        unprocessed = await self._gateway.get_unprocessed_activities(
+            limit=limit, athlete_id=self._athlete_id
+        )
+        activities = {activity["activity_id"]: activity for activity in unprocessed}
+        return await self._generate_stories(list(activities), activities)
+
+    async def _resolve_activities(
+        self, activity_ids: list[int]
+    ) -> dict[int, Union[dict, Exception]]:
+        # activities that could not be fetched from Strava are mapped to their error, they fail on their own
+        activities = {
+            activity["activity_id"]: activity
+            for activity in await self._gateway.get_many(
+                activity_ids, athlete_id=self._athlete_id
+            )
+        }
+        missing_ids = [idx for idx in activity_ids if idx not in activities]
+        if self._athlete_id is not None and missing_ids:
+            # saved, but not for this athlete
+            for activity in await self._gateway.get_many(missing_ids):
+                activities[activity["activity_id"]] = ActivityConflict(
+                    f"Activity {activity['activity_id']} belongs to another athlete"
+                )
+            missing_ids = [idx for idx in missing_ids if idx not in activities]
+        results = await self._strava_client.get_activities(
+            missing_ids, concurrency=self._concurrency
+        )
+        fetched = [result for result in results if not isinstance(result, Exception)]
+        if fetched:
+            await self._gateway.bulk_save(stamp_athlete(fetched, self._athlete_id))
+        activities.update(zip(missing_ids, results))
+        return activities
+
+    async def _generate_stories(
+        self, activity_ids: list[int], activities: dict[int, dict]
+    ) -> list[dict]:
+        results = await asyncio.gather(
+            *(
+                self._generate_one(activity_id, activities[activity_id])
+                for activity_id in activity_ids
+            )
+        )
+        await self._gateway.bulk_update(
+            {
+                result["activity_id"]: {
+                    "story_title": result["story_title"],
+                    "story_content": result["story_content"],
+                }
+                for result in results
+                if result["status"] in ("generated", "cached")
+            },
+            athlete_id=self._athlete_id,
+        )
+        return results
+
+    async def _generate_one(
+        self, activity_id: int, activity: Union[dict, Exception]
+    ) -> dict:
+        if isinstance(activity, ActivityNotFoundError):
+            return {
+                "activity_id": activity_id,
+                "status": "not_found",
+                "detail": f"Activity {activity_id} not found in database nor in Strava Client",
+            }
+        if isinstance(activity, ActivityConflict):
+            return {
+                "activity_id": activity_id,
+                "status": "conflict",
+                "detail": str(activity),
+            }
+        if isinstance(activity, Exception):
+            return {
+                "activity_id": activity_id,
+                "status": "failed",
+                "detail": f"Could not get activity {activity_id} from Strava: {activity}",
+            }
+        cache_key = self._story_generator.cache_key(activity)
+        story = await self._story_cache.aget(cache_key) if self._story_cache else None
+        if story is not None:
+            return self._story_result(activity_id, "cached", story)
+        async with self._semaphore:
+            try:
+                story = await asyncio.wait_for(
+                    self._story_generator.agenerate(activity), self._timeout
+                )
+            except asyncio.TimeoutError:
+                return {
+                    "activity_id": activity_id,
+                    "status": "timeout",
+                    "detail": f"Story generation took longer than {self._timeout} seconds",
+                }
+            except Exception as e:
+                return {
+                    "activity_id": activity_id,
+                    "status": "failed",
+                    "detail": str(e),
+                }
+        if self._story_cache:
+            await self._story_cache.aset(cache_key, story)
+        return self._story_result(activity_id, "generated", story)
+
+    @staticmethod
+    def _story_result(activity_id: int, status: str, story: Story) -> dict:
+        return {"activity_id": activity_id, "status": status, **story.__dict__}
@@ -0,0 +1,150 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from src.generators import Story
+from src.metrics import STORY_CACHE_LOOKUPS
+
+
+class StoryCache:
+    """
+    Two tier story cache. First tier is an in-process LRU, second tier is an optional persistent store that implements
+    `get_cached_story(key)` and `save_cached_story(key, story)` e.g. `MongoDBGateway`. Persistent hits are promoted to
+    the LRU.
+
+    """
+
+    def __init__(self, max_size: int = 1024, store=None):
+        self._max_size = max_size
+        self._store = store
+        self._stories: OrderedDict[str, Story] = OrderedDict()
+        self._lock = threading.Lock()
+        self._memory_hits = 0
+        self._persistent_hits = 0
+        self._misses = 0
+        self._lookup_seconds = 0.0
+
+    def get(self, key: str) -> Optional[Story]:
+        """
+        Looks the story up in the LRU first, then in the persistent store.
+
+        Parameters
+        ----------
+        key : str
+            key built with `AIStoryGenerator.cache_key`
+
+        Returns
+        -------
+        Optional[Story]
+            cached story, None on a miss
+
+        """
+        start = time.perf_counter()
+        story = self._get_from_memory(key, start)
+        if story is not None:
+            return story
+        cached = self._store.get_cached_story(key) if self._store else None
+        return self._record_persistent_lookup(key, cached, start)
+
+    async def aget(self, key: str) -> Optional[Story]:
+        """
+        Async version of `get`, the persistent store must implement `get_cached_story` as a coroutine e.g.
+        `AsyncMongoDBGateway`.
+
+        """
+        start = time.perf_counter()
+        story = self._get_from_memory(key, start)
+        if story is not None:
+            return story
+        cached = await self._store.get_cached_story(key) if self._store else None
+        return self._record_persistent_lookup(key, cached, start)
+
+    def set(self, key: str, story: Story) -> None:
+        """
+        Stores the story in the LRU and in the persistent store if there is one.
+
+        Parameters
+        ----------
+        key : str
+            key built with `AIStoryGenerator.cache_key`
+        story : Story
+            generated story
+
+        Returns
+        -------
+        None
+
+        """
+        with self._lock:
+            self._put(key, story)
+        if self._store:
+            self._store.save_cached_story(key, story.__dict__)
+
+    async def aset(self, key: str, story: Story) -> None:
+        """
+        Async version of `set`.
+
+        """
+        with self._lock:
+            self._put(key, story)
+        if self._store:
+            await self._store.save_cached_story(key, story.__dict__)
+
+    def stats(self) -> dict:
+        """
+        Returns hit-rate and latency metrics of the cache.
+
+        Returns
+        -------
+        dict
+            with `size`, `max_size`, `memory_hits`, `persistent_hits`, `misses`, `hit_rate` and
+            `mean_lookup_ms` keys
+
+        """
+        with self._lock:
+            hits = self._memory_hits + self._persistent_hits
+            lookups = hits + self._misses
+            return {
+                "size": len(self._stories),
+                "max_size": self._max_size,
+                "memory_hits": self._memory_hits,
+                "persistent_hits": self._persistent_hits,
+                "misses": self._misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "mean_lookup_ms": self._lookup_seconds * 1000 / lookups
+                if lookups
+                else 0.0,
+            }
+
+    def _get_from_memory(self, key: str, start: float) -> Optional[Story]:
+        with self._lock:
+            story = self._stories.get(key)
+            if story is not None:
+                self._stories.move_to_end(key)
+                self._memory_hits += 1
+                STORY_CACHE_LOOKUPS.inc(result="memory_hit")
+                self._lookup_seconds += time.perf_counter() - start
+            return story
+
+    def _record_persistent_lookup(
+        self, key: str, cached: Optional[dict], start: float
+    ) -> Optional[Story]:
+        story = None
+        with self._lock:
+            if cached is not None:
+                story = Story(**cached)
+                self._put(key, story)
+                self._persistent_hits += 1
+                STORY_CACHE_LOOKUPS.inc(result="persistent_hit")
+            else:
+                self._misses += 1
+                STORY_CACHE_LOOKUPS.inc(result="miss")
+            self._lookup_seconds += time.perf_counter() - start
+        return story
+
+    def _put(self, key: str, story: Story) -> None:
+        self._stories[key] = story
+        self._stories.move_to_end(key)
+        while len(self._stories) > self._max_size:
+            self._stories.popitem(last=False)
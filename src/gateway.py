@@ -1,17 +1,165 @@
-from pymongo import MongoClient
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Iterator, Optional
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from src.metrics import MONGO_SECONDS, timed
 
 
 class NoResultFound(Exception):
     pass
 
 
+class ActivityConflict(Exception):
+    pass
+
+
+# partial index only holds processed activities, so listing them in `activity_id` order does not scan nor sort the
+# unprocessed ones. Listings are not covered: `story_content` is not a key, so every listed document is still fetched
+# to check it, projections only shrink the documents sent back
+PROCESSED_ACTIVITIES_INDEX_KEYS = [("activity_id", 1), ("story_title", 1)]
+PROCESSED_ACTIVITIES_INDEX_OPTIONS = dict(
+    name="processed_activities",
+    partialFilterExpression={
+        "story_title": {"$exists": True},
+        "story_content": {"$exists": True},
+    },
+)
+
+
+def _projection(fields: Optional[list[str]]) -> dict:
+    if not fields:
+        return {"_id": 0}
+    return {"_id": 0, **{field: 1 for field in fields}}
+
+
+def _scoped(query: dict, athlete_id: Optional[int]) -> dict:
+    # activities of all athletes live in the same collection, `athlete_id` narrows a query down to one athlete
+    if athlete_id is None:
+        return query
+    return {**query, "athlete_id": athlete_id}
+
+
+def _claimable(query: dict, athlete_id: Optional[int]) -> dict:
+    # activities saved without an athlete, e.g. by a single-athlete sync, are claimed by the first athlete using them
+    if athlete_id is None:
+        return query
+    return {**query, "athlete_id": {"$in": [athlete_id, None]}}
+
+
+def _write_filter(document: dict) -> dict:
+    # writes never match, and so never move, an activity of another athlete
+    return _claimable(
+        {"activity_id": document["activity_id"]}, document.get("athlete_id")
+    )
+
+
+def _claim_update(athlete_id: int) -> dict:
+    return {"$set": {"athlete_id": athlete_id}}
+
+
+def _conflict(activity_id: int) -> ActivityConflict:
+    return ActivityConflict(f"Activity {activity_id} belongs to another athlete")
+
+
+def stamp_athlete(activities: list[dict], athlete_id: Optional[int]) -> list[dict]:
+    """
+    Assigns the activities to the athlete, they are left as they are if `athlete_id` is None.
+
+    """
+    if athlete_id is not None:
+        for activity in activities:
+            activity["athlete_id"] = athlete_id
+    return activities
+
+
+def _bulk_save_result(details: dict) -> "BulkSaveResult":
+    # activities of other athletes are rejected by the unique activity_id index, the other writes still go through
+    conflicts = 0
+    for error in details.get("writeErrors", []):
+        if error["code"] != 11000:
+            raise BulkWriteError(details)
+        conflicts += 1
+    return BulkSaveResult(
+        inserted=details["nUpserted"],
+        updated=details["nModified"],
+        unchanged=details["nMatched"] - details["nModified"],
+        conflicts=conflicts,
+    )
+
+
+def _processed_activities_filter(
+    after: Optional[int] = None, athlete_id: Optional[int] = None
+) -> dict:
+    query = {
+        "$and": [
+            {"story_content": {"$exists": True}},
+            {"story_title": {"$exists": True}},
+        ]
+    }
+    if after is not None:
+        query["$and"].append({"activity_id": {"$gt": after}})
+    return _scoped(query, athlete_id)
+
+
+@dataclass
+class BulkSaveResult:
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    conflicts: int = 0
+
+    @property
+    def saved(self) -> int:
+        return self.inserted + self.updated + self.unchanged
+
+
 class MongoDBGateway:
-    def __init__(self, uri: str, db_name: str, collection_name: str):
+    def __init__(
+        self,
+        uri: str,
+        db_name: str,
+        collection_name: str,
+        watermark_collection_name: str = "sync_watermarks",
+        batch_size: int = 1000,
+        story_cache_collection_name: str = "story_cache",
+        story_cache_ttl_seconds: int = 30 * 24 * 60 * 60,
+        token_collection_name: str = "strava_tokens",
+    ):
         self._client = MongoClient(uri)
         self._db = self._client[db_name]
         self._collection = self._db[collection_name]
+        self._watermark_collection = self._db[watermark_collection_name]
+        self._story_cache_collection = self._db[story_cache_collection_name]
+        self._token_collection = self._db[token_collection_name]
+        self._story_cache_ttl_seconds = story_cache_ttl_seconds
+        self._batch_size = batch_size
+        self._ensure_indexes()
+
+    def _ensure_indexes(self) -> None:
+        # unique index makes activity_id lookups an index scan and rejects duplicate activities
+        # creating it fails if the collection already has duplicate activity_ids, those must be removed first
+        self._collection.create_index("activity_id", unique=True)
+        self._collection.create_index([("athlete_id", 1), ("activity_id", 1)])
+        self._collection.create_index(
+            PROCESSED_ACTIVITIES_INDEX_KEYS, **PROCESSED_ACTIVITIES_INDEX_OPTIONS
+        )
+        self._watermark_collection.create_index("athlete_id", unique=True)
+        self._token_collection.create_index("athlete_id", unique=True)
+        self._story_cache_collection.create_index("key", unique=True)
+        # TTL index, MongoDB removes cached stories older than the TTL
+        self._story_cache_collection.create_index(
+            "created_at", expireAfterSeconds=self._story_cache_ttl_seconds
+        )
+
+    def close(self) -> None:
+        self._client.close()
 
-    def get(self, document_id: int) -> dict:
+    @timed(MONGO_SECONDS, operation="get")
+    def get(self, document_id: int, athlete_id: Optional[int] = None) -> dict:
         """
         Retrieve the document from the collection with the given activity ID.
 
@@ -19,6 +167,9 @@ class MongoDBGateway:
         ----------
         document_id : int
             The activity ID of the document to retrieve.
+        athlete_id : Optional[int]
+            Only the activities of this athlete are searched, all activities if None. An activity saved without an
+            athlete is assigned to this athlete.
 
         Returns
         -------
@@ -29,16 +180,28 @@ class MongoDBGateway:
         ------
         NoResultFound
             If no document with the specified activity ID is found in the collection.
+        ActivityConflict
+            If the activity is saved for another athlete.
 
         """
-        result = self._collection.find_one({"activity_id": document_id}, {"_id": 0})
+        query = {"activity_id": document_id}
+        result = self._collection.find_one(_claimable(query, athlete_id), {"_id": 0})
         if result is None:
+            if athlete_id is not None and self._collection.find_one(query, {"_id": 1}):
+                raise _conflict(document_id)
             raise NoResultFound(f"Activity {document_id} not found")
+        if athlete_id is not None and result.get("athlete_id") is None:
+            self._collection.update_one(
+                _claimable(query, athlete_id), _claim_update(athlete_id)
+            )
+            result["athlete_id"] = athlete_id
         return result
 
+    @timed(MONGO_SECONDS, operation="save_one")
     def save_one(self, document: dict) -> None:
         """
-        Saves the document to MongoDB
+        Saves the document to MongoDB. An existing document with the same activity ID is updated instead of
+        duplicated.
 
         Parameters
         ----------
@@ -49,9 +212,20 @@ class MongoDBGateway:
         -------
         None
 
+        Raises
+        ------
+        ActivityConflict
+            If the activity is saved for another athlete.
+
         """
-        self._collection.insert_one(document.copy())
+        try:
+            self._collection.update_one(
+                _write_filter(document), {"$set": document.copy()}, upsert=True
+            )
+        except DuplicateKeyError:
+            raise _conflict(document["activity_id"])
 
+    @timed(MONGO_SECONDS, operation="update")
     def update(self, document: dict, update_dict: dict) -> dict:
         """
         Update document with the given update dictionary
@@ -68,17 +242,25 @@ class MongoDBGateway:
         dict
             A dictionary representing the updated activity with the new keys
 
+        Raises
+        ------
+        NoResultFound
+            If the activity is not saved, or is saved for another athlete.
+
         """
-        self._collection.update_one(
-            {"activity_id": document["activity_id"]},
-            {"$set": update_dict},
+        result = self._collection.update_one(
+            _write_filter(document), {"$set": update_dict}
         )
+        if result.matched_count == 0:
+            raise NoResultFound(f"Activity {document['activity_id']} not found")
         document.update(update_dict)
         return document
 
-    def bulk_save(self, documents: list[dict]) -> None:
+    @timed(MONGO_SECONDS, operation="bulk_save")
+    def bulk_save(self, documents: list[dict]) -> BulkSaveResult:
         """
-        This method bulk saves activities by inserting multiple documents into the specified collection.
+        This method bulk saves activities by upserting multiple documents into the specified collection. Documents are
+        written in unordered batches of `batch_size`, so saving the same activities again does not create duplicates.
 
         Parameters
         ----------
@@ -87,16 +269,55 @@ class MongoDBGateway:
 
         Returns
         -------
-        None
+        BulkSaveResult
+            Number of inserted, updated and unchanged documents, and of documents skipped because their activity is
+            saved for another athlete
 
         """
-        self._collection.insert_many(documents)
+        result = BulkSaveResult()
+        for start in range(0, len(documents), self._batch_size):
+            batch = documents[start : start + self._batch_size]
+            requests = [
+                UpdateOne(_write_filter(document), {"$set": document}, upsert=True)
+                for document in batch
+            ]
+            try:
+                details = self._collection.bulk_write(
+                    requests, ordered=False
+                ).bulk_api_result
+            except BulkWriteError as e:
+                details = e.details
+            batch_result = _bulk_save_result(details)
+            result.inserted += batch_result.inserted
+            result.updated += batch_result.updated
+            result.unchanged += batch_result.unchanged
+            result.conflicts += batch_result.conflicts
+        return result
 
-    def get_processed_activities(self) -> list[dict]:
+    @timed(MONGO_SECONDS, operation="get_processed_activities")
+    def get_processed_activities(
+        self,
+        limit: int = 0,
+        after: Optional[int] = None,
+        fields: Optional[list[str]] = None,
+        athlete_id: Optional[int] = None,
+    ) -> list[dict]:
         """
-        Retrieves a list of processed activities from the collection.
+        Retrieves a list of processed activities from the collection sorted by activity ID.
+
+        Processed activity is an activity that has `story_title` and `story_content` attributes. Pages are fetched with
+        keyset pagination, pass the activity ID of the last activity of a page as `after` to get the next page.
 
-        Processed activity is an activity that has `story_title` and `story_content` attributes.
+        Parameters
+        ----------
+        limit : int
+            Maximum number of activities to return, 0 means no limit.
+        after : Optional[int]
+            Only activities with an activity ID greater than `after` are returned.
+        fields : Optional[list[str]]
+            Only these fields are returned, all fields if None.
+        athlete_id : Optional[int]
+            Only the activities of this athlete are returned, all activities if None.
 
         Returns:
             list[dict]: A list of dictionaries representing the processed activities.
@@ -104,12 +325,564 @@ class MongoDBGateway:
         """
         return list(
             self._collection.find(
+                _processed_activities_filter(after, athlete_id),
+                _projection(fields),
+                sort=[("activity_id", 1)],
+                limit=limit,
+            )
+        )
+
+    def iter_processed_activities(
+        self,
+        batch_size: int = 1000,
+        after: Optional[int] = None,
+        fields: Optional[list[str]] = None,
+        athlete_id: Optional[int] = None,
+    ) -> Iterator[dict]:
+        """
+        Lazily yields processed activities sorted by activity ID straight from the cursor. At most `batch_size`
+        documents are held in memory at a time, regardless of the collection size.
+
+        Parameters
+        ----------
+        batch_size : int
+            Number of documents fetched from MongoDB per round trip.
+        after : Optional[int]
+            Only activities with an activity ID greater than `after` are yielded.
+        fields : Optional[list[str]]
+            Only these fields are yielded, all fields if None.
+        athlete_id : Optional[int]
+            Only the activities of this athlete are yielded, all activities if None.
+
+        Yields
+        ------
+        dict
+            processed activity, excluding the "_id" field
+
+        """
+        cursor = self._collection.find(
+            _processed_activities_filter(after, athlete_id),
+            _projection(fields),
+            sort=[("activity_id", 1)],
+            batch_size=batch_size,
+        )
+        with cursor:
+            yield from cursor
+
+    @timed(MONGO_SECONDS, operation="get_many")
+    def get_many(
+        self, document_ids: list[int], athlete_id: Optional[int] = None
+    ) -> list[dict]:
+        """
+        Retrieves the documents with the given activity IDs in a single query. Missing activities are skipped.
+
+        Parameters
+        ----------
+        document_ids : list[int]
+            The activity IDs of the documents to retrieve.
+        athlete_id : Optional[int]
+            Only the activities of this athlete are retrieved, activities of other athletes are skipped like missing
+            ones. Activities saved without an athlete are assigned to this athlete.
+
+        Returns
+        -------
+        list[dict]
+            The retrieved documents, excluding the "_id" field.
+
+        """
+        query = {"activity_id": {"$in": document_ids}}
+        if athlete_id is not None:
+            self._collection.update_many(
+                {**query, "athlete_id": None}, _claim_update(athlete_id)
+            )
+        return list(self._collection.find(_scoped(query, athlete_id), {"_id": 0}))
+
+    @timed(MONGO_SECONDS, operation="get_unprocessed_activities")
+    def get_unprocessed_activities(
+        self, limit: int = 0, athlete_id: Optional[int] = None
+    ) -> list[dict]:
+        """
+        Retrieves activities that do not have a story yet.
+
+        Parameters
+        ----------
+        limit : int
+            Maximum number of activities to return, 0 means no limit.
+        athlete_id : Optional[int]
+            Only the activities of this athlete are returned, all activities if None.
+
+        Returns
+        -------
+        list[dict]
+            A list of dictionaries representing the unprocessed activities.
+
+        """
+        return list(
+            self._collection.find(
+                _scoped({"story_content": {"$exists": False}}, athlete_id),
+                {"_id": 0},
+                limit=limit,
+            )
+        )
+
+    @timed(MONGO_SECONDS, operation="bulk_update")
+    def bulk_update(
+        self, update_dicts: dict[int, dict], athlete_id: Optional[int] = None
+    ) -> int:
+        """
+        Updates multiple documents with a single unordered bulk write of `$set` operations.
+
+        Parameters
+        ----------
+        update_dicts : dict[int, dict]
+            Activity ID to the key, value pairs that will be used to update the activity
+        athlete_id : Optional[int]
+            Only the activities of this athlete are updated, all activities if None.
+
+        Returns
+        -------
+        int
+            Number of modified documents
+
+        """
+        if not update_dicts:
+            return 0
+        result = self._collection.bulk_write(
+            [
+                UpdateOne(
+                    _scoped({"activity_id": activity_id}, athlete_id),
+                    {"$set": update_dict},
+                )
+                for activity_id, update_dict in update_dicts.items()
+            ],
+            ordered=False,
+        )
+        return result.modified_count
+
+    @timed(MONGO_SECONDS, operation="get_watermark")
+    def get_watermark(self, athlete_id: int) -> Optional[dict]:
+        """
+        Retrieves the high-water mark of the last incremental sync of the given athlete.
+
+        Parameters
+        ----------
+        athlete_id : int
+            The Strava athlete ID.
+
+        Returns
+        -------
+        Optional[dict]
+            A dictionary with `athlete_id`, `start_date` (epoch seconds) and `activity_id` of the latest ingested
+            activity, None if the athlete has never been synced.
+
+        """
+        return self._watermark_collection.find_one(
+            {"athlete_id": athlete_id}, {"_id": 0}
+        )
+
+    @timed(MONGO_SECONDS, operation="set_watermark")
+    def set_watermark(self, athlete_id: int, start_date: int, activity_id: int) -> None:
+        """
+        Stores the high-water mark of the given athlete. Existing mark is replaced.
+
+        Parameters
+        ----------
+        athlete_id : int
+            The Strava athlete ID.
+        start_date : int
+            Start date of the latest ingested activity as epoch seconds.
+        activity_id : int
+            The activity ID of the latest ingested activity.
+
+        Returns
+        -------
+        None
+
+        """
+        self._watermark_collection.update_one(
+            {"athlete_id": athlete_id},
+            {"$set": {"start_date": start_date, "activity_id": activity_id}},
+            upsert=True,
+        )
+
+    def get_token(self, athlete_id: int) -> Optional[dict]:
+        """
+        Retrieves the Strava token pair of the given athlete.
+
+        Parameters
+        ----------
+        athlete_id : int
+            The Strava athlete ID.
+
+        Returns
+        -------
+        Optional[dict]
+            A dictionary with `access_token`, `refresh_token` and `expires_at`, None if the athlete has no token.
+
+        """
+        token = self._token_collection.find_one(
+            {"athlete_id": athlete_id, "access_token": {"$exists": True}},
+            {"_id": 0, "access_token": 1, "refresh_token": 1, "expires_at": 1},
+        )
+        return token
+
+    def save_token(self, athlete_id: int, token: dict) -> None:
+        """
+        Stores the Strava token pair of the given athlete. Existing token is replaced.
+
+        Parameters
+        ----------
+        athlete_id : int
+            The Strava athlete ID.
+        token : dict
+            A dictionary with `access_token`, `refresh_token` and `expires_at`.
+
+        Returns
+        -------
+        None
+
+        """
+        self._token_collection.update_one(
+            {"athlete_id": athlete_id},
+            {
+                "$set": {
+                    "access_token": token["access_token"],
+                    "refresh_token": token["refresh_token"],
+                    "expires_at": token.get("expires_at", 0),
+                }
+            },
+            upsert=True,
+        )
+
+    def try_lock_token(self, athlete_id: int, owner: str, ttl_seconds: float) -> bool:
+        """
+        Takes the token refresh lock of the given athlete. Lock expires after `ttl_seconds` so that a crashed owner
+        does not block the others forever.
+
+        Parameters
+        ----------
+        athlete_id : int
+            The Strava athlete ID.
+        owner : str
+            Unique ID of the lock owner.
+        ttl_seconds : float
+            Lifetime of the lock.
+
+        Returns
+        -------
+        bool
+            True if the lock is taken, False if another owner holds it.
+
+        """
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        try:
+            self._token_collection.update_one(
                 {
-                    "$and": [
-                        {"story_content": {"$exists": True}},
-                        {"story_title": {"$exists": True}},
-                    ]
+                    "athlete_id": athlete_id,
+                    "$or": [
+                        {"lock_expires_at": None},
+                        {"lock_expires_at": {"$lte": now}},
+                    ],
                 },
-                {"_id": 0},
+                {
+                    "$set": {
+                        "lock_owner": owner,
+                        "lock_expires_at": now + timedelta(seconds=ttl_seconds),
+                    }
+                },
+                upsert=True,
             )
+        except DuplicateKeyError:
+            # document exists and its lock is held
+            return False
+        return True
+
+    def release_token_lock(self, athlete_id: int, owner: str) -> None:
+        """
+        Releases the token refresh lock of the given athlete if it is held by `owner`.
+
+        """
+        self._token_collection.update_one(
+            {"athlete_id": athlete_id, "lock_owner": owner},
+            {"$set": {"lock_owner": None, "lock_expires_at": None}},
+        )
+
+    @timed(MONGO_SECONDS, operation="get_cached_story")
+    def get_cached_story(self, key: str) -> Optional[dict]:
+        """
+        Retrieves a cached story with the given cache key.
+
+        Parameters
+        ----------
+        key : str
+            The story cache key.
+
+        Returns
+        -------
+        Optional[dict]
+            A dictionary with `story_title` and `story_content`, None if the story is not cached or expired.
+
+        """
+        return self._story_cache_collection.find_one(
+            {"key": key}, {"_id": 0, "story_title": 1, "story_content": 1}
+        )
+
+    @timed(MONGO_SECONDS, operation="save_cached_story")
+    def save_cached_story(self, key: str, story: dict) -> None:
+        """
+        Caches the story with the given cache key. The story expires after the TTL of the story cache.
+
+        Parameters
+        ----------
+        key : str
+            The story cache key.
+        story : dict
+            A dictionary with `story_title` and `story_content`.
+
+        Returns
+        -------
+        None
+
+        """
+        self._story_cache_collection.update_one(
+            {"key": key},
+            {"$set": {**story, "created_at": datetime.now(timezone.utc)}},
+            upsert=True,
+        )
+
+
+class AsyncMongoDBGateway:
+    """
+    Async counterpart of `MongoDBGateway` built on Motor. Documents, indexes and results are the same as the ones of
+    `MongoDBGateway`. Indexes are created with `ensure_indexes`, call it once on startup.
+
+    """
+
+    def __init__(
+        self,
+        uri: str,
+        db_name: str,
+        collection_name: str,
+        watermark_collection_name: str = "sync_watermarks",
+        batch_size: int = 1000,
+        story_cache_collection_name: str = "story_cache",
+        story_cache_ttl_seconds: int = 30 * 24 * 60 * 60,
+        max_pool_size: int = 100,
+    ):
+        self._client = AsyncIOMotorClient(uri, maxPoolSize=max_pool_size)
+        self._db = self._client[db_name]
+        self._collection = self._db[collection_name]
+        self._watermark_collection = self._db[watermark_collection_name]
+        self._story_cache_collection = self._db[story_cache_collection_name]
+        self._story_cache_ttl_seconds = story_cache_ttl_seconds
+        self._batch_size = batch_size
+
+    async def ensure_indexes(self) -> None:
+        await self._collection.create_index("activity_id", unique=True)
+        await self._collection.create_index([("athlete_id", 1), ("activity_id", 1)])
+        await self._collection.create_index(
+            PROCESSED_ACTIVITIES_INDEX_KEYS, **PROCESSED_ACTIVITIES_INDEX_OPTIONS
+        )
+        await self._watermark_collection.create_index("athlete_id", unique=True)
+        await self._story_cache_collection.create_index("key", unique=True)
+        await self._story_cache_collection.create_index(
+            "created_at", expireAfterSeconds=self._story_cache_ttl_seconds
+        )
+
+    def close(self) -> None:
+        self._client.close()
+
+    @timed(MONGO_SECONDS, operation="get")
+    async def get(self, document_id: int, athlete_id: Optional[int] = None) -> dict:
+        """
+        Async version of `MongoDBGateway.get`.
+
+        """
+        query = {"activity_id": document_id}
+        result = await self._collection.find_one(
+            _claimable(query, athlete_id), {"_id": 0}
+        )
+        if result is None:
+            if athlete_id is not None and await self._collection.find_one(
+                query, {"_id": 1}
+            ):
+                raise _conflict(document_id)
+            raise NoResultFound(f"Activity {document_id} not found")
+        if athlete_id is not None and result.get("athlete_id") is None:
+            await self._collection.update_one(
+                _claimable(query, athlete_id), _claim_update(athlete_id)
+            )
+            result["athlete_id"] = athlete_id
+        return result
+
+    @timed(MONGO_SECONDS, operation="save_one")
+    async def save_one(self, document: dict) -> None:
+        """
+        Async version of `MongoDBGateway.save_one`.
+
+        """
+        try:
+            await self._collection.update_one(
+                _write_filter(document), {"$set": document.copy()}, upsert=True
+            )
+        except DuplicateKeyError:
+            raise _conflict(document["activity_id"])
+
+    @timed(MONGO_SECONDS, operation="update")
+    async def update(self, document: dict, update_dict: dict) -> dict:
+        """
+        Async version of `MongoDBGateway.update`.
+
+        """
+        result = await self._collection.update_one(
+            _write_filter(document), {"$set": update_dict}
+        )
+        if result.matched_count == 0:
+            raise NoResultFound(f"Activity {document['activity_id']} not found")
+        document.update(update_dict)
+        return document
+
+    @timed(MONGO_SECONDS, operation="bulk_save")
+    async def bulk_save(self, documents: list[dict]) -> BulkSaveResult:
+        """
+        Async version of `MongoDBGateway.bulk_save`.
+
+        """
+        result = BulkSaveResult()
+        for start in range(0, len(documents), self._batch_size):
+            batch = documents[start : start + self._batch_size]
+            requests = [
+                UpdateOne(_write_filter(document), {"$set": document}, upsert=True)
+                for document in batch
+            ]
+            try:
+                details = (
+                    await self._collection.bulk_write(requests, ordered=False)
+                ).bulk_api_result
+            except BulkWriteError as e:
+                details = e.details
+            batch_result = _bulk_save_result(details)
+            result.inserted += batch_result.inserted
+            result.updated += batch_result.updated
+            result.unchanged += batch_result.unchanged
+            result.conflicts += batch_result.conflicts
+        return result
+
+    @timed(MONGO_SECONDS, operation="get_processed_activities")
+    async def get_processed_activities(
+        self,
+        limit: int = 0,
+        after: Optional[int] = None,
+        fields: Optional[list[str]] = None,
+        athlete_id: Optional[int] = None,
+    ) -> list[dict]:
+        """
+        Async version of `MongoDBGateway.get_processed_activities`.
+
+        """
+        cursor = self._collection.find(
+            _processed_activities_filter(after, athlete_id),
+            _projection(fields),
+            sort=[("activity_id", 1)],
+            limit=limit,
+        )
+        return await cursor.to_list(length=None)
+
+    @timed(MONGO_SECONDS, operation="get_many")
+    async def get_many(
+        self, document_ids: list[int], athlete_id: Optional[int] = None
+    ) -> list[dict]:
+        """
+        Async version of `MongoDBGateway.get_many`.
+
+        """
+        query = {"activity_id": {"$in": document_ids}}
+        if athlete_id is not None:
+            await self._collection.update_many(
+                {**query, "athlete_id": None}, _claim_update(athlete_id)
+            )
+        cursor = self._collection.find(_scoped(query, athlete_id), {"_id": 0})
+        return await cursor.to_list(length=None)
+
+    @timed(MONGO_SECONDS, operation="get_unprocessed_activities")
+    async def get_unprocessed_activities(
+        self, limit: int = 0, athlete_id: Optional[int] = None
+    ) -> list[dict]:
+        """
+        Async version of `MongoDBGateway.get_unprocessed_activities`.
+
+        """
+        cursor = self._collection.find(
+            _scoped({"story_content": {"$exists": False}}, athlete_id),
+            {"_id": 0},
+            limit=limit,
+        )
+        return await cursor.to_list(length=None)
+
+    @timed(MONGO_SECONDS, operation="bulk_update")
+    async def bulk_update(
+        self, update_dicts: dict[int, dict], athlete_id: Optional[int] = None
+    ) -> int:
+        """
+        Async version of `MongoDBGateway.bulk_update`.
+
+        """
+        if not update_dicts:
+            return 0
+        result = await self._collection.bulk_write(
+            [
+                UpdateOne(
+                    _scoped({"activity_id": activity_id}, athlete_id),
+                    {"$set": update_dict},
+                )
+                for activity_id, update_dict in update_dicts.items()
+            ],
+            ordered=False,
+        )
+        return result.modified_count
+
+    @timed(MONGO_SECONDS, operation="get_watermark")
+    async def get_watermark(self, athlete_id: int) -> Optional[dict]:
+        """
+        Async version of `MongoDBGateway.get_watermark`.
+
+        """
+        return await self._watermark_collection.find_one(
+            {"athlete_id": athlete_id}, {"_id": 0}
+        )
+
+    @timed(MONGO_SECONDS, operation="set_watermark")
+    async def set_watermark(
+        self, athlete_id: int, start_date: int, activity_id: int
+    ) -> None:
+        """
+        Async version of `MongoDBGateway.set_watermark`.
+
+        """
+        await self._watermark_collection.update_one(
+            {"athlete_id": athlete_id},
+            {"$set": {"start_date": start_date, "activity_id": activity_id}},
+            upsert=True,
+        )
+
+    @timed(MONGO_SECONDS, operation="get_cached_story")
+    async def get_cached_story(self, key: str) -> Optional[dict]:
+        """
+        Async version of `MongoDBGateway.get_cached_story`.
+
+        """
+        return await self._story_cache_collection.find_one(
+            {"key": key}, {"_id": 0, "story_title": 1, "story_content": 1}
+        )
+
+    @timed(MONGO_SECONDS, operation="save_cached_story")
+    async def save_cached_story(self, key: str, story: dict) -> None:
+        """
+        Async version of `MongoDBGateway.save_cached_story`.
+
+        """
+        await self._story_cache_collection.update_one(
+            {"key": key},
+            {"$set": {**story, "created_at": datetime.now(timezone.utc)}},
+            upsert=True,
         )
@@ -0,0 +1,457 @@
+import asyncio
+import itertools
+import json
+import logging
+import math
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from multiprocessing.connection import wait
+from typing import Callable, Iterator, Optional
+
+from src.generators import AIGenerator, AIStoryGenerator, Story, story_cache_key
+from src.metrics import GENERATION_POOL_REJECTIONS, STAGE_SECONDS, timed
+
+logger = logging.getLogger(__name__)
+
+# marks the end of a streamed story in the chunks of a task
+_END = object()
+
+
+class GenerationPoolFull(Exception):
+    def __init__(self, retry_after_seconds: int):
+        super().__init__(
+            f"Story generation pool is full, retry after {retry_after_seconds} seconds"
+        )
+        self.retry_after_seconds = retry_after_seconds
+
+
+class GenerationWorkerError(Exception):
+    pass
+
+
+def _run_worker(conn, generator_factory: Callable, warm_up: bool) -> None:
+    # the API process stops the workers on shutdown, Ctrl+C in a terminal should not kill them mid-task
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    generator = generator_factory()
+    if warm_up:
+        generator.warm_up()
+    # parameters go through JSON so that the parent builds exactly the same cache keys
+    conn.send(("ready", json.loads(json.dumps(generator.cache_params(), default=str))))
+    while True:
+        task = conn.recv()
+        if task is None:
+            return
+        task_id, kind, activity = task
+        try:
+            if kind == "stream":
+                for chunk in generator.stream(activity):
+                    conn.send(("chunk", task_id, chunk))
+                result = None
+            else:
+                result = generator.generate(activity)
+        except Exception as e:
+            conn.send(("failed", task_id, f"{type(e).__name__}: {e}"))
+        else:
+            conn.send(("done", task_id, result))
+
+
+class _Task:
+    def __init__(self, task_id: int, kind: str, activity: dict):
+        self.task_id = task_id
+        self.kind = kind
+        self.activity = activity
+        self.future: Future = Future()
+        # streamed chunks, then `_END` or the exception the stream failed with
+        self.chunks: Optional[queue.Queue] = queue.Queue() if kind == "stream" else None
+        self.submitted = time.monotonic()
+        self.started: Optional[float] = None
+
+
+class _Worker:
+    def __init__(self, worker_id: int):
+        self.worker_id = worker_id
+        self.process = None
+        self.conn = None
+        self.ready = False
+        self.task: Optional[_Task] = None
+        self.tasks_done = 0
+        self.restarts = 0
+        # consecutive exits before the generator was built, respawns back off exponentially
+        self.failures = 0
+        self.restart_at = 0.0
+
+
+class GenerationPool(AIGenerator):
+    """
+    Generates stories in `num_workers` processes, each holding one generator, so that local model inference and
+    parsing run on all cores instead of holding the GIL of the API process. Drop-in replacement of `AIStoryGenerator`
+    for the routes: `generate`, `agenerate`, `stream` and `cache_key`.
+
+    At most `num_workers` stories are generated and `max_queue_size` stories wait at a time, further stories are
+    rejected with `GenerationPoolFull` right away. A dispatcher thread hands the waiting stories to idle workers,
+    respawns workers that exit and kills workers that take longer than `task_timeout_seconds`, the stories they were
+    generating fail with `GenerationWorkerError`. See `health`.
+
+    """
+
+    def __init__(
+        self,
+        num_workers: int = 2,
+        max_queue_size: int = 16,
+        task_timeout_seconds: float = 120.0,
+        health_check_interval_seconds: float = 1.0,
+        start_timeout_seconds: float = 300.0,
+        generator_factory: Callable = AIStoryGenerator,
+        warm_up: bool = False,
+        start_method: str = "spawn",
+    ):
+        """
+        Starts the workers and waits until the first one has built its generator.
+
+        Parameters
+        ----------
+        num_workers : int
+            Number of worker processes, every worker loads its own model with local backends
+        max_queue_size : int
+            Maximum number of stories waiting for an idle worker
+        task_timeout_seconds : float
+            A story fails if it waits or is generated for longer, its worker is killed and respawned
+        health_check_interval_seconds : float
+            Interval of the liveness and timeout checks of the dispatcher thread
+        start_timeout_seconds : float
+            Maximum time to wait for the first worker to build its generator
+        generator_factory : Callable
+            Builds the generator of a worker, it must be picklable, e.g. a class or a module level function
+        warm_up : bool
+            Workers warm up their generator before they take stories, see `AIStoryGenerator.warm_up`
+        start_method : str
+            Start method of the worker processes. `spawn` starts them without the threads and connections of the
+            API process.
+
+        """
+        self._num_workers = num_workers
+        self._max_queue_size = max_queue_size
+        self._task_timeout_seconds = task_timeout_seconds
+        self._health_check_interval_seconds = health_check_interval_seconds
+        self._generator_factory = generator_factory
+        self._warm_up = warm_up
+        self._context = multiprocessing.get_context(start_method)
+        self._workers = [_Worker(worker_id) for worker_id in range(num_workers)]
+        self._pending: deque[_Task] = deque()
+        # queued and running tasks
+        self._tasks: dict[int, _Task] = {}
+        self._task_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._wakeup_reader, self._wakeup_writer = self._context.Pipe(duplex=False)
+        self._cache_params: Optional[dict] = None
+        self._started = threading.Event()
+        self._start_failed = False
+        # expected generation time, estimates Retry-After of rejected stories
+        self._task_seconds = 1.0
+        self._closed = False
+
+        for worker in self._workers:
+            self._spawn(worker)
+        self._dispatcher = threading.Thread(
+            target=self._run, name="generation-pool", daemon=True
+        )
+        self._dispatcher.start()
+        if not self._started.wait(start_timeout_seconds):
+            self.close()
+            raise GenerationWorkerError(
+                f"No generation worker started in {start_timeout_seconds} seconds"
+            )
+        if self._start_failed:
+            self.close()
+            raise GenerationWorkerError(
+                "Every generation worker exited before building its generator"
+            )
+
+    def generate(self, activity: dict) -> Story:
+        with timed(STAGE_SECONDS, stage="generation_pool"):
+            return self._submit("generate", activity).future.result()
+
+    async def agenerate(self, activity: dict) -> Story:
+        task = self._submit("generate", activity)
+        with timed(STAGE_SECONDS, stage="generation_pool"):
+            return await asyncio.wrap_future(task.future)
+
+    def stream(self, activity: dict) -> Iterator[str]:
+        """
+        Streams the model output of the story of the activity from a worker. The story is submitted right away, so
+        a full pool raises `GenerationPoolFull` here and not while iterating.
+
+        """
+        return self._iter_chunks(self._submit("stream", activity))
+
+    def cache_key(self, activity: dict) -> str:
+        return story_cache_key(self._cache_params, activity)
+
+    def warm_up(self) -> None:
+        # generators are warmed up in the workers when the pool is built with `warm_up`
+        pass
+
+    def health(self) -> dict:
+        """
+        Returns
+        -------
+        dict
+            `workers` with `worker_id`, `pid`, `alive`, `ready` (generator is built), `busy`, `tasks_done` and
+            `restarts` of every worker, number of `ready_workers`, `queued` and `in_flight` stories and `capacity`
+
+        """
+        with self._lock:
+            workers = [
+                {
+                    "worker_id": worker.worker_id,
+                    "pid": worker.process.pid if worker.process is not None else None,
+                    "alive": worker.process is not None
+                    and worker.process.exitcode is None,
+                    "ready": worker.ready,
+                    "busy": worker.task is not None,
+                    "tasks_done": worker.tasks_done,
+                    "restarts": worker.restarts,
+                }
+                for worker in self._workers
+            ]
+            return {
+                "workers": workers,
+                "ready_workers": sum(worker["ready"] for worker in workers),
+                "queued": len(self._pending),
+                "in_flight": len(self._tasks),
+                "capacity": self._num_workers + self._max_queue_size,
+            }
+
+    def close(self) -> None:
+        """
+        Stops the dispatcher and the workers, queued and running stories fail.
+
+        """
+        with self._lock:
+            self._closed = True
+            self._wakeup_writer.send(None)
+        self._dispatcher.join(timeout=5)
+        for worker in self._workers:
+            if worker.process is None:
+                continue
+            try:
+                worker.conn.send(None)
+            except OSError:
+                pass
+            worker.process.join(timeout=5)
+            if worker.process.exitcode is None:
+                worker.process.kill()
+                worker.process.join()
+        for task in list(self._tasks.values()):
+            self._finish(task, error=GenerationWorkerError("Generation pool is closed"))
+
+    def _submit(self, kind: str, activity: dict) -> _Task:
+        with self._lock:
+            if self._closed:
+                raise GenerationWorkerError("Generation pool is closed")
+            if len(self._tasks) >= self._num_workers + self._max_queue_size:
+                GENERATION_POOL_REJECTIONS.inc()
+                raise GenerationPoolFull(self._retry_after_seconds())
+            task = _Task(next(self._task_ids), kind, activity)
+            self._tasks[task.task_id] = task
+            self._pending.append(task)
+            self._wakeup_writer.send(None)
+        return task
+
+    def _retry_after_seconds(self) -> int:
+        # time until the queue ahead of a new story is drained by all workers
+        waves = len(self._pending) / self._num_workers + 1
+        return max(1, math.ceil(self._task_seconds * waves))
+
+    @staticmethod
+    def _iter_chunks(task: _Task) -> Iterator[str]:
+        while True:
+            chunk = task.chunks.get()
+            if chunk is _END:
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+
+    def _spawn(self, worker: _Worker) -> None:
+        conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=_run_worker,
+            args=(child_conn, self._generator_factory, self._warm_up),
+            name=f"generation-worker-{worker.worker_id}",
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        worker.process = process
+        worker.conn = conn
+        worker.ready = False
+
+    def _run(self) -> None:
+        while not self._closed:
+            alive = [worker for worker in self._workers if worker.process is not None]
+            ready = wait(
+                [self._wakeup_reader]
+                + [worker.conn for worker in alive]
+                + [worker.process.sentinel for worker in alive],
+                timeout=self._health_check_interval_seconds,
+            )
+            while self._wakeup_reader.poll():
+                self._wakeup_reader.recv()
+            try:
+                # results sent right before a worker exits are read before its exit is handled
+                for worker in alive:
+                    if worker.conn in ready:
+                        self._receive(worker)
+                self._check_health()
+                self._dispatch()
+            except Exception:
+                # stories wait for the dispatcher, it keeps running whatever happens to a worker
+                logger.exception("Generation pool dispatcher failed")
+
+    def _receive(self, worker: _Worker) -> None:
+        try:
+            while worker.conn.poll():
+                self._handle(worker, worker.conn.recv())
+        except (EOFError, OSError):
+            # worker exited, see `_check_health`
+            pass
+
+    def _handle(self, worker: _Worker, message: tuple) -> None:
+        kind = message[0]
+        if kind == "ready":
+            worker.ready = True
+            worker.failures = 0
+            if self._cache_params is None:
+                self._cache_params = message[1]
+                self._started.set()
+            return
+        task = worker.task
+        if task is None or task.task_id != message[1]:
+            return
+        if kind == "chunk":
+            task.chunks.put(message[2])
+            return
+        worker.task = None
+        worker.tasks_done += 1
+        self._task_seconds = 0.8 * self._task_seconds + 0.2 * (
+            time.monotonic() - task.started
+        )
+        if kind == "done":
+            self._finish(task, result=message[2])
+        else:
+            self._finish(task, error=GenerationWorkerError(message[2]))
+
+    def _check_health(self) -> None:
+        now = time.monotonic()
+        for worker in self._workers:
+            if worker.process is not None and worker.process.exitcode is not None:
+                self._on_exit(worker, now)
+            if worker.process is None:
+                if now >= worker.restart_at:
+                    self._spawn(worker)
+                    worker.restarts += 1
+            elif (
+                worker.task is not None
+                and now - worker.task.started > self._task_timeout_seconds
+            ):
+                task, worker.task = worker.task, None
+                self._finish(task, error=self._timeout_error())
+                logger.warning(
+                    "Killing generation worker %s (pid %s) stuck on a story",
+                    worker.worker_id,
+                    worker.process.pid,
+                )
+                worker.process.kill()
+        with self._lock:
+            expired = [
+                task
+                for task in self._pending
+                if now - task.submitted > self._task_timeout_seconds
+            ]
+            for task in expired:
+                self._pending.remove(task)
+        for task in expired:
+            self._finish(task, error=self._timeout_error())
+
+    def _on_exit(self, worker: _Worker, now: float) -> None:
+        exitcode = worker.process.exitcode
+        logger.warning(
+            "Generation worker %s (pid %s) exited with code %s",
+            worker.worker_id,
+            worker.process.pid,
+            exitcode,
+        )
+        if worker.ready:
+            worker.failures = 0
+        else:
+            # generator could not be built, e.g. the model is missing
+            worker.failures += 1
+            if not self._started.is_set() and all(
+                other.failures for other in self._workers
+            ):
+                self._start_failed = True
+                self._started.set()
+        worker.restart_at = now + (
+            min(30, 2**worker.failures) if worker.failures else 0
+        )
+        task = worker.task
+        worker.conn.close()
+        worker.process.close()
+        with self._lock:
+            worker.process = None
+            worker.conn = None
+            worker.ready = False
+            worker.task = None
+        if task is not None:
+            self._finish(
+                task,
+                error=GenerationWorkerError(
+                    f"Generation worker exited with code {exitcode}"
+                ),
+            )
+
+    def _dispatch(self) -> None:
+        for worker in self._workers:
+            if not worker.ready or worker.task is not None:
+                continue
+            with self._lock:
+                if not self._pending:
+                    return
+                task = self._pending.popleft()
+            task.started = time.monotonic()
+            worker.task = task
+            try:
+                worker.conn.send((task.task_id, task.kind, task.activity))
+            except OSError:
+                # worker exited, the task goes back to the queue and the worker is respawned
+                worker.task = None
+                with self._lock:
+                    self._pending.appendleft(task)
+
+    def _finish(
+        self,
+        task: _Task,
+        result: Optional[Story] = None,
+        error: Optional[Exception] = None,
+    ) -> None:
+        with self._lock:
+            self._tasks.pop(task.task_id, None)
+        if task.chunks is not None:
+            task.chunks.put(_END if error is None else error)
+        if task.future.done():
+            return
+        if error is None:
+            task.future.set_result(result)
+        else:
+            task.future.set_exception(error)
+
+    def _timeout_error(self) -> GenerationWorkerError:
+        return GenerationWorkerError(
+            f"Story generation timed out after {self._task_timeout_seconds} seconds"
+        )
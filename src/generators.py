@@ -1,13 +1,27 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
 from abc import abstractmethod, ABC
 from dataclasses import dataclass
+from typing import Iterator, Optional, TYPE_CHECKING
 
 from dotenv import load_dotenv
-from langchain_community.llms import HuggingFaceHub
-from langchain.chains import LLMChain
-from langchain.prompts import PromptTemplate
+
+from src.metrics import LLM_SECONDS, LLM_TOKENS, STAGE_SECONDS, timed
+from src.story_parser import ParsedStory, parse_story, story_is_complete
+
+if TYPE_CHECKING:
+    # langchain takes more than a second to import, it is imported when the first generator is built
+    from langchain_core.language_models.llms import BaseLLM
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+METRIC_KEYS = ("speed", "distance", "time", "elevation")
+
 
 @dataclass
 class Story:
@@ -21,22 +35,85 @@ class AIGenerator(ABC):
     def generate(self, input_: dict) -> Story:
         pass
 
+    async def agenerate(self, input_: dict) -> Story:
+        # generators without native async support run in a worker thread to keep the event loop free
+        return await asyncio.to_thread(self.generate, input_)
+
+    def generate_many(self, inputs: list[dict]) -> list[Story]:
+        # generators without batch support generate one by one
+        return [self.generate(input_) for input_ in inputs]
+
 
 class AIStoryGenerator(AIGenerator):
-    def __init__(self):
-        self._llm_model = HuggingFaceHub(
-            repo_id="openchat/openchat-3.5-0106",
+    def __init__(
+        self,
+        llm: Optional["BaseLLM"] = None,
+        min_confidence: float = 0.5,
+        max_attempts: int = 2,
+        stop: Optional[list[str]] = None,
+        stream: Optional[bool] = None,
+    ):
+        """
+        Parameters
+        ----------
+        llm : Optional[BaseLLM]
+            The model that writes the stories, built from STORY_LLM_BACKEND environment variable if None, see
+            `build_llm`. Local backends load the model here, so a generator should be built once per process.
+        min_confidence : float
+            A story is generated again when its parse confidence is lower, see `parse_story`
+        max_attempts : int
+            Maximum number of generations per story, the story with the highest confidence is returned
+        stop : Optional[list[str]]
+            The model stops generating when it writes one of the stop sequences, read from STORY_LLM_STOP environment
+            variable if None, see `stop_sequences`. Maximum number of generated tokens and temperature are set on the
+            backend, see `build_llm`.
+        stream : Optional[bool]
+            Streams the output of the model in `generate` and `agenerate` and stops reading as soon as the title and
+            two sentences are complete, read from STORY_LLM_STREAM environment variable if None (default is false).
+            Ignored for models that do not stream, see `supports_streaming`, their output only arrives whole.
+
+        """
+        from langchain.chains import LLMChain
+        from langchain.prompts import PromptTemplate
+
+        from src.llm_backends import build_llm, stop_sequences, supports_streaming
+
+        self._llm_model = llm if llm is not None else build_llm()
+        self._min_confidence = min_confidence
+        self._max_attempts = max_attempts
+        self._stop = stop if stop is not None else stop_sequences()
+        self._stream = (
+            stream
+            if stream is not None
+            else os.getenv("STORY_LLM_STREAM", "false").lower() == "true"
         )
-        self._story_prompt_template: PromptTemplate = PromptTemplate(
+        if self._stream and not supports_streaming(self._llm_model):
+            logger.warning(
+                "%s LLM does not stream its output, stories are generated in one call",
+                self._llm_model._llm_type,
+            )
+            self._stream = False
+        self._story_prompt_template = PromptTemplate(
             input_variables=["metrics"],
             template="Write a 2 sentence story. First sentence must include these phrases: {metrics}. "
             "Second sentence will define nature. Provide a Title at the beginning.",
         )
+        # chain holds the model client, building it once lets every call reuse the same HTTP session
+        self._story_llm_chain = LLMChain(
+            prompt=self._story_prompt_template, llm=self._llm_model, verbose=False
+        )
+
+    def warm_up(self) -> None:
+        """
+        Sends a short prompt to the model so that the hosted model is loaded before the first real request.
+
+        """
+        self._story_llm_chain.run("distance 1")
 
     def generate(self, activity: dict) -> Story:
         """
-        Generates story around 50 words and a title with https://huggingface.co/openchat/openchat-3.5-0106
-        model with the given activity metrics
+        Generates story around 50 words and a title with the given activity metrics. Default model is
+        https://huggingface.co/openchat/openchat-3.5-0106
 
         Parameters
         ----------
@@ -56,19 +133,211 @@ class AIStoryGenerator(AIGenerator):
             - `story_content`
 
         """
-        story_llm_chain = LLMChain(
-            prompt=self._story_prompt_template, llm=self._llm_model, verbose=False
+        prompt_metrics = self._render_metrics(activity)
+        best = None
+        for _ in range(self._max_attempts):
+            best = self._better(best, self._parse(self._complete(prompt_metrics)))
+            if best.confidence >= self._min_confidence:
+                break
+        return self._to_story(best)
+
+    async def agenerate(self, activity: dict) -> Story:
+        """
+        Async version of `generate`, the model is called without blocking the event loop.
+
+        """
+        prompt_metrics = self._render_metrics(activity)
+        best = None
+        for _ in range(self._max_attempts):
+            story = await self._acomplete(prompt_metrics)
+            best = self._better(best, self._parse(story))
+            if best.confidence >= self._min_confidence:
+                break
+        return self._to_story(best)
+
+    def generate_many(self, activities: list[dict]) -> list[Story]:
+        """
+        Generates stories of many activities with a single call to the model. Local backends run the prompts through
+        the model in batches, which is faster than generating the stories one by one. Stories with low parse confidence
+        are generated again together in the next call.
+
+        Parameters
+        ----------
+        activities : list[dict]
+            activities with the keys expected by `generate`
+
+        Returns
+        -------
+        list[Story]
+            one story per activity in input order
+
+        """
+        # stop sequences must be the same in every input of the batch
+        inputs = [
+            {"metrics": self._render_metrics(activity), "stop": self._stop}
+            for activity in activities
+        ]
+        best: list[Optional[ParsedStory]] = [None] * len(activities)
+        pending = list(range(len(activities)))
+        for _ in range(self._max_attempts):
+            results = self._story_llm_chain.apply([inputs[idx] for idx in pending])
+            for idx, result in zip(pending, results):
+                self._count_tokens(result["text"])
+                best[idx] = self._better(best[idx], self._parse(result["text"]))
+            pending = [
+                idx for idx in pending if best[idx].confidence < self._min_confidence
+            ]
+            if not pending:
+                break
+        return [self._to_story(parsed) for parsed in best]
+
+    def _complete(self, prompt_metrics: str) -> str:
+        llm = self._llm_model._llm_type
+        with timed(STAGE_SECONDS, stage="llm_generate"), timed(LLM_SECONDS, llm=llm):
+            if not self._stream:
+                text = self._story_llm_chain.invoke(
+                    {"metrics": prompt_metrics, "stop": self._stop}
+                )["text"]
+            else:
+                text = "".join(self._stream_chunks(prompt_metrics))
+        self._count_tokens(text)
+        return text
+
+    async def _acomplete(self, prompt_metrics: str) -> str:
+        llm = self._llm_model._llm_type
+        with timed(STAGE_SECONDS, stage="llm_generate"), timed(LLM_SECONDS, llm=llm):
+            if not self._stream:
+                result = await self._story_llm_chain.ainvoke(
+                    {"metrics": prompt_metrics, "stop": self._stop}
+                )
+                text = result["text"]
+            else:
+                text = await self._astream_text(prompt_metrics)
+        self._count_tokens(text)
+        return text
+
+    async def _astream_text(self, prompt_metrics: str) -> str:
+        text = ""
+        prompt = self._story_prompt_template.format(metrics=prompt_metrics)
+        chunks = self._llm_model.astream(prompt, stop=self._stop)
+        try:
+            async for chunk in chunks:
+                text += chunk
+                if story_is_complete(text):
+                    break
+        finally:
+            # async generators are not closed on break, closing stops the model
+            await chunks.aclose()
+        return text
+
+    def _count_tokens(self, text: str) -> None:
+        from src.llm_backends import count_tokens
+
+        LLM_TOKENS.inc(count_tokens(text), llm=self._llm_model._llm_type)
+
+    @staticmethod
+    def _parse(text: str) -> ParsedStory:
+        with timed(STAGE_SECONDS, stage="parse"):
+            return parse_story(text)
+
+    def stream(self, activity: dict) -> Iterator[str]:
+        """
+        Streams the output of the model for the given activity as it is generated, stops as soon as the title and two
+        sentences are complete. Output is not parsed nor generated again, see `parse_story`. A model that does not
+        stream, see `supports_streaming`, yields its whole output as a single chunk once it is generated.
+
+        Parameters
+        ----------
+        activity : dict
+            A dictionary containing activity with the keys expected by `generate`
+
+        Returns
+        -------
+        Iterator[str]
+            chunks of the model output
+
+        """
+        text = ""
+        for chunk in self._stream_chunks(self._render_metrics(activity)):
+            text += chunk
+            yield chunk
+        self._count_tokens(text)
+
+    def _stream_chunks(self, prompt_metrics: str) -> Iterator[str]:
+        text = ""
+        prompt = self._story_prompt_template.format(metrics=prompt_metrics)
+        # leaving the loop closes the stream, the model stops generating the rest of the output
+        for chunk in self._llm_model.stream(prompt, stop=self._stop):
+            text += chunk
+            yield chunk
+            if story_is_complete(text):
+                break
+
+    @staticmethod
+    def _better(best: Optional[ParsedStory], parsed: ParsedStory) -> ParsedStory:
+        if best is None or parsed.confidence > best.confidence:
+            return parsed
+        return best
+
+    @staticmethod
+    def _to_story(parsed: ParsedStory) -> Story:
+        return Story(story_title=parsed.story_title, story_content=parsed.story_content)
+
+    def cache_key(self, activity: dict) -> str:
+        """
+        Builds the story cache key of the given activity from model, prompt template, rendered metrics and generation
+        parameters.
+
+        Parameters
+        ----------
+        activity : dict
+            A dictionary containing activity with the keys expected by `generate`
+
+        Returns
+        -------
+        str
+            content-addressed cache key
+
+        """
+        return story_cache_key(self.cache_params(), activity)
+
+    def cache_params(self) -> dict:
+        """
+        Returns
+        -------
+        dict
+            model, prompt template and generation parameters a story depends on besides the activity metrics, see
+            `story_cache_key`
+
+        """
+        return {
+            "llm": self._llm_model._llm_type,
+            "template": self._story_prompt_template.template,
+            # model id and generation parameters of the backend
+            "params": self._llm_model._identifying_params,
+            "stop": self._stop,
+        }
+
+    @staticmethod
+    def _render_metrics(activity: dict) -> str:
+        # only the metrics go into the prompt, stored activities might also carry a previous story or a start date
+        return ", ".join(
+            f"{key} {activity[key]}" for key in METRIC_KEYS if key in activity
         )
-        metrics = activity.copy()
-        metrics.pop("activity_id")
-        prompt_metrics = ", ".join(f"{key} {value}" for key, value in metrics.items())
-        story = story_llm_chain.run(prompt_metrics)
-        title = story.split("Title: ")[1].split("\n")[0]
-        # Title always comes after "Title: "
-        content = sorted(story.split("\n\n"), key=lambda x: len(x), reverse=True)[0]
-        # LLM might continue to generate the story resulting in abruptly finishing sentences
-        # Get the logical text from the longest paragraph to have a meaningful story to read
-        return Story(story_title=title, story_content=content)
+
+
+def story_cache_key(params: dict, activity: dict) -> str:
+    """
+    Builds the story cache key of the given activity from the `cache_params` of a generator, so that keys can be built
+    without the generator, e.g. by `GenerationPool` whose generators live in worker processes.
+
+    """
+    payload = json.dumps(
+        {**params, "prompt_metrics": AIStoryGenerator._render_metrics(activity)},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
 
 
 class AIImageGenerator(AIGenerator):
@@ -0,0 +1,68 @@
+import os
+from typing import Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class PooledSession(requests.Session):
+    """
+    `requests.Session` that keeps up to `pool_size` keep-alive connections per host, so consecutive requests to the
+    same host reuse an open TCP+TLS connection instead of opening a new one.
+
+    Every request gets `timeout` unless it passes its own. Connection and read failures of idempotent requests are
+    retried by the transport adapter with exponential backoff. Responses are not retried by status, rate limited and
+    failed responses are left to the caller, see `StravaRateLimiter.retry_delay`.
+
+    """
+
+    def __init__(
+        self,
+        pool_size: int = 10,
+        timeout: Union[float, tuple[float, float]] = (3.05, 30.0),
+        max_retries: int = 3,
+        backoff_factor: float = 0.5,
+        keep_alive: bool = True,
+    ):
+        super().__init__()
+        self.timeout = timeout
+        adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=Retry(
+                total=max_retries,
+                status=0,
+                backoff_factor=backoff_factor,
+                raise_on_status=False,
+            ),
+        )
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+        if not keep_alive:
+            self.headers["Connection"] = "close"
+
+    @classmethod
+    def from_env(cls) -> "PooledSession":
+        """
+        Builds a session configured through environment variables:
+            - STRAVA_HTTP_POOL_SIZE: connections kept open per host, default is 10
+            - STRAVA_HTTP_CONNECT_TIMEOUT: seconds to wait for a connection, default is 3.05
+            - STRAVA_HTTP_READ_TIMEOUT: seconds to wait for a response, default is 30
+            - STRAVA_HTTP_MAX_RETRIES: retries of failed connections, default is 3
+            - STRAVA_HTTP_KEEP_ALIVE: false closes the connection after every request, default is true
+
+        """
+        return cls(
+            pool_size=int(os.getenv("STRAVA_HTTP_POOL_SIZE", "10")),
+            timeout=(
+                float(os.getenv("STRAVA_HTTP_CONNECT_TIMEOUT", "3.05")),
+                float(os.getenv("STRAVA_HTTP_READ_TIMEOUT", "30")),
+            ),
+            max_retries=int(os.getenv("STRAVA_HTTP_MAX_RETRIES", "3")),
+            keep_alive=os.getenv("STRAVA_HTTP_KEEP_ALIVE", "true").lower() == "true",
+        )
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(method, url, **kwargs)
@@ -0,0 +1,408 @@
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from pymongo import MongoClient, ReturnDocument
+
+from src.gateway import ActivityConflict, MongoDBGateway, NoResultFound, stamp_athlete
+from src.generators import AIGenerator
+from src.strava_client import (
+    StravaClient,
+    StravaClientPool,
+    ActivityNotFoundError,
+    AthleteNotAuthorizedError,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class JobNotFound(Exception):
+    pass
+
+
+class JobQueue:
+    """
+    MongoDB backed queue of story generation jobs with at-least-once delivery. A worker leases a job for
+    `visibility_timeout` seconds, if it does not complete or fail the job within the lease the job becomes visible to
+    other workers again. A worker extends the lease of a job that is still running, see `extend_lease`. Failed jobs and jobs with an expired lease are retried with exponential backoff until
+    `max_attempts` is reached.
+
+    Job statuses: `queued`, `running`, `succeeded`, `failed`
+
+    """
+
+    def __init__(
+        self,
+        uri: str,
+        db_name: str,
+        collection_name: str = "story_jobs",
+        visibility_timeout: float = 300.0,
+        max_attempts: int = 3,
+        backoff_seconds: float = 10.0,
+    ):
+        self._client = MongoClient(uri)
+        self._collection = self._client[db_name][collection_name]
+        self.visibility_timeout = visibility_timeout
+        self._max_attempts = max_attempts
+        self._backoff_seconds = backoff_seconds
+        self._collection.create_index("job_id", unique=True)
+        self._collection.create_index([("status", 1), ("available_at", 1)])
+
+    def enqueue(self, activity_id: int, athlete_id: Optional[int] = None) -> dict:
+        """
+        Adds a story generation job of the given activity to the queue.
+
+        Parameters
+        ----------
+        activity_id : int
+            The activity ID of the activity to generate a story for.
+        athlete_id : Optional[int]
+            The athlete the activity belongs to, the activity is read and fetched with the single-athlete client if
+            None.
+
+        Returns
+        -------
+        dict
+            The queued job.
+
+        """
+        now = self._now()
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "activity_id": activity_id,
+            "athlete_id": athlete_id,
+            "status": "queued",
+            "attempts": 0,
+            "available_at": now,
+            "lease_expires_at": None,
+            "result": None,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+        }
+        self._collection.insert_one(job.copy())
+        return job
+
+    def get(self, job_id: str) -> dict:
+        """
+        Retrieves the job with the given job ID.
+
+        Parameters
+        ----------
+        job_id : str
+            The job ID.
+
+        Returns
+        -------
+        dict
+            The job, excluding the "_id" field.
+
+        Raises
+        ------
+        JobNotFound
+            If there is no job with the given job ID.
+
+        """
+        job = self._collection.find_one({"job_id": job_id}, {"_id": 0})
+        if job is None:
+            raise JobNotFound(f"Job {job_id} not found")
+        return job
+
+    def lease(self, worker_id: str) -> Optional[dict]:
+        """
+        Leases the oldest available job. A job is available if it is queued and its backoff has passed. Jobs whose
+        lease has expired e.g. the worker that leased it died, are failed first like a failed attempt: queued again
+        with exponential backoff or failed if they have reached `max_attempts`.
+
+        Parameters
+        ----------
+        worker_id : str
+            ID of the worker leasing the job.
+
+        Returns
+        -------
+        Optional[dict]
+            The leased job, None if there is no available job.
+
+        """
+        now = self._now()
+        self._release_expired(now)
+        job = self._collection.find_one_and_update(
+            {"status": "queued", "available_at": {"$lte": now}},
+            {
+                "$set": {
+                    "status": "running",
+                    "worker_id": worker_id,
+                    "lease_expires_at": now
+                    + timedelta(seconds=self.visibility_timeout),
+                    "updated_at": now,
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("available_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+        if job is not None:
+            job.pop("_id")
+        return job
+
+    def extend_lease(self, job: dict) -> bool:
+        """
+        Extends the lease of the leased job by `visibility_timeout` seconds from now, so that a job that takes longer
+        than its lease is not leased and run again by another worker.
+
+        Parameters
+        ----------
+        job : dict
+            The leased job.
+
+        Returns
+        -------
+        bool
+            True if the lease was extended, False if the worker does not hold the lease anymore.
+
+        """
+        now = self._now()
+        result = self._collection.update_one(
+            {
+                "job_id": job["job_id"],
+                "worker_id": job["worker_id"],
+                "status": "running",
+            },
+            {
+                "$set": {
+                    "lease_expires_at": now
+                    + timedelta(seconds=self.visibility_timeout),
+                    "updated_at": now,
+                }
+            },
+        )
+        return result.matched_count == 1
+
+    def close(self) -> None:
+        self._client.close()
+
+    def complete(self, job: dict, result: dict) -> None:
+        """
+        Marks the leased job as succeeded.
+
+        Parameters
+        ----------
+        job : dict
+            The leased job.
+        result : dict
+            Result of the job.
+
+        Returns
+        -------
+        None
+
+        """
+        self._collection.update_one(
+            {"job_id": job["job_id"], "worker_id": job["worker_id"]},
+            {
+                "$set": {
+                    "status": "succeeded",
+                    "result": result,
+                    "error": None,
+                    "lease_expires_at": None,
+                    "updated_at": self._now(),
+                }
+            },
+        )
+
+    def fail(self, job: dict, error: str, retry: bool = True) -> None:
+        """
+        Marks the leased job as failed. The job is queued again with exponential backoff unless `retry` is False or
+        the job has reached `max_attempts`.
+
+        Parameters
+        ----------
+        job : dict
+            The leased job.
+        error : str
+            Description of the error.
+        retry : bool
+            Whether the job should be retried.
+
+        Returns
+        -------
+        None
+
+        """
+        self._release(
+            job,
+            error,
+            retry,
+            {"job_id": job["job_id"], "worker_id": job["worker_id"]},
+            self._now(),
+        )
+
+    def _release_expired(self, now: datetime) -> None:
+        expired = self._collection.find(
+            {"status": "running", "lease_expires_at": {"$lte": now}}, {"_id": 0}
+        )
+        for job in expired:
+            # matches only if no other worker has released or leased the job since it was read
+            self._release(
+                job,
+                f"Lease of worker {job['worker_id']} expired",
+                True,
+                {
+                    "job_id": job["job_id"],
+                    "status": "running",
+                    "lease_expires_at": job["lease_expires_at"],
+                },
+                now,
+            )
+
+    def _release(
+        self, job: dict, error: str, retry: bool, job_filter: dict, now: datetime
+    ) -> None:
+        update = {"error": error, "lease_expires_at": None, "updated_at": now}
+        if retry and job["attempts"] < self._max_attempts:
+            backoff = self._backoff_seconds * 2 ** (job["attempts"] - 1)
+            update.update(
+                status="queued", available_at=now + timedelta(seconds=backoff)
+            )
+        else:
+            update.update(status="failed")
+        self._collection.update_one(job_filter, {"$set": update})
+
+    @staticmethod
+    def _now() -> datetime:
+        # MongoDB stores datetimes in UTC without timezone information
+        return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class StoryJobWorker:
+    """
+    Drains the job queue. Each job reads the activity from DB (or from Strava if missing), generates its story and
+    stores it in DB, same as PUT /activities/{activity_id}/. Activities of jobs with an athlete are fetched with the
+    client of that athlete from `strava_client_pool`.
+
+    The lease of a running job is extended every `heartbeat_interval` seconds (a third of the visibility timeout by
+    default), so a long generation is not run twice.
+
+    """
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        gateway: MongoDBGateway,
+        strava_client: StravaClient,
+        story_generator: AIGenerator,
+        poll_interval: float = 1.0,
+        worker_id: Optional[str] = None,
+        strava_client_pool: Optional[StravaClientPool] = None,
+        heartbeat_interval: Optional[float] = None,
+    ):
+        self._queue = queue
+        self._gateway = gateway
+        self._strava_client = strava_client
+        self._strava_client_pool = strava_client_pool
+        self._story_generator = story_generator
+        self._poll_interval = poll_interval
+        self._worker_id = worker_id or uuid.uuid4().hex
+        self._heartbeat_interval = (
+            heartbeat_interval
+            if heartbeat_interval is not None
+            else queue.visibility_timeout / 3
+        )
+
+    def run(self, stop_event=None) -> None:
+        """
+        Processes jobs until `stop_event` is set, sleeps `poll_interval` seconds when the queue is empty. Errors of the
+        queue, e.g. MongoDB is unreachable, are logged and the job is leased again after `poll_interval` seconds.
+
+        """
+        while stop_event is None or not stop_event.is_set():
+            try:
+                processed = self.process_one()
+            except Exception:
+                logger.exception("Worker %s could not process a job", self._worker_id)
+                processed = False
+            if not processed:
+                time.sleep(self._poll_interval)
+
+    def process_one(self) -> bool:
+        """
+        Leases and processes a single job.
+
+        Returns
+        -------
+        bool
+            True if a job was processed, False if the queue was empty
+
+        """
+        job = self._queue.lease(self._worker_id)
+        if job is None:
+            return False
+        try:
+            with self._heartbeat(job):
+                result = self._generate_story(job["activity_id"], job.get("athlete_id"))
+        except (ActivityConflict, AthleteNotAuthorizedError) as e:
+            self._queue.fail(job, str(e), retry=False)
+        except ActivityNotFoundError:
+            self._queue.fail(
+                job,
+                f"Activity {job['activity_id']} not found in database nor in Strava Client",
+                retry=False,
+            )
+        except Exception as e:
+            self._queue.fail(job, repr(e))
+        else:
+            self._queue.complete(job, result)
+        return True
+
+    @contextmanager
+    def _heartbeat(self, job: dict):
+        stopped = threading.Event()
+
+        def extend():
+            while not stopped.wait(self._heartbeat_interval):
+                try:
+                    if not self._queue.extend_lease(job):
+                        logger.warning(
+                            "Worker %s lost the lease of job %s",
+                            self._worker_id,
+                            job["job_id"],
+                        )
+                        return
+                except Exception:
+                    # the lease is extended again on the next beat, it only expires if MongoDB stays unreachable
+                    logger.exception(
+                        "Could not extend the lease of job %s", job["job_id"]
+                    )
+
+        thread = threading.Thread(
+            target=extend, name=f"lease-{job['job_id']}", daemon=True
+        )
+        thread.start()
+        try:
+            yield
+        finally:
+            stopped.set()
+            thread.join()
+
+    def _generate_story(self, activity_id: int, athlete_id: Optional[int]) -> dict:
+        try:
+            activity = self._gateway.get(activity_id, athlete_id=athlete_id)
+        except NoResultFound:
+            activity = self._client_of(athlete_id).get_activity(activity_id)
+            self._gateway.save_one(stamp_athlete([activity], athlete_id)[0])
+        story = self._story_generator.generate(activity)
+        return self._gateway.update(activity, story.__dict__)
+
+    def _client_of(self, athlete_id: Optional[int]) -> StravaClient:
+        if athlete_id is None:
+            return self._strava_client
+        if self._strava_client_pool is None:
+            raise AthleteNotAuthorizedError(
+                f"Worker has no clients of athletes to serve athlete {athlete_id}"
+            )
+        return self._strava_client_pool.get(athlete_id)
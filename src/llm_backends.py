@@ -0,0 +1,236 @@
+import asyncio
+import json
+import os
+import random
+import re
+import time
+from typing import AsyncIterator, Callable, Iterator, Optional
+
+from langchain_community.llms import HuggingFaceHub
+from langchain_core.language_models.llms import BaseLLM, LLM
+from langchain_core.outputs import GenerationChunk
+from langchain_core.pydantic_v1 import PrivateAttr
+
+# a word with its leading whitespace stands for a token of the model output
+_TOKEN = re.compile(r"\s*\S+")
+
+
+class StubLLMError(Exception):
+    pass
+
+
+class StubLLM(LLM):
+    """
+    Deterministic offline LLM. Answers every prompt with a titled story that repeats the prompt, so that stories can
+    be generated and parsed without a model. Used by tests and benchmarks, `latency_seconds` simulates inference time
+    and `error_rate` of the calls fail with `StubLLMError`. Failures are drawn from a random generator seeded with
+    `seed`, so the same sequence of calls fails the same way every run.
+
+    Like a real model, the stub can keep writing `continuation_paragraphs` paragraphs after the story, it streams its
+    output word by word with `token_latency_seconds` per word and honours `max_new_tokens` and stop sequences. Async
+    calls sleep on the event loop, so unlike models without an async client they do not take a thread of the executor.
+
+    """
+
+    latency_seconds: float = 0.0
+    token_latency_seconds: float = 0.0
+    error_rate: float = 0.0
+    seed: int = 0
+    continuation_paragraphs: int = 0
+    max_new_tokens: Optional[int] = None
+    _random: random.Random = PrivateAttr(default=None)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._random = random.Random(self.seed)
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return {
+            "latency_seconds": self.latency_seconds,
+            "max_new_tokens": self.max_new_tokens,
+        }
+
+    def _call(
+        self, prompt: str, stop: Optional[list[str]] = None, run_manager=None, **kwargs
+    ) -> str:
+        tokens = self._start(prompt, stop)
+        time.sleep(self.token_latency_seconds * len(tokens))
+        return "".join(tokens)
+
+    async def _acall(
+        self, prompt: str, stop: Optional[list[str]] = None, run_manager=None, **kwargs
+    ) -> str:
+        await asyncio.sleep(self.latency_seconds)
+        tokens = self._draw(prompt, stop)
+        await asyncio.sleep(self.token_latency_seconds * len(tokens))
+        return "".join(tokens)
+
+    def _stream(
+        self, prompt: str, stop: Optional[list[str]] = None, run_manager=None, **kwargs
+    ) -> Iterator[GenerationChunk]:
+        for token in self._start(prompt, stop):
+            time.sleep(self.token_latency_seconds)
+            yield GenerationChunk(text=token)
+
+    async def _astream(
+        self, prompt: str, stop: Optional[list[str]] = None, run_manager=None, **kwargs
+    ) -> AsyncIterator[GenerationChunk]:
+        await asyncio.sleep(self.latency_seconds)
+        for token in self._draw(prompt, stop):
+            await asyncio.sleep(self.token_latency_seconds)
+            yield GenerationChunk(text=token)
+
+    def _start(self, prompt: str, stop: Optional[list[str]]) -> list[str]:
+        time.sleep(self.latency_seconds)
+        return self._draw(prompt, stop)
+
+    def _draw(self, prompt: str, stop: Optional[list[str]]) -> list[str]:
+        if self._random.random() < self.error_rate:
+            raise StubLLMError("Stub LLM failed to generate a story")
+        text = f"Title: A Stub Story\n\nThis is a story about {prompt}" + (
+            "\n\nThe next day, the story went on and on without an end."
+            * self.continuation_paragraphs
+        )
+        for stop_sequence in stop or []:
+            text = text.split(stop_sequence)[0]
+        return _TOKEN.findall(text)[: self.max_new_tokens]
+
+
+def count_tokens(text: str) -> int:
+    """
+    Approximates the number of tokens of a model output with its number of words, used to compare generation settings.
+
+    """
+    return len(_TOKEN.findall(text))
+
+
+def supports_streaming(llm: BaseLLM) -> bool:
+    """
+    Tells whether the LLM streams its output token by token. LangChain streams a model without its own `_stream`, e.g.
+    HuggingFaceHub, as a single chunk holding the whole output once it is generated.
+
+    """
+    return type(llm)._stream is not BaseLLM._stream
+
+
+def max_new_tokens() -> int:
+    return int(os.getenv("STORY_LLM_MAX_NEW_TOKENS", "128"))
+
+
+def temperature() -> Optional[float]:
+    value = os.getenv("STORY_LLM_TEMPERATURE")
+    return float(value) if value else None
+
+
+def stop_sequences() -> Optional[list[str]]:
+    """
+    Reads stop sequences of the story generator from STORY_LLM_STOP environment variable, a JSON list of strings e.g.
+    `["\\n\\nThe next day"]`. Generation stops as soon as the model writes one of them.
+
+    """
+    value = os.getenv("STORY_LLM_STOP")
+    return json.loads(value) if value else None
+
+
+def _huggingface_hub() -> BaseLLM:
+    model_kwargs = {"max_new_tokens": max_new_tokens()}
+    if temperature() is not None:
+        model_kwargs["temperature"] = temperature()
+    if stop_sequences():
+        # stops the generation on the server, LangChain only cuts the output after it is generated
+        model_kwargs["stop"] = stop_sequences()
+    return HuggingFaceHub(
+        repo_id=os.getenv("STORY_LLM_MODEL", "openchat/openchat-3.5-0106"),
+        model_kwargs=model_kwargs,
+    )
+
+
+def _transformers() -> BaseLLM:
+    # needs `transformers` and `torch`, the model is downloaded once and then loaded from the local cache
+    from langchain_community.llms import HuggingFacePipeline
+
+    pipeline_kwargs = {"max_new_tokens": max_new_tokens()}
+    if temperature() is not None:
+        pipeline_kwargs.update(do_sample=True, temperature=temperature())
+    return HuggingFacePipeline.from_model_id(
+        model_id=os.getenv("STORY_LLM_MODEL", "openchat/openchat-3.5-0106"),
+        task="text-generation",
+        device=-1,
+        batch_size=int(os.getenv("STORY_LLM_BATCH_SIZE", "4")),
+        pipeline_kwargs=pipeline_kwargs,
+    )
+
+
+def _llama_cpp() -> BaseLLM:
+    # needs `llama-cpp-python` and a GGUF model file
+    from langchain_community.llms import LlamaCpp
+
+    kwargs = {"temperature": temperature()} if temperature() is not None else {}
+    return LlamaCpp(
+        model_path=os.environ["STORY_LLM_MODEL_PATH"],
+        n_ctx=int(os.getenv("STORY_LLM_N_CTX", "2048")),
+        n_batch=int(os.getenv("STORY_LLM_BATCH_SIZE", "8")),
+        max_tokens=max_new_tokens(),
+        stop=stop_sequences() or [],
+        verbose=False,
+        **kwargs,
+    )
+
+
+def _stub() -> BaseLLM:
+    return StubLLM(
+        latency_seconds=float(os.getenv("STORY_LLM_STUB_LATENCY", "0")),
+        error_rate=float(os.getenv("STORY_LLM_STUB_ERROR_RATE", "0")),
+        seed=int(os.getenv("STORY_LLM_STUB_SEED", "0")),
+        token_latency_seconds=float(os.getenv("STORY_LLM_STUB_TOKEN_LATENCY", "0")),
+        continuation_paragraphs=int(
+            os.getenv("STORY_LLM_STUB_CONTINUATION_PARAGRAPHS", "0")
+        ),
+        max_new_tokens=max_new_tokens(),
+    )
+
+
+LLM_BACKENDS: dict[str, Callable[[], BaseLLM]] = {
+    "huggingface_hub": _huggingface_hub,
+    "transformers": _transformers,
+    "llama_cpp": _llama_cpp,
+    "stub": _stub,
+}
+
+
+def build_llm(backend: Optional[str] = None) -> BaseLLM:
+    """
+    Builds the LLM of the story generator.
+
+    Parameters
+    ----------
+    backend : Optional[str]
+        One of `LLM_BACKENDS`, read from STORY_LLM_BACKEND environment variable if None (default is huggingface_hub):
+            - huggingface_hub: remote inference through Hugging Face Inference API, needs HUGGINGFACEHUB_API_TOKEN
+            - transformers: local CPU inference of STORY_LLM_MODEL with a transformers pipeline, prompts are generated
+            in batches of STORY_LLM_BATCH_SIZE
+            - llama_cpp: local CPU inference of the GGUF model at STORY_LLM_MODEL_PATH with llama.cpp
+            - stub: deterministic offline stub, see `StubLLM`
+
+    Returns
+    -------
+    BaseLLM
+        the LangChain LLM of the backend
+
+    Raises
+    ------
+    ValueError
+        If the backend is unknown.
+
+    """
+    backend = backend or os.getenv("STORY_LLM_BACKEND", "huggingface_hub")
+    if backend not in LLM_BACKENDS:
+        raise ValueError(
+            f"Unknown LLM backend {backend}, expected one of {sorted(LLM_BACKENDS)}"
+        )
+    return LLM_BACKENDS[backend]()
@@ -0,0 +1,282 @@
+import asyncio
+import functools
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Optional
+
+# seconds, from a cached Mongo lookup to a slow LLM generation
+DEFAULT_BUCKETS = (
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+
+
+class Counter:
+    """
+    Monotonic counter with optional labels, e.g. Strava calls by status code.
+
+    """
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self._labelnames = labelnames
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = _label_values(self._labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_values(self._labelnames, labels), 0.0)
+
+    def samples(self) -> list[tuple[str, dict, float]]:
+        with self._lock:
+            values = list(self._values.items())
+        return [
+            (self.name, dict(zip(self._labelnames, key)), value)
+            for key, value in values
+        ]
+
+
+class Histogram:
+    """
+    Cumulative histogram of observed values with optional labels, e.g. latency of every stage of story generation.
+
+    """
+
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+        buckets: tuple = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self._labelnames = labelnames
+        self._buckets = tuple(buckets)
+        # per label values: count of every bucket (the last one is +Inf), sum of observations
+        self._values: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = _label_values(self._labelnames, labels)
+        bucket = bisect_left(self._buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [[0] * (len(self._buckets) + 1), 0.0]
+            counts[0][bucket] += 1
+            counts[1] += value
+
+    def count(self, **labels) -> int:
+        counts = self._values.get(_label_values(self._labelnames, labels))
+        return sum(counts[0]) if counts else 0
+
+    def samples(self) -> list[tuple[str, dict, float]]:
+        with self._lock:
+            values = [
+                (key, list(counts[0]), counts[1])
+                for key, counts in self._values.items()
+            ]
+        samples = []
+        for key, bucket_counts, total in values:
+            labels = dict(zip(self._labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self._buckets + ("+Inf",), bucket_counts):
+                cumulative += bucket_count
+                samples.append(
+                    (f"{self.name}_bucket", {**labels, "le": str(bound)}, cumulative)
+                )
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: dict[str, object] = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+        buckets: tuple = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """
+        Renders all metrics in Prometheus text exposition format.
+
+        Returns
+        -------
+        str
+            metrics to be served with `text/plain; version=0.0.4` content type
+
+        """
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# receives the timings of the current request when it is profiled, see `src.profiling.RequestProfile`
+timing_recorder: ContextVar = ContextVar("timing_recorder", default=None)
+
+
+class timed:
+    """
+    Observes the elapsed seconds of a block or of every call of a function in the given histogram, e.g.
+
+        with timed(STAGE_SECONDS, stage="parse"):
+            ...
+
+        @timed(MONGO_SECONDS, operation="get")
+        def get(...):
+            ...
+
+    Coroutine functions are timed until they return, not until the coroutine is created. Timings are also passed to
+    the `timing_recorder` of the current context if there is one, named after the labels e.g. "stage=parse".
+
+    """
+
+    def __init__(self, histogram: Histogram, **labels):
+        self._histogram = histogram
+        self._labels = labels
+        self._name = ",".join(f"{key}={value}" for key, value in labels.items())
+        self._start: Optional[float] = None
+
+    def __enter__(self):
+        self._start = self._begin()
+        return self
+
+    def __exit__(self, *exc):
+        self._end(self._start)
+        return False
+
+    def __call__(self, func):
+        # decorated functions might run in many threads at once, every call keeps its own start time
+        if asyncio.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                start = self._begin()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    self._end(start)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = self._begin()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._end(start)
+
+        return wrapper
+
+    @staticmethod
+    def _begin() -> float:
+        recorder = timing_recorder.get()
+        if recorder is not None:
+            recorder.enter()
+        return time.perf_counter()
+
+    def _end(self, start: float) -> None:
+        seconds = time.perf_counter() - start
+        self._histogram.observe(seconds, **self._labels)
+        recorder = timing_recorder.get()
+        if recorder is not None:
+            recorder.record(self._name, seconds)
+            recorder.exit()
+
+
+def _label_values(labelnames: tuple, labels: dict) -> tuple:
+    # label values are converted to strings when rendered, not on every observation
+    return tuple(map(labels.__getitem__, labelnames))
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return (
+        "{"
+        + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items())
+        + "}"
+    )
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "story_stage_seconds",
+    "Latency of the stages of story generation: mongo_get, strava_get_activity, llm_generate, parse, mongo_update, "
+    "generation_pool",
+    ("stage",),
+)
+MONGO_SECONDS = REGISTRY.histogram(
+    "mongo_operation_seconds", "Latency of MongoDB operations", ("operation",)
+)
+STRAVA_REQUESTS = REGISTRY.counter(
+    "strava_requests_total", "Strava API calls by status code", ("status_code",)
+)
+LLM_SECONDS = REGISTRY.histogram(
+    "llm_generation_seconds", "Latency of a single LLM generation", ("llm",)
+)
+LLM_TOKENS = REGISTRY.counter(
+    "llm_generated_tokens_total",
+    "Tokens generated by the LLM, approximated with words",
+    ("llm",),
+)
+GENERATION_POOL_REJECTIONS = REGISTRY.counter(
+    "generation_pool_rejected_total",
+    "Stories rejected because the generation pool was full",
+)
+STORY_CACHE_LOOKUPS = REGISTRY.counter(
+    "story_cache_lookups_total",
+    "Story cache lookups by result: memory_hit, persistent_hit or miss",
+    ("result",),
+)
@@ -0,0 +1,248 @@
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+from pymongo import DESCENDING, MongoClient
+from pymongo.errors import CollectionInvalid
+
+
+def _current_owner() -> tuple:
+    # the thread and, on an event loop, the task running the caller
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    return threading.get_ident(), task
+
+
+class RequestProfile:
+    """
+    Profile of a single request: time spent in every instrumented stage, see `src.metrics.timed`, and a sampled stack
+    profile of the code the request ran. The thread, and on an event loop the task, running the request is registered
+    while it is inside an instrumented block or the profiling middleware, and unregistered when it leaves. Threads of
+    the threadpool and the event loop are shared by requests, so a request is only sampled while it runs on them.
+
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: dict[str, list] = {}
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        # nesting depth of the instrumented blocks of every (thread ident, task) running the request
+        self._owners: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def enter(self) -> None:
+        owner = _current_owner()
+        with self._lock:
+            self._owners[owner] += 1
+
+    def exit(self) -> None:
+        owner = _current_owner()
+        with self._lock:
+            self._owners[owner] -= 1
+            if self._owners[owner] <= 0:
+                del self._owners[owner]
+
+    def record(self, name: str, seconds: float) -> None:
+        with self._lock:
+            stage = self.stages.setdefault(name, [0, 0.0])
+            stage[0] += 1
+            stage[1] += seconds
+
+    def owners(self) -> tuple:
+        with self._lock:
+            return tuple(self._owners)
+
+    def threads(self) -> tuple:
+        return tuple({ident for ident, _ in self.owners()})
+
+    def add_sample(self, stack: str) -> None:
+        with self._lock:
+            self.stacks[stack] += 1
+            self.samples += 1
+
+    def to_document(self, top_stacks: int = 50) -> dict:
+        """
+        Returns
+        -------
+        dict
+            `stages` with the `count` and total `ms` of every stage, `samples` and the `top_stacks` most sampled
+            `stacks` in folded format ("module:function;module:function", root first) with their sample counts
+
+        """
+        with self._lock:
+            return {
+                "stages": {
+                    name: {"count": count, "ms": round(seconds * 1000, 3)}
+                    for name, (count, seconds) in self.stages.items()
+                },
+                "samples": self.samples,
+                "stacks": self.stacks.most_common(top_stacks),
+            }
+
+
+class StackSampler:
+    """
+    Samples the stacks of the threads of active request profiles every `interval_seconds` from a daemon thread, like
+    py-spy does from outside the process. Sampling only reads the frames of registered threads, requests pay nothing
+    for it. An event loop thread is only sampled for the request whose task it is running at that moment.
+
+    """
+
+    def __init__(self, interval_seconds: float = 0.01, max_depth: int = 64):
+        self._interval_seconds = interval_seconds
+        self._max_depth = max_depth
+        self._profiles: set[RequestProfile] = set()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, profile: RequestProfile) -> None:
+        with self._lock:
+            self._profiles.add(profile)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="stack-sampler", daemon=True
+                )
+                self._thread.start()
+
+    def stop(self, profile: RequestProfile) -> None:
+        with self._lock:
+            self._profiles.discard(profile)
+
+    def sample(self) -> None:
+        with self._lock:
+            profiles = list(self._profiles)
+        if not profiles:
+            return
+        frames = sys._current_frames()
+        for profile in profiles:
+            for ident, task in profile.owners():
+                if (
+                    task is not None
+                    and asyncio.current_task(task.get_loop()) is not task
+                ):
+                    # the event loop runs another request, or waits for I/O
+                    continue
+                frame = frames.get(ident)
+                if frame is not None:
+                    profile.add_sample(self._fold(frame))
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self._interval_seconds)
+            self.sample()
+
+    def _fold(self, frame) -> str:
+        names = []
+        while frame is not None and len(names) < self._max_depth:
+            code = frame.f_code
+            module = frame.f_globals.get("__name__", code.co_filename)
+            names.append(f"{module}:{code.co_name}")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+
+class FileProfileStore:
+    """
+    Stores request profiles as JSON lines in `directory`/profiles.jsonl. The file is rotated to profiles.jsonl.1 when
+    it grows over `max_bytes`, so at most twice `max_bytes` are kept.
+
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 50 * 1024 * 1024):
+        self._path = os.path.join(directory, "profiles.jsonl")
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def save(self, profile: dict) -> None:
+        line = json.dumps(profile, default=str) + "\n"
+        with self._lock:
+            if (
+                os.path.exists(self._path)
+                and os.path.getsize(self._path) + len(line) > self._max_bytes
+            ):
+                os.replace(self._path, self._path + ".1")
+            with open(self._path, "a") as f:
+                f.write(line)
+
+    def slowest(self, limit: int = 10) -> list[dict]:
+        profiles = []
+        for path in (self._path + ".1", self._path):
+            if os.path.exists(path):
+                with open(path) as f:
+                    profiles.extend(json.loads(line) for line in f if line.strip())
+        return sorted(profiles, key=lambda x: x["duration_ms"], reverse=True)[:limit]
+
+
+class MongoProfileStore:
+    """
+    Stores request profiles in a capped MongoDB collection of `max_bytes`, MongoDB drops the oldest profiles when it
+    is full. Collection is created on the first use.
+
+    """
+
+    def __init__(
+        self,
+        uri: str,
+        db_name: str,
+        collection_name: str = "request_profiles",
+        max_bytes: int = 50 * 1024 * 1024,
+    ):
+        self._client = MongoClient(uri)
+        self._db = self._client[db_name]
+        self._collection_name = collection_name
+        self._max_bytes = max_bytes
+        self._collection = None
+
+    def save(self, profile: dict) -> None:
+        self._ensure_collection().insert_one(dict(profile))
+
+    def slowest(self, limit: int = 10) -> list[dict]:
+        return list(
+            self._ensure_collection()
+            .find({}, {"_id": 0})
+            .sort("duration_ms", DESCENDING)
+            .limit(limit)
+        )
+
+    def close(self) -> None:
+        self._client.close()
+
+    def _ensure_collection(self):
+        if self._collection is None:
+            try:
+                self._db.create_collection(
+                    self._collection_name, capped=True, size=self._max_bytes
+                )
+            except CollectionInvalid:
+                # already created by another worker
+                pass
+            collection = self._db[self._collection_name]
+            collection.create_index([("duration_ms", DESCENDING)])
+            self._collection = collection
+        return self._collection
+
+
+def build_profile_store():
+    """
+    Builds the profile store from PROFILE_STORE environment variable: `file` (default) keeps profiles in PROFILE_DIR
+    (default profiles), `mongo` keeps them in a capped collection of the MongoDB at MONGO_URI. Both are capped at
+    PROFILE_MAX_BYTES (default 50MB).
+
+    """
+    max_bytes = int(os.getenv("PROFILE_MAX_BYTES", str(50 * 1024 * 1024)))
+    if os.getenv("PROFILE_STORE", "file") == "mongo":
+        return MongoProfileStore(
+            uri=os.getenv("MONGO_URI", "mongodb://localhost:27017"),
+            db_name="activities",
+            max_bytes=max_bytes,
+        )
+    return FileProfileStore(os.getenv("PROFILE_DIR", "profiles"), max_bytes=max_bytes)
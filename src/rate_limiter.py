@@ -0,0 +1,282 @@
+import asyncio
+import math
+import random
+import threading
+import time
+from typing import Mapping, Optional
+
+
+class RateLimitExceededError(Exception):
+    def __init__(self, message: str, retry_after_seconds: Optional[int] = None):
+        super().__init__(message)
+        self.retry_after_seconds = retry_after_seconds
+
+
+def retry_after_seconds(
+    headers: Mapping[str, str], short_window: float = 15 * 60
+) -> int:
+    """
+    Estimates when a rate limited Strava request can be sent again from the headers of its response: the
+    `Retry-After` header if present, midnight UTC if the daily limit in `X-RateLimit-Usage` is used up, the next
+    short window boundary otherwise.
+
+    Parameters
+    ----------
+    headers : Mapping[str, str]
+        response headers
+    short_window : float
+        length of the short term window in seconds, default is 15 minutes
+
+    Returns
+    -------
+    int
+        seconds to wait, at least 1
+
+    """
+    seconds = _parse_retry_after(headers.get("Retry-After"))
+    if seconds is None:
+        limits = StravaRateLimiter._parse_header(headers.get("X-RateLimit-Limit"))
+        usages = StravaRateLimiter._parse_header(headers.get("X-RateLimit-Usage"))
+        if limits is not None and usages is not None and usages[1] >= limits[1]:
+            seconds = _seconds_until_midnight()
+        else:
+            seconds = _seconds_until_next_window(short_window)
+    return max(1, math.ceil(seconds))
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    # only the delay-seconds form is supported, an HTTP date is ignored
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def _seconds_until_next_window(window: float) -> float:
+    now = time.time()
+    return math.ceil(now / window) * window - now
+
+
+def _seconds_until_midnight() -> float:
+    return 24 * 60 * 60 - time.time() % (24 * 60 * 60)
+
+
+class StravaRateLimiter:
+    """
+    Token bucket that paces Strava API calls of all threads and coroutines of the process. The bucket holds at most
+    `short_limit` tokens and refills at `short_limit / short_window` tokens per second. Limits and usage reported by
+    Strava in `X-RateLimit-Limit` and `X-RateLimit-Usage` headers override the local estimate after every response.
+    No request waits longer than `max_backoff_seconds` for a token or for a retry, requests that would have to wait
+    longer, e.g. until the next window or the next day, fail fast with `RateLimitExceededError`.
+
+    Strava rate limits reset at natural 15-minute boundaries and at midnight UTC, more details available at:
+    https://developers.strava.com/docs/rate-limits/
+
+    """
+
+    def __init__(
+        self,
+        short_limit: int = 100,
+        daily_limit: int = 1000,
+        short_window: float = 15 * 60,
+        max_retries: int = 3,
+        backoff_seconds: float = 1.0,
+        max_backoff_seconds: float = 60.0,
+    ):
+        self._short_limit = short_limit
+        self._daily_limit = daily_limit
+        self._short_window = short_window
+        self._max_retries = max_retries
+        self._backoff_seconds = backoff_seconds
+        self._max_backoff_seconds = max_backoff_seconds
+        self._lock = threading.Lock()
+        self._tokens = float(short_limit)
+        self._updated_at = self._now()
+        self._short_usage = 0
+        self._daily_usage = 0
+        self._throttled_seconds = 0.0
+        self._retries = 0
+
+    @property
+    def max_retries(self) -> int:
+        return self._max_retries
+
+    def reserve(self) -> float:
+        """
+        Takes a token from the bucket.
+
+        Returns
+        -------
+        float
+            seconds the caller has to wait before sending the request
+
+        Raises
+        ------
+        RateLimitExceededError
+            If the daily limit is used up, or the request would wait longer than `max_backoff_seconds`.
+
+        """
+        with self._lock:
+            if self._daily_usage >= self._daily_limit:
+                raise RateLimitExceededError(
+                    "Strava daily rate limit is used up.",
+                    retry_after_seconds=math.ceil(_seconds_until_midnight()),
+                )
+            self._refill()
+            wait = max(0.0, (1 - self._tokens) / self._refill_rate)
+            if wait > self._max_backoff_seconds:
+                # the token is not taken, so a rejected request does not delay the next ones
+                raise RateLimitExceededError(
+                    f"Strava rate limit is used up for the next {math.ceil(wait)} seconds.",
+                    retry_after_seconds=math.ceil(wait),
+                )
+            self._tokens -= 1
+            self._daily_usage += 1
+            self._throttled_seconds += wait
+            return wait
+
+    def acquire(self) -> None:
+        """
+        Blocks the thread until a request can be sent.
+
+        """
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+
+    async def aacquire(self) -> None:
+        """
+        Async version of `acquire`, waits without blocking the event loop.
+
+        """
+        wait = self.reserve()
+        if wait:
+            await asyncio.sleep(wait)
+
+    def update(self, headers: Mapping[str, str]) -> None:
+        """
+        Synchronizes limits and usage with the rate limit headers of a Strava API response.
+
+        Parameters
+        ----------
+        headers : Mapping[str, str]
+            response headers
+
+        Returns
+        -------
+        None
+
+        """
+        limits = self._parse_header(headers.get("X-RateLimit-Limit"))
+        usages = self._parse_header(headers.get("X-RateLimit-Usage"))
+        if limits is None or usages is None:
+            return
+        with self._lock:
+            self._refill()
+            self._short_limit, self._daily_limit = limits
+            self._short_usage, self._daily_usage = usages
+            self._tokens = min(self._tokens, self._short_limit - self._short_usage)
+
+    def retry_delay(
+        self,
+        status_code: int,
+        attempt: int,
+        headers: Optional[Mapping[str, str]] = None,
+    ) -> Optional[float]:
+        """
+        Decides whether a response should be retried. A rate limited response is retried after its `Retry-After`
+        header, or at the next window boundary, only if that is within `max_backoff_seconds` and the daily limit is
+        not used up.
+
+        Parameters
+        ----------
+        status_code : int
+            response status code
+        attempt : int
+            number of attempts made so far, starting from 1
+        headers : Optional[Mapping[str, str]]
+            response headers, default is None
+
+        Returns
+        -------
+        Optional[float]
+            seconds to wait before retrying, None if the response should not be retried
+
+        """
+        if attempt > self._max_retries:
+            return None
+        if status_code == 429:
+            retry_after = _parse_retry_after((headers or {}).get("Retry-After"))
+            if retry_after is None:
+                # usage is only reset at the next window boundary
+                retry_after = _seconds_until_next_window(self._short_window)
+            with self._lock:
+                daily_used_up = self._daily_usage >= self._daily_limit
+            if daily_used_up or retry_after > self._max_backoff_seconds:
+                return None
+            delay = retry_after + random.uniform(0, self._backoff_seconds)
+        elif status_code >= 500:
+            # full jitter exponential backoff
+            delay = random.uniform(
+                0,
+                min(
+                    self._max_backoff_seconds,
+                    self._backoff_seconds * 2 ** (attempt - 1),
+                ),
+            )
+        else:
+            return None
+        with self._lock:
+            self._retries += 1
+            self._throttled_seconds += delay
+        return delay
+
+    def metrics(self) -> dict:
+        """
+        Returns the remaining budget and throttling metrics.
+
+        Returns
+        -------
+        dict
+            with `short_limit`, `short_usage`, `short_remaining`, `daily_limit`, `daily_usage`, `daily_remaining`,
+            `tokens`, `retries` and `throttled_seconds` keys
+
+        """
+        with self._lock:
+            self._refill()
+            return {
+                "short_limit": self._short_limit,
+                "short_usage": self._short_usage,
+                "short_remaining": max(0, self._short_limit - self._short_usage),
+                "daily_limit": self._daily_limit,
+                "daily_usage": self._daily_usage,
+                "daily_remaining": max(0, self._daily_limit - self._daily_usage),
+                "tokens": self._tokens,
+                "retries": self._retries,
+                "throttled_seconds": self._throttled_seconds,
+            }
+
+    @property
+    def _refill_rate(self) -> float:
+        return self._short_limit / self._short_window
+
+    def _refill(self) -> None:
+        now = self._now()
+        self._tokens = min(
+            self._short_limit,
+            self._tokens + (now - self._updated_at) * self._refill_rate,
+        )
+        self._updated_at = now
+
+    @staticmethod
+    def _parse_header(value: Optional[str]) -> Optional[tuple[int, int]]:
+        # e.g. "600,30000" short term and daily values
+        try:
+            short, daily = (int(part) for part in value.split(","))
+        except (AttributeError, ValueError):
+            return None
+        return short, daily
+
+    @staticmethod
+    def _now() -> float:
+        return time.monotonic()
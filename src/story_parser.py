@@ -0,0 +1,191 @@
+import re
+from dataclasses import dataclass
+from typing import Optional
+
+# "Title: ...", "**Title:** ...", "## Title - ..." anywhere in the output
+_TITLE_LABEL = re.compile(r"^[#*_\s]*title[*_\s]*[:\-–][*_\s]*(.*?)[*_\s]*$", re.I)
+# markdown heading anywhere in the output, the model might write a preamble before it
+_HEADING = re.compile(r"^#{1,6}\s+(.+?)[\s#]*$")
+# formats that only count as a title on the first line of the output
+_FIRST_LINE_TITLES = (
+    (re.compile(r"^\*\*(.+?)\*\*$"), 0.7),
+    (re.compile(r"^[\"“'](.+?)[\"”']$"), 0.7),
+)
+_STORY_LABEL = re.compile(r"^[#*_\s]*story[*_\s]*[:\-–][*_\s]*(.*)$", re.I)
+# end of a sentence: terminator, optional closing quotes or brackets, then whitespace or end of text
+_SENTENCE_END = re.compile(r"[.!?…][\"”’')\]]*(?=\s|$)")
+_TITLE_STRIP = " \t\"“”'*_#"
+
+LABEL_SCORE = 1.0
+HEADING_SCORE = 0.8
+FALLBACK_TITLE_SCORE = 0.3
+FALLBACK_TITLE_WORDS = 8
+TRIMMED_CONTENT_SCORE = 0.8
+INCOMPLETE_CONTENT_SCORE = 0.5
+
+
+@dataclass
+class ParsedStory:
+    story_title: str
+    story_content: str
+    confidence: float
+    title_score: float
+    content_score: float
+
+
+def parse_story(text: str) -> ParsedStory:
+    """
+    Parses the title and the story out of a raw LLM output in a single pass over its lines. Never raises, the quality
+    of the parse is reported as a confidence score instead.
+
+    Title is the line labelled "Title:" (also in bold or as a heading), otherwise a markdown heading, or a bold or
+    quoted line at the beginning of the output. Without any of them, the first words of the story become the title.
+    Story is the longest paragraph, trimmed after its last complete sentence because the model might stop in the
+    middle of a sentence.
+
+    Parameters
+    ----------
+    text : str
+        raw output of the model
+
+    Returns
+    -------
+    ParsedStory
+        title, story and `confidence` between 0 and 1, the product of `title_score` and `content_score`:
+            - title_score: 1.0 for a labelled title, 0.8 for a heading, 0.7 for a bold or quoted line and 0.3 when
+            the title is made up from the story
+            - content_score: 1.0 for a story of complete sentences, 0.8 when an unfinished sentence is trimmed and
+            0.5 when there is no complete sentence, 0.0 for an empty story
+
+    """
+    title: Optional[str] = None
+    title_score = 0.0
+    is_first_line = True
+    # "Title:" alone on a line, the title is on the next line
+    title_is_next = False
+    paragraph: list[str] = []
+    longest_paragraph = ""
+
+    for line in (text or "").splitlines() + [""]:
+        line = line.strip()
+        if not line:
+            if paragraph:
+                joined = " ".join(paragraph)
+                if len(joined) > len(longest_paragraph):
+                    longest_paragraph = joined
+                paragraph = []
+            continue
+        if title_is_next:
+            title, title_score = line, LABEL_SCORE
+            title_is_next = False
+            continue
+        label = _TITLE_LABEL.match(line)
+        if label and title_score < LABEL_SCORE:
+            if label.group(1).strip(_TITLE_STRIP):
+                title, title_score = label.group(1), LABEL_SCORE
+            else:
+                title_is_next = True
+            is_first_line = False
+            continue
+        heading = _HEADING.match(line)
+        if heading and title_score < HEADING_SCORE:
+            title, title_score = heading.group(1), HEADING_SCORE
+            is_first_line = False
+            continue
+        if is_first_line:
+            is_first_line = False
+            first_line_title = _first_line_title(line)
+            if first_line_title:
+                title, title_score = first_line_title
+                continue
+        story_label = _STORY_LABEL.match(line)
+        if story_label:
+            line = story_label.group(1).strip()
+            if not line:
+                continue
+        paragraph.append(line)
+
+    content, content_score = _complete_sentences(longest_paragraph)
+    title = (title or "").strip(_TITLE_STRIP)
+    if not title and content:
+        first_sentence = _SENTENCE_END.split(content, maxsplit=1)[0]
+        title = " ".join(first_sentence.split()[:FALLBACK_TITLE_WORDS])
+        title_score = FALLBACK_TITLE_SCORE
+    return ParsedStory(
+        story_title=title,
+        story_content=content,
+        confidence=round(title_score * content_score, 2),
+        title_score=title_score,
+        content_score=content_score,
+    )
+
+
+def _first_line_title(line: str) -> Optional[tuple[str, float]]:
+    for pattern, score in _FIRST_LINE_TITLES:
+        match = pattern.match(line)
+        if match:
+            return match.group(1), score
+    return None
+
+
+def _complete_sentences(paragraph: str) -> tuple[str, float]:
+    if not paragraph:
+        return "", 0.0
+    last_end = None
+    for last_end in _SENTENCE_END.finditer(paragraph):
+        pass
+    if last_end is None:
+        return paragraph, INCOMPLETE_CONTENT_SCORE
+    if last_end.end() == len(paragraph):
+        return paragraph, 1.0
+    return paragraph[: last_end.end()], TRIMMED_CONTENT_SCORE
+
+
+def story_is_complete(text: str, num_sentences: int = 2) -> bool:
+    """
+    Tells whether a partial LLM output already holds a title and `num_sentences` complete sentences, so that a
+    streamed generation can stop without waiting for the rest of the output.
+
+    Parameters
+    ----------
+    text : str
+        output of the model streamed so far
+    num_sentences : int
+        number of complete sentences the story needs
+
+    Returns
+    -------
+    bool
+        True if the title is found and the story has `num_sentences` complete sentences
+
+    """
+    parsed = parse_story(text)
+    if parsed.title_score <= FALLBACK_TITLE_SCORE:
+        return False
+    sentences = len(_SENTENCE_END.findall(parsed.story_content))
+    if text.endswith(parsed.story_content):
+        # a terminator at the very end might be the decimal point of a number still being written
+        sentences -= 1
+    return sentences >= num_sentences
+
+
+def streamed_title(text: str) -> Optional[str]:
+    """
+    Finds the title in a partial LLM output once the line holding it is complete, so that it can be shown before the
+    story is generated.
+
+    Parameters
+    ----------
+    text : str
+        output of the model streamed so far
+
+    Returns
+    -------
+    Optional[str]
+        the title, None until a title line is complete
+
+    """
+    parsed = parse_story(text[: text.rfind("\n") + 1])
+    if parsed.title_score <= FALLBACK_TITLE_SCORE or not parsed.story_title:
+        return None
+    return parsed.story_title
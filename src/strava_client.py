@@ -1,7 +1,31 @@
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from itertools import islice
+from typing import AsyncIterator, Iterator, Optional, Union
+
 from dotenv import load_dotenv
+import httpx
 import os
+import time
 import requests
-from requests import Response, HTTPError
+from requests import Response
+
+from src.http_session import PooledSession
+from src.metrics import STRAVA_REQUESTS
+from src.rate_limiter import (
+    StravaRateLimiter,
+    RateLimitExceededError,
+    retry_after_seconds,
+)
+from src.token_manager import (
+    ClientAuthenticationError,
+    FileTokenStore,
+    MongoTokenStore,
+    StravaTokenManager,
+)
 
 load_dotenv()
 
@@ -10,23 +34,53 @@ class ActivityNotFoundError(Exception):
     pass
 
 
-class ClientAuthenticationError(Exception):
+class ActivityBadRequestError(Exception):
     pass
 
 
-class ActivityBadRequestError(Exception):
+class AthleteNotAuthorizedError(Exception):
     pass
 
 
+class StravaServerError(Exception):
+    def __init__(self, message: str, retry_after_seconds: int = 30):
+        super().__init__(message)
+        self.retry_after_seconds = retry_after_seconds
+
+
 class StravaClient:
     _access_token_uri = "https://www.strava.com/oauth/token"
     _token_type = "Bearer"
-    _refresh_token = os.environ.get("STRAVA_REFRESH_TOKEN")
-    _access_token = None
     _first_call = True
+    # shared by all clients of the process, Strava rate limits are per application
+    _rate_limiter = StravaRateLimiter()
+    # shared by all clients of the process, keeps the connections to Strava API open between requests
+    _session = PooledSession.from_env()
+    _token_manager = StravaTokenManager(
+        refresh_token=os.environ.get("STRAVA_REFRESH_TOKEN"),
+        store=FileTokenStore(os.getenv("STRAVA_TOKEN_FILE", ".strava_token.json")),
+        session=_session,
+    )
 
-    def __init__(self, activity_uri: str = "https://www.strava.com/api/v3/activities/"):
+    def __init__(
+        self,
+        activity_uri: str = "https://www.strava.com/api/v3/activities/",
+        athlete_activities_uri: str = "https://www.strava.com/api/v3/athlete/activities",
+        athlete_uri: str = "https://www.strava.com/api/v3/athlete",
+        rate_limiter: Optional[StravaRateLimiter] = None,
+        token_manager: Optional[StravaTokenManager] = None,
+        session: Optional[requests.Session] = None,
+        athlete_id: Optional[int] = None,
+    ):
+        self._http = session if session is not None else self._session
+        if rate_limiter is not None:
+            self._rate_limiter = rate_limiter
+        if token_manager is not None:
+            self._token_manager = token_manager
         self._activity_uri = activity_uri
+        self._athlete_activities_uri = athlete_activities_uri
+        self._athlete_uri = athlete_uri
+        self._athlete_id = athlete_id
 
     @classmethod
     def authenticate(cls):
@@ -50,50 +104,45 @@ class StravaClient:
             "client_secret": os.getenv("STRAVA_CLIENT_SECRET"),
             "code": os.getenv("STRAVA_AUTHORIZATION_CODE"),
         }
-        response = requests.post(cls._access_token_uri, data=payload)
-        data = response.json()
-        cls._access_token = data["access_token"]
-        cls._refresh_token = data["refresh_token"]
+        response = cls._session.post(cls._access_token_uri, data=payload)
+        cls._token_manager.set_token(response.json())
         cls._first_call = False
 
     @classmethod
     def refresh_token(cls):
         """
-        This method refreshes the access token for the Strava API.
+        This method refreshes the access token for the Strava API. Access tokens are also refreshed automatically
+        before they expire and when Strava API rejects them, see `StravaTokenManager`.
 
         Note:
             This method requires environment variables:
                 - STRAVA_CLIENT_ID: The client ID for your Strava application
                 - STRAVA_CLIENT_SECRET: The client secret for your Strava application
-                - STRAVA_REFRESH_TOKEN: The refresh token for your Strava application
+                - STRAVA_REFRESH_TOKEN: The refresh token for your Strava application, only used if there is no
+                persisted token in STRAVA_TOKEN_FILE (default .strava_token.json)
 
         """
-        payload = {
-            "client_id": os.getenv("STRAVA_CLIENT_ID"),
-            "client_secret": os.getenv("STRAVA_CLIENT_SECRET"),
-            "refresh_token": cls._refresh_token,
-            "grant_type": "refresh_token",
-        }
-        response = requests.post(cls._access_token_uri, data=payload)
-        data = response.json()
-        cls._access_token = data["access_token"]
-        cls._refresh_token = data["refresh_token"]
+        cls._token_manager.refresh()
 
-    def get_most_recent_activities(self, num_recent_activities=3) -> list[dict]:
+    def get_most_recent_activities(
+        self, num_recent_activities: int = 3, per_page: int = 30
+    ) -> list[dict]:
         """
-        Gets most recent activities from Strava API. Assumes activities are sorted by date. It queries all the pages
-        until Strava API does not provide any data, because there is no metadata returned about pagination. Returns
+        Gets most recent activities from Strava API. Pages are requested newest-first and pagination stops as soon as
+        `num_recent_activities` activities are collected, so only the pages that are needed are queried. Returns
         parsed activities with only certain keys.
 
         Parameters
         ----------
         num_recent_activities: int
             default is 3
+        per_page: int
+            number of activities requested per page, default is 30 (Strava allows at most 200)
 
         Returns
         -------
         parsed_activities: list[dict]
-            activities that have the following keys:
+            activities sorted newest-first that have the following keys:
             - activity_id
             - distance
             - speed
@@ -101,23 +150,102 @@ class StravaClient:
             - elevation
 
         """
-        activities = []
+        return list(
+            islice(
+                self.iter_most_recent_activities(
+                    per_page=min(per_page, num_recent_activities)
+                ),
+                num_recent_activities,
+            )
+        )
+
+    def iter_most_recent_activities(self, per_page: int = 30) -> Iterator[dict]:
+        """
+        Lazily yields parsed activities from Strava API newest-first. A page is only requested once the previous one is
+        consumed, so callers that stop iterating early do not pay for the rest of the history.
+
+        Parameters
+        ----------
+        per_page: int
+            number of activities requested per page, default is 30 (Strava allows at most 200)
+
+        Yields
+        ------
+        dict
+            parsed activity with `activity_id`, `distance`, `speed`, `time` and `elevation` keys
+
+        """
+        # `before` makes Strava sort the activities newest-first
+        before = int(time.time())
+        page_number = 1
+        while True:
+            uri = (
+                f"{self._athlete_activities_uri}?before={before}"
+                f"&page={page_number}&per_page={per_page}"
+            )
+            response = self._get(uri)
+            self._handle_errors(response)
+            data = response.json()
+            for activity in data:
+                yield self._parse_response(activity)
+            if len(data) < per_page:
+                # a short page is the last page, no need for another round trip
+                break
+            page_number += 1
+
+    def iter_activities_after(self, after: int, per_page: int = 200) -> Iterator[dict]:
+        """
+        Lazily yields parsed activities that started after the given epoch timestamp, oldest-first. Used for
+        incremental syncs so that only the activities newer than the last synced one are downloaded.
+
+        Parameters
+        ----------
+        after: int
+            epoch timestamp in seconds, only activities started after it are returned
+        per_page: int
+            number of activities requested per page, default is 200 (maximum allowed by Strava)
+
+        Yields
+        ------
+        dict
+            parsed activity with `activity_id`, `distance`, `speed`, `time`, `elevation` and `start_date` (epoch
+            seconds) keys
+
+        """
         page_number = 1
         while True:
-            uri = f"{self._activity_uri}?page={page_number}"
-            header = {"Authorization": f"{self._token_type} {self._access_token}"}
-            response = requests.get(uri, headers=header)
+            uri = (
+                f"{self._athlete_activities_uri}?after={after}"
+                f"&page={page_number}&per_page={per_page}"
+            )
+            response = self._get(uri)
             self._handle_errors(response)
             data = response.json()
-            if len(data) == 0:
+            for activity in data:
+                parsed_activity = self._parse_response(activity)
+                parsed_activity["start_date"] = self._parse_start_date(
+                    activity["start_date"]
+                )
+                yield parsed_activity
+            if len(data) < per_page:
                 break
-            activities.extend(data)
             page_number += 1
-        most_recent_activities = activities[-1 * num_recent_activities :]
-        parsed_activities = [
-            self._parse_response(activity) for activity in most_recent_activities
-        ]
-        return parsed_activities
+
+    def get_athlete_id(self) -> int:
+        """
+        Gets the id of the authenticated athlete from Strava API. The id is cached after the first call.
+
+        Returns
+        -------
+        int
+            id of the athlete that the access token belongs to
+
+        """
+        if self._athlete_id is None:
+            response = self._get(self._athlete_uri)
+            self._handle_errors(response)
+            self._athlete_id = response.json()["id"]
+        return self._athlete_id
 
     def get_activity(self, activity_id) -> dict:
         """
@@ -139,10 +267,8 @@ class StravaClient:
             - elevation
 
         """
-        header = {"Authorization": f"{self._token_type} {self._access_token}"}
-        response = requests.get(
+        response = self._get(
             f"{self._activity_uri}{activity_id}?include_all_efforts=false",
-            headers=header,
         )
         self._handle_errors(response)
         data = response.json()
@@ -150,6 +276,83 @@ class StravaClient:
         result = self._parse_response(data)
         return result
 
+    def get_activities(
+        self, activity_ids: list[int], concurrency: int = 10
+    ) -> list[Union[dict, Exception]]:
+        """
+        Gets many activities from Strava API concurrently with at most `concurrency` requests in flight. Requests go
+        through the shared rate limiter like any other call, so the fan-out is paced to the remaining Strava budget.
+        Once the budget is used up, the remaining activities fail fast with `RateLimitExceededError` instead of
+        holding the threads until the next window. Keep `concurrency` at most `STRAVA_HTTP_POOL_SIZE` so that every
+        request reuses a pooled connection.
+
+        Parameters
+        ----------
+        activity_ids : list[int]
+            The IDs of the activities to retrieve.
+        concurrency : int
+            maximum number of requests in flight, default is 10
+
+        Returns
+        -------
+        list[Union[dict, Exception]]
+            one result per activity in input order, either the parsed activity (see `get_activity`) or the exception
+            raised while getting it e.g. `ActivityNotFoundError`
+
+        """
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return list(executor.map(self._get_activity_or_error, activity_ids))
+
+    def _get_activity_or_error(self, activity_id: int) -> Union[dict, Exception]:
+        # one failed activity must not fail the whole fan-out
+        try:
+            return self.get_activity(activity_id)
+        except Exception as e:
+            return e
+
+    def close(self) -> None:
+        """
+        Closes the open connections of the HTTP session. The session opens new connections if it is used again.
+
+        """
+        self._http.close()
+
+    def rate_limit_metrics(self) -> dict:
+        """
+        Returns remaining Strava API budget and throttling metrics of the shared rate limiter, see
+        `StravaRateLimiter.metrics`.
+
+        """
+        return self._rate_limiter.metrics()
+
+    def _get(self, uri: str, **kwargs) -> Response:
+        # paces requests with the shared rate limiter and retries rate limited and failed requests
+        # a rejected access token is refreshed once, concurrent callers share the same refresh
+        attempt = 1
+        token_refreshed = False
+        while True:
+            access_token = self._token_manager.get_access_token()
+            self._rate_limiter.acquire()
+            response = self._http.get(
+                uri, headers=self._auth_header(access_token), **kwargs
+            )
+            self._rate_limiter.update(response.headers)
+            STRAVA_REQUESTS.inc(status_code=response.status_code)
+            if response.status_code == 401 and not token_refreshed:
+                self._token_manager.refresh(stale_access_token=access_token)
+                token_refreshed = True
+                continue
+            delay = self._rate_limiter.retry_delay(
+                response.status_code, attempt, response.headers
+            )
+            if delay is None:
+                return response
+            time.sleep(delay)
+            attempt += 1
+
+    def _auth_header(self, access_token: str) -> dict:
+        return {"Authorization": f"{self._token_type} {access_token}"}
+
     @staticmethod
     def _parse_response(raw_response: dict) -> dict:
         return {
@@ -161,13 +364,312 @@ class StravaClient:
         }
 
     @staticmethod
-    def _handle_errors(response: Response):
-        try:
-            response.raise_for_status()
-        except HTTPError:
-            if response.status_code == 404:
-                raise ActivityNotFoundError(f"Activity not found on Strava.")
-            elif response.status_code == 400:
-                raise ActivityBadRequestError(response.text)
-            elif response.status_code == 401:
-                raise ClientAuthenticationError("Authentication has failed.")
+    def _parse_start_date(start_date) -> int:
+        # Strava returns ISO 8601 UTC dates e.g. "2018-02-16T14:52:54Z"
+        if isinstance(start_date, (int, float)):
+            return int(start_date)
+        return int(
+            datetime.fromisoformat(start_date.replace("Z", "+00:00")).timestamp()
+        )
+
+    @staticmethod
+    def _handle_errors(response: Union[Response, httpx.Response]):
+        # works for both requests and httpx responses
+        if response.status_code < 400:
+            return
+        if response.status_code == 404:
+            raise ActivityNotFoundError(f"Activity not found on Strava.")
+        elif response.status_code == 400:
+            raise ActivityBadRequestError(response.text)
+        elif response.status_code == 401:
+            raise ClientAuthenticationError("Authentication has failed.")
+        elif response.status_code == 429:
+            raise RateLimitExceededError(
+                "Strava rate limit is exceeded.",
+                retry_after_seconds=retry_after_seconds(response.headers),
+            )
+        elif response.status_code >= 500:
+            raise StravaServerError(response.text)
+
+
+class AsyncStravaClient(StravaClient):
+    """
+    Async counterpart of `StravaClient` built on a pooled `httpx.AsyncClient`. Shares the token state, parsing and
+    error handling with `StravaClient`. Call `aclose` when the client is not needed anymore.
+
+    """
+
+    def __init__(
+        self,
+        activity_uri: str = "https://www.strava.com/api/v3/activities/",
+        athlete_activities_uri: str = "https://www.strava.com/api/v3/athlete/activities",
+        athlete_uri: str = "https://www.strava.com/api/v3/athlete",
+        rate_limiter: Optional[StravaRateLimiter] = None,
+        max_connections: int = 100,
+        timeout: float = 10.0,
+        token_manager: Optional[StravaTokenManager] = None,
+        athlete_id: Optional[int] = None,
+        http_client: Optional[httpx.AsyncClient] = None,
+    ):
+        super().__init__(
+            activity_uri,
+            athlete_activities_uri,
+            athlete_uri,
+            rate_limiter,
+            token_manager=token_manager,
+            athlete_id=athlete_id,
+        )
+        self._http_client = http_client or httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+            timeout=timeout,
+        )
+
+    def for_athlete(self, client: StravaClient) -> "AsyncStravaClient":
+        """
+        Returns an async client of the athlete of the given client, e.g. one returned by `StravaClientPool.get`. It
+        shares the token manager of `client` and the connection pool of this client, it does not need to be closed.
+
+        """
+        return AsyncStravaClient(
+            self._activity_uri,
+            self._athlete_activities_uri,
+            self._athlete_uri,
+            self._rate_limiter,
+            token_manager=client._token_manager,
+            athlete_id=client._athlete_id,
+            http_client=self._http_client,
+        )
+
+    async def aclose(self) -> None:
+        await self._http_client.aclose()
+
+    async def get_most_recent_activities(
+        self, num_recent_activities: int = 3, per_page: int = 30
+    ) -> list[dict]:
+        """
+        Async version of `StravaClient.get_most_recent_activities`.
+
+        """
+        activities = []
+        if num_recent_activities <= 0:
+            return activities
+        async for activity in self.iter_most_recent_activities(
+            per_page=min(per_page, num_recent_activities)
+        ):
+            activities.append(activity)
+            if len(activities) == num_recent_activities:
+                break
+        return activities
+
+    async def iter_most_recent_activities(
+        self, per_page: int = 30
+    ) -> AsyncIterator[dict]:
+        """
+        Async version of `StravaClient.iter_most_recent_activities`.
+
+        """
+        params = {"before": int(time.time()), "per_page": per_page}
+        async for activity in self._iter_pages(params):
+            yield self._parse_response(activity)
+
+    async def iter_activities_after(
+        self, after: int, per_page: int = 200
+    ) -> AsyncIterator[dict]:
+        """
+        Async version of `StravaClient.iter_activities_after`.
+
+        """
+        params = {"after": after, "per_page": per_page}
+        async for activity in self._iter_pages(params):
+            parsed_activity = self._parse_response(activity)
+            parsed_activity["start_date"] = self._parse_start_date(
+                activity["start_date"]
+            )
+            yield parsed_activity
+
+    async def get_athlete_id(self) -> int:
+        """
+        Async version of `StravaClient.get_athlete_id`.
+
+        """
+        if self._athlete_id is None:
+            response = await self._aget(self._athlete_uri)
+            self._handle_errors(response)
+            self._athlete_id = response.json()["id"]
+        return self._athlete_id
+
+    async def get_activity(self, activity_id) -> dict:
+        """
+        Async version of `StravaClient.get_activity`.
+
+        """
+        response = await self._aget(
+            f"{self._activity_uri}{activity_id}?include_all_efforts=false",
+        )
+        self._handle_errors(response)
+        data = response.json()
+        data.update({"id": activity_id})
+        return self._parse_response(data)
+
+    async def get_activities(
+        self, activity_ids: list[int], concurrency: int = 10
+    ) -> list[Union[dict, Exception]]:
+        """
+        Async version of `StravaClient.get_activities`.
+
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def get_activity_or_error(activity_id: int) -> Union[dict, Exception]:
+            async with semaphore:
+                try:
+                    return await self.get_activity(activity_id)
+                except Exception as e:
+                    return e
+
+        return list(
+            await asyncio.gather(
+                *(get_activity_or_error(activity_id) for activity_id in activity_ids)
+            )
+        )
+
+    async def _iter_pages(self, params: dict) -> AsyncIterator[dict]:
+        page_number = 1
+        while True:
+            response = await self._aget(
+                self._athlete_activities_uri,
+                params={**params, "page": page_number},
+            )
+            self._handle_errors(response)
+            data = response.json()
+            for activity in data:
+                yield activity
+            if len(data) < params["per_page"]:
+                break
+            page_number += 1
+
+    async def _aget(self, uri: str, **kwargs) -> httpx.Response:
+        attempt = 1
+        token_refreshed = False
+        while True:
+            access_token = await self._token_manager.aget_access_token()
+            await self._rate_limiter.aacquire()
+            response = await self._http_client.get(
+                uri, headers=self._auth_header(access_token), **kwargs
+            )
+            self._rate_limiter.update(response.headers)
+            STRAVA_REQUESTS.inc(status_code=response.status_code)
+            if response.status_code == 401 and not token_refreshed:
+                await asyncio.to_thread(self._token_manager.refresh, access_token)
+                token_refreshed = True
+                continue
+            delay = self._rate_limiter.retry_delay(
+                response.status_code, attempt, response.headers
+            )
+            if delay is None:
+                return response
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+class StravaClientPool:
+    """
+    Bounded LRU pool of per-athlete `StravaClient`s. Token pairs of athletes are stored in MongoDB, all clients share
+    one HTTP session and the process-wide rate limiter. Least recently used clients are evicted when the pool is full,
+    they are rebuilt from their stored tokens on the next use.
+
+    """
+
+    def __init__(
+        self,
+        gateway,
+        max_size: int = 1000,
+        session: Optional[requests.Session] = None,
+        **client_kwargs,
+    ):
+        self._gateway = gateway
+        self._max_size = max_size
+        self._session = session if session is not None else StravaClient._session
+        self._client_kwargs = client_kwargs
+        self._clients: OrderedDict[int, StravaClient] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, athlete_id: int) -> StravaClient:
+        """
+        Returns the client of the given athlete.
+
+        Parameters
+        ----------
+        athlete_id : int
+            The Strava athlete ID.
+
+        Returns
+        -------
+        StravaClient
+            client authenticated with the tokens of the athlete
+
+        Raises
+        ------
+        AthleteNotAuthorizedError
+            If the athlete has no stored tokens, see `authenticate`.
+
+        """
+        with self._lock:
+            client = self._clients.get(athlete_id)
+            if client is not None:
+                self._clients.move_to_end(athlete_id)
+                return client
+            # checked before the token store is touched, locking a token upserts a placeholder document
+            if self._gateway.get_token(athlete_id) is None:
+                raise AthleteNotAuthorizedError(
+                    f"Athlete {athlete_id} has not authorized the app"
+                )
+            client = StravaClient(
+                token_manager=StravaTokenManager(
+                    store=MongoTokenStore(self._gateway, athlete_id),
+                    session=self._session,
+                ),
+                session=self._session,
+                athlete_id=athlete_id,
+                **self._client_kwargs,
+            )
+            self._clients[athlete_id] = client
+            while len(self._clients) > self._max_size:
+                self._clients.popitem(last=False)
+            return client
+
+    def authenticate(self, code: str) -> int:
+        """
+        Exchanges the authorization code of an athlete for a token pair and stores it.
+
+        Parameters
+        ----------
+        code : str
+            Code obtained through redirected web uri, see `StravaClient.authenticate`
+
+        Returns
+        -------
+        int
+            ID of the authenticated athlete
+
+        """
+        payload = {
+            "client_id": os.getenv("STRAVA_CLIENT_ID"),
+            "client_secret": os.getenv("STRAVA_CLIENT_SECRET"),
+            "code": code,
+            "grant_type": "authorization_code",
+        }
+        response = self._session.post(StravaClient._access_token_uri, data=payload)
+        StravaClient._handle_errors(response)
+        data = response.json()
+        athlete_id = data["athlete"]["id"]
+        self._gateway.save_token(athlete_id, data)
+        with self._lock:
+            self._clients.pop(athlete_id, None)
+        return athlete_id
+
+    def close(self) -> None:
+        self._session.close()
@@ -0,0 +1,249 @@
+import asyncio
+import fcntl
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+import requests
+
+
+class ClientAuthenticationError(Exception):
+    pass
+
+
+class FileTokenStore:
+    """
+    Persists the Strava token pair in a JSON file, so that restarted workers reuse a valid access token instead of
+    refreshing it on boot. A lock file next to it serializes refreshes of the processes on the same host.
+
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+
+    def load(self) -> Optional[dict]:
+        try:
+            with open(self._path) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def save(self, token: dict) -> None:
+        # write then rename so that readers never see a partially written file
+        tmp_path = f"{self._path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(token, f)
+        os.replace(tmp_path, self._path)
+
+    @contextmanager
+    def lock(self):
+        with open(f"{self._path}.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class MongoTokenStore:
+    """
+    Persists the Strava token pair of an athlete in MongoDB through `MongoDBGateway`. A lock document with a TTL
+    serializes refreshes of all processes and hosts.
+
+    """
+
+    def __init__(
+        self,
+        gateway,
+        athlete_id: int,
+        lock_ttl_seconds: float = 30.0,
+        lock_poll_interval: float = 0.1,
+    ):
+        self._gateway = gateway
+        self._athlete_id = athlete_id
+        self._lock_ttl_seconds = lock_ttl_seconds
+        self._lock_poll_interval = lock_poll_interval
+
+    def load(self) -> Optional[dict]:
+        return self._gateway.get_token(self._athlete_id)
+
+    def save(self, token: dict) -> None:
+        self._gateway.save_token(self._athlete_id, token)
+
+    @contextmanager
+    def lock(self):
+        owner = uuid.uuid4().hex
+        while not self._gateway.try_lock_token(
+            self._athlete_id, owner, self._lock_ttl_seconds
+        ):
+            time.sleep(self._lock_poll_interval)
+        try:
+            yield
+        finally:
+            self._gateway.release_token_lock(self._athlete_id, owner)
+
+
+class StravaTokenManager:
+    """
+    Holds the Strava access and refresh tokens. Access token is refreshed proactively `refresh_margin` seconds before
+    it expires. Refreshes are single-flight: one thread refreshes while the others wait for its result, and with a
+    `store` the processes sharing the store do the same.
+
+    Note:
+        Refresh requires environment variables:
+            - STRAVA_CLIENT_ID: The client ID for your Strava application
+            - STRAVA_CLIENT_SECRET: The client secret for your Strava application
+
+    """
+
+    def __init__(
+        self,
+        refresh_token: Optional[str] = None,
+        access_token: Optional[str] = None,
+        expires_at: float = 0,
+        store: Optional[FileTokenStore] = None,
+        refresh_margin: float = 300,
+        access_token_uri: str = "https://www.strava.com/oauth/token",
+        session: Optional[requests.Session] = None,
+    ):
+        self._refresh_token = refresh_token
+        self._access_token = access_token
+        self._expires_at = expires_at
+        self._store = store
+        self._refresh_margin = refresh_margin
+        self._access_token_uri = access_token_uri
+        self._http = session if session is not None else requests
+        self._lock = threading.Lock()
+        if store is not None:
+            self._load(store.load())
+
+    @property
+    def access_token(self) -> Optional[str]:
+        return self._access_token
+
+    @property
+    def refresh_token(self) -> Optional[str]:
+        return self._refresh_token
+
+    def get_access_token(self) -> str:
+        """
+        Returns a valid access token, refreshes it first if it is about to expire. Raises
+        `ClientAuthenticationError` if Strava rejects the refresh.
+
+        """
+        if self._needs_refresh():
+            self._refresh_if(self._needs_refresh)
+        return self._access_token
+
+    async def aget_access_token(self) -> str:
+        """
+        Async version of `get_access_token`, refresh runs in a worker thread.
+
+        """
+        if self._needs_refresh():
+            await asyncio.to_thread(self._refresh_if, self._needs_refresh)
+        return self._access_token
+
+    def refresh(self, stale_access_token: Optional[str] = None) -> None:
+        """
+        Refreshes the access token. If `stale_access_token` is given and the access token has already been replaced
+        by another thread or process, no request is sent.
+
+        Parameters
+        ----------
+        stale_access_token : Optional[str]
+            the access token that turned out to be expired or rejected
+
+        Returns
+        -------
+        None
+
+        Raises
+        ------
+        ClientAuthenticationError
+            If Strava rejects the refresh token.
+
+        """
+        self._refresh_if(
+            lambda: stale_access_token is None
+            or self._access_token == stale_access_token
+            or self._needs_refresh()
+        )
+
+    def _refresh_if(self, should_refresh: Callable[[], bool]) -> None:
+        # `should_refresh` is checked again after every lock, the caller might have waited for another refresh
+        with self._lock:
+            if not should_refresh():
+                return
+            if self._store is None:
+                self._request_refresh()
+                return
+            with self._store.lock():
+                # another process might have refreshed and rotated the refresh token meanwhile
+                self._load(self._store.load())
+                if not should_refresh():
+                    return
+                self._request_refresh()
+                self._store.save(self._as_dict())
+
+    def set_token(self, data: dict) -> None:
+        """
+        Stores the tokens of a Strava OAuth token response.
+
+        Parameters
+        ----------
+        data : dict
+            Strava OAuth response with `access_token`, `refresh_token` and `expires_at` keys
+
+        Returns
+        -------
+        None
+
+        """
+        with self._lock:
+            self._load(data)
+            if self._store is not None:
+                self._store.save(self._as_dict())
+
+    def _needs_refresh(self) -> bool:
+        return (
+            self._access_token is None
+            or time.time() >= self._expires_at - self._refresh_margin
+        )
+
+    def _request_refresh(self) -> None:
+        payload = {
+            "client_id": os.getenv("STRAVA_CLIENT_ID"),
+            "client_secret": os.getenv("STRAVA_CLIENT_SECRET"),
+            "refresh_token": self._refresh_token,
+            "grant_type": "refresh_token",
+        }
+        response = self._http.post(self._access_token_uri, data=payload)
+        if not response.ok:
+            # e.g. {"message": "Bad Request", "errors": [{"field": "refresh_token", "code": "invalid"}]}
+            try:
+                message = response.json()
+            except ValueError:
+                message = response.text
+            raise ClientAuthenticationError(
+                f"Strava rejected the token refresh ({response.status_code}): {message}"
+            )
+        self._load(response.json())
+
+    def _load(self, data: Optional[dict]) -> None:
+        if not data:
+            return
+        self._access_token = data["access_token"]
+        self._refresh_token = data["refresh_token"]
+        self._expires_at = data.get("expires_at", 0)
+
+    def _as_dict(self) -> dict:
+        return {
+            "access_token": self._access_token,
+            "refresh_token": self._refresh_token,
+            "expires_at": self._expires_at,
+        }
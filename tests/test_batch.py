@@ -0,0 +1,169 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from src.batch import BatchStoryGenerator
+from src.cache import StoryCache
+from src.generators import Story
+from src.rate_limiter import RateLimitExceededError
+from src.strava_client import ActivityNotFoundError
+
+
+class SlowStoryGenerator:
+    def __init__(self, latency: dict):
+        self._latency = latency
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def cache_key(self, activity: dict) -> str:
+        return str(activity["activity_id"])
+
+    async def agenerate(self, activity: dict) -> Story:
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(self._latency.get(activity["activity_id"], 0.01))
+        self.in_flight -= 1
+        return Story(f"title {activity['activity_id']}", "content")
+
+
+@pytest.fixture
+def mock_gateway():
+    gateway = AsyncMock()
+    gateway.get_many.return_value = [{"activity_id": 1}, {"activity_id": 2}]
+    return gateway
+
+
+@pytest.fixture
+def mock_strava_client():
+    strava_client = AsyncMock()
+
+    async def get_activities(activity_ids, concurrency=10):
+        # like the client, failures are returned per activity in input order
+        errors = {
+            404: ActivityNotFoundError(),
+            429: RateLimitExceededError("Strava rate limit is exceeded."),
+        }
+        return [
+            errors.get(activity_id, {"activity_id": activity_id})
+            for activity_id in activity_ids
+        ]
+
+    strava_client.get_activities.side_effect = get_activities
+    return strava_client
+
+
+def test_generate(mock_gateway, mock_strava_client):
+    batch_generator = BatchStoryGenerator(
+        gateway=mock_gateway,
+        strava_client=mock_strava_client,
+        story_generator=SlowStoryGenerator({2: 1.0}),
+        concurrency=2,
+        timeout=0.2,
+    )
+
+    results = asyncio.run(batch_generator.generate([3, 1, 404, 2, 1]))
+
+    assert [(result["activity_id"], result["status"]) for result in results] == [
+        (3, "generated"),
+        (1, "generated"),
+        (404, "not_found"),
+        (2, "timeout"),
+    ]
+    mock_gateway.get_many.assert_awaited_once_with([3, 1, 404, 2], athlete_id=None)
+    mock_gateway.bulk_save.assert_awaited_once_with([{"activity_id": 3}])
+    mock_gateway.bulk_update.assert_awaited_once_with(
+        {
+            3: {"story_title": "title 3", "story_content": "content"},
+            1: {"story_title": "title 1", "story_content": "content"},
+        },
+        athlete_id=None,
+    )
+
+
+def test_generate_respects_concurrency(mock_gateway, mock_strava_client):
+    mock_gateway.get_many.return_value = [{"activity_id": idx} for idx in range(10)]
+    story_generator = SlowStoryGenerator({})
+    batch_generator = BatchStoryGenerator(
+        gateway=mock_gateway,
+        strava_client=mock_strava_client,
+        story_generator=story_generator,
+        concurrency=3,
+    )
+
+    results = asyncio.run(batch_generator.generate(list(range(10))))
+
+    assert all(result["status"] == "generated" for result in results)
+    assert story_generator.max_in_flight == 3
+
+
+def test_generate_unprocessed_uses_cache(mock_gateway, mock_strava_client):
+    mock_gateway.get_unprocessed_activities.return_value = [
+        {"activity_id": 1},
+        {"activity_id": 2},
+    ]
+    story_cache = StoryCache()
+    story_cache.set("1", Story("cached title", "cached content"))
+    story_generator = MagicMock(wraps=SlowStoryGenerator({}))
+    batch_generator = BatchStoryGenerator(
+        gateway=mock_gateway,
+        strava_client=mock_strava_client,
+        story_generator=story_generator,
+        story_cache=story_cache,
+    )
+
+    results = asyncio.run(batch_generator.generate_unprocessed(limit=10))
+
+    assert [result["status"] for result in results] == ["cached", "generated"]
+    assert results[0]["story_title"] == "cached title"
+    mock_gateway.get_unprocessed_activities.assert_awaited_once_with(
+        limit=10, athlete_id=None
+    )
+    mock_strava_client.get_activities.assert_not_awaited()
+
+
+def test_generate_reports_strava_errors_per_activity(mock_gateway, mock_strava_client):
+    batch_generator = BatchStoryGenerator(
+        gateway=mock_gateway,
+        strava_client=mock_strava_client,
+        story_generator=SlowStoryGenerator({}),
+    )
+
+    results = asyncio.run(batch_generator.generate([429, 1, 3]))
+
+    assert [(result["activity_id"], result["status"]) for result in results] == [
+        (429, "failed"),
+        (1, "generated"),
+        (3, "generated"),
+    ]
+    assert "Strava rate limit is exceeded." in results[0]["detail"]
+    mock_gateway.bulk_save.assert_awaited_once_with([{"activity_id": 3}])
+
+
+def test_generate_of_athlete(mock_gateway, mock_strava_client):
+    async def get_many(activity_ids, athlete_id=None):
+        # activity 1 is saved for the athlete, activity 2 for another athlete
+        if athlete_id is None:
+            return [{"activity_id": 2}]
+        return [{"activity_id": 1, "athlete_id": athlete_id}]
+
+    mock_gateway.get_many.side_effect = get_many
+    batch_generator = BatchStoryGenerator(
+        gateway=mock_gateway,
+        strava_client=mock_strava_client,
+        story_generator=SlowStoryGenerator({}),
+        athlete_id=7,
+    )
+
+    results = asyncio.run(batch_generator.generate([1, 2, 3]))
+
+    assert [(result["activity_id"], result["status"]) for result in results] == [
+        (1, "generated"),
+        (2, "conflict"),
+        (3, "generated"),
+    ]
+    mock_strava_client.get_activities.assert_awaited_once_with([3], concurrency=4)
+    mock_gateway.bulk_save.assert_awaited_once_with(
+        [{"activity_id": 3, "athlete_id": 7}]
+    )
+    assert mock_gateway.bulk_update.await_args.kwargs == {"athlete_id": 7}
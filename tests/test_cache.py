@@ -0,0 +1,80 @@
+import asyncio
+from unittest.mock import patch, AsyncMock
+
+import mongomock
+import pytest
+
+from src.cache import StoryCache
+from src.gateway import MongoDBGateway
+from src.generators import Story
+
+
+@pytest.fixture
+def mock_gateway():
+    with patch("src.gateway.MongoClient", mongomock.MongoClient):
+        yield MongoDBGateway(
+            uri="mongodb://localhost:27017",
+            db_name="activities",
+            collection_name="activity_collection",
+        )
+
+
+def test_get_miss_then_hit():
+    cache = StoryCache(max_size=2)
+    story = Story("title", "content")
+
+    assert cache.get("key") is None
+    cache.set("key", story)
+
+    assert cache.get("key") == story
+    stats = cache.stats()
+    assert stats["memory_hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["hit_rate"] == 0.5
+
+
+def test_least_recently_used_is_evicted():
+    cache = StoryCache(max_size=2)
+    cache.set("first", Story("first", "content"))
+    cache.set("second", Story("second", "content"))
+    cache.get("first")
+
+    cache.set("third", Story("third", "content"))
+
+    assert cache.get("second") is None
+    assert cache.get("first") == Story("first", "content")
+    assert cache.stats()["size"] == 2
+
+
+def test_persistent_hit_is_promoted(mock_gateway):
+    StoryCache(store=mock_gateway).set("key", Story("title", "content"))
+    cache = StoryCache(store=mock_gateway)
+
+    assert cache.get("key") == Story("title", "content")
+    assert cache.get("key") == Story("title", "content")
+    stats = cache.stats()
+    assert stats["persistent_hits"] == 1
+    assert stats["memory_hits"] == 1
+
+
+def test_story_cache_ttl_index(mock_gateway):
+    index = mock_gateway._story_cache_collection.index_information()["created_at_1"]
+
+    assert index["expireAfterSeconds"] == 30 * 24 * 60 * 60
+
+
+def test_async_persistent_tier():
+    store = AsyncMock()
+    store.get_cached_story.return_value = {
+        "story_title": "title",
+        "story_content": "content",
+    }
+    cache = StoryCache(store=store)
+
+    story = asyncio.run(cache.aget("key"))
+    asyncio.run(cache.aset("other", Story("other", "content")))
+
+    assert story == Story("title", "content")
+    store.save_cached_story.assert_awaited_once_with(
+        "other", {"story_title": "other", "story_content": "content"}
+    )
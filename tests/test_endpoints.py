@@ -1,12 +1,62 @@
-from unittest.mock import patch
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch, AsyncMock, MagicMock
 
+import mongomock
+from mongomock.store import ServerStore
+import pytest
 from fastapi.testclient import TestClient
+from app.data_models import PROCESSED_ACTIVITY_FIELDS
+from app.dependencies import (
+    get_async_gateway,
+    get_async_story_cache,
+    get_async_strava_client,
+    get_gateway,
+    get_job_queue,
+    get_story_cache,
+    get_story_generator,
+    get_strava_client,
+    get_strava_client_pool,
+)
 from app.main import app
+from src.cache import StoryCache
+from src.gateway import BulkSaveResult, NoResultFound
+from src.generation_pool import GenerationPoolFull, GenerationWorkerError
+from src.generators import AIStoryGenerator, Story
+from src.jobs import JobNotFound
+from src.llm_backends import StubLLM
+from src.rate_limiter import RateLimitExceededError
+from src.strava_client import (
+    ActivityBadRequestError,
+    ActivityNotFoundError,
+    StravaServerError,
+)
+from src.token_manager import ClientAuthenticationError
 
 
 client = TestClient(app)
 
 
+@pytest.fixture(autouse=True)
+def offline_dependencies():
+    # dependencies are built on first use, every test builds them again on an empty mongomock server
+    store = ServerStore()
+    with patch(
+        "src.gateway.MongoClient",
+        lambda *args, **kwargs: mongomock.MongoClient(*args, _store=store, **kwargs),
+    ):
+        yield
+    for dependency in (
+        get_gateway,
+        get_story_cache,
+        get_strava_client,
+        get_strava_client_pool,
+    ):
+        dependency.cache_clear()
+
+
 @patch("src.gateway.MongoDBGateway.get_processed_activities")
 def test_get_all_processed_activities_200(mock_get_processed_activities):
     activities = [
@@ -18,7 +68,7 @@ def test_get_all_processed_activities_200(mock_get_processed_activities):
             "distance": 35,
             "story_title": "A sunny day run",
             "story_content": "Lorem ipsum dolor sit amet, consectetur adipiscing elit. Aenean et augue id nunc fermentum"
-                             " malesuada in sed sapien. Aliquam malesuada eu enim non convallis. Donec id sapien arcu.",
+            " malesuada in sed sapien. Aliquam malesuada eu enim non convallis. Donec id sapien arcu.",
         },
         {
             "activity_id": 2,
@@ -28,7 +78,7 @@ def test_get_all_processed_activities_200(mock_get_processed_activities):
             "distance": 43.9,
             "story_title": "A cloudy day jog",
             "story_content": "Lorem ipsum dolor sit amet, consectetur adipiscing elit. Aenean et augue id nunc fermentum"
-                             " malesuada in sed sapien. Aliquam malesuada eu enim non convallis. Donec id sapien arcu.",
+            " malesuada in sed sapien. Aliquam malesuada eu enim non convallis. Donec id sapien arcu.",
         },
     ]
     mock_get_processed_activities.return_value = activities
@@ -47,3 +97,752 @@ def test_get_all_processed_activities_404(mock_get_processed_activities):
     response = client.get("/activities/processed")
     assert response.status_code == 404
     assert response.json() == {"detail": "No processed activities"}
+
+
+@patch("src.gateway.MongoDBGateway.set_watermark")
+@patch("src.gateway.MongoDBGateway.bulk_save")
+@patch("src.gateway.MongoDBGateway.get_watermark")
+@patch("src.strava_client.StravaClient.iter_activities_after")
+@patch("src.strava_client.StravaClient.get_athlete_id")
+def test_save_activities_since_last_sync_201(
+    mock_get_athlete_id,
+    mock_iter_activities_after,
+    mock_get_watermark,
+    mock_bulk_save,
+    mock_set_watermark,
+):
+    activities = [
+        {"activity_id": 3, "start_date": 300},
+        {"activity_id": 4, "start_date": 400},
+    ]
+    mock_get_athlete_id.return_value = 42
+    mock_get_watermark.return_value = {
+        "athlete_id": 42,
+        "start_date": 200,
+        "activity_id": 2,
+    }
+    mock_iter_activities_after.return_value = iter(activities)
+    mock_bulk_save.return_value = BulkSaveResult(inserted=2)
+
+    response = client.post("/activities/?since_last_sync=true")
+
+    assert response.status_code == 201
+    assert response.json() == {
+        "message": "Successfully saved 2 activities.",
+        "saved": 2,
+        "conflicts": 0,
+    }
+    mock_iter_activities_after.assert_called_once_with(200)
+    mock_bulk_save.assert_called_once_with(activities)
+    mock_set_watermark.assert_called_once_with(42, 400, 4)
+
+
+@patch("src.gateway.MongoDBGateway.set_watermark")
+@patch("src.gateway.MongoDBGateway.bulk_save")
+@patch("src.gateway.MongoDBGateway.get_watermark")
+@patch("src.strava_client.StravaClient.iter_activities_after")
+@patch("src.strava_client.StravaClient.get_athlete_id")
+def test_save_activities_since_last_sync_nothing_new(
+    mock_get_athlete_id,
+    mock_iter_activities_after,
+    mock_get_watermark,
+    mock_bulk_save,
+    mock_set_watermark,
+):
+    mock_get_athlete_id.return_value = 42
+    mock_get_watermark.return_value = None
+    mock_iter_activities_after.return_value = iter([])
+
+    response = client.post("/activities/?since_last_sync=true")
+
+    assert response.status_code == 201
+    assert response.json() == {
+        "message": "Successfully saved 0 activities.",
+        "saved": 0,
+        "conflicts": 0,
+    }
+    mock_iter_activities_after.assert_called_once_with(0)
+    mock_bulk_save.assert_not_called()
+    mock_set_watermark.assert_not_called()
+
+
+@patch("src.gateway.MongoDBGateway.update")
+@patch("src.gateway.MongoDBGateway.get")
+def test_update_activity_with_story_200(mock_get, mock_update):
+    activity = {
+        "activity_id": 1,
+        "time": 120,
+        "elevation": 50.5,
+        "speed": 60,
+        "distance": 35,
+    }
+    story = Story(story_title="A sunny day run", story_content="Lorem ipsum.")
+    mock_story_generator = MagicMock()
+    mock_story_generator.generate.return_value = story
+    mock_story_generator.cache_key.return_value = "key"
+    mock_get.return_value = activity
+    mock_update.side_effect = lambda document, update_dict: {
+        **document,
+        **update_dict,
+    }
+    app.dependency_overrides[get_story_generator] = lambda: mock_story_generator
+
+    response = client.put("/activities/1/")
+    app.dependency_overrides.clear()
+
+    assert response.status_code == 200
+    assert response.json() == {**activity, **story.__dict__}
+    assert response.headers["X-Story-Cache"] == "MISS"
+    mock_story_generator.generate.assert_called_once_with(activity)
+
+
+@patch("src.gateway.MongoDBGateway.update")
+@patch("src.gateway.MongoDBGateway.get")
+def test_update_activity_with_cached_story(mock_get, mock_update):
+    activity = {
+        "activity_id": 1,
+        "time": 120,
+        "elevation": 50.5,
+        "speed": 60,
+        "distance": 35,
+    }
+    mock_story_generator = MagicMock()
+    mock_story_generator.generate.return_value = Story("A sunny day run", "Lorem.")
+    mock_story_generator.cache_key.return_value = "key"
+    mock_get.side_effect = lambda activity_id, athlete_id: activity.copy()
+    mock_update.side_effect = lambda document, update_dict: {
+        **document,
+        **update_dict,
+    }
+    app.dependency_overrides[get_story_generator] = lambda: mock_story_generator
+
+    first = client.put("/activities/1/")
+    second = client.put("/activities/1/")
+    third = client.put("/activities/1/?use_cache=false")
+    stats = client.get("/activities/story-cache/stats/").json()
+    app.dependency_overrides.clear()
+
+    assert first.headers["X-Story-Cache"] == "MISS"
+    assert second.headers["X-Story-Cache"] == "HIT"
+    assert third.headers["X-Story-Cache"] == "MISS"
+    assert second.json() == first.json()
+    assert mock_story_generator.generate.call_count == 2
+    assert stats["memory_hits"] == 1
+
+
+@patch("app.dependencies.AIStoryGenerator")
+def test_story_generator_is_built_once(mock_story_generator_class):
+    get_story_generator.cache_clear()
+
+    first = get_story_generator()
+    second = get_story_generator()
+    get_story_generator.cache_clear()
+
+    assert first is second
+    mock_story_generator_class.assert_called_once_with()
+
+
+def test_dependencies_are_built_once_by_concurrent_first_requests():
+    get_story_generator.cache_clear()
+    built = []
+
+    def build_slowly():
+        built.append(threading.get_ident())
+        time.sleep(0.1)
+        return MagicMock()
+
+    with patch("app.dependencies.AIStoryGenerator", side_effect=build_slowly):
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            generators = list(executor.map(lambda _: get_story_generator(), range(8)))
+    get_story_generator.cache_clear()
+
+    assert len(built) == 1
+    assert all(generator is generators[0] for generator in generators)
+
+
+def test_async_update_activity_with_story_200():
+    activity = {
+        "activity_id": 1,
+        "time": 120,
+        "elevation": 50.5,
+        "speed": 60,
+        "distance": 35,
+    }
+    story = Story(story_title="A sunny day run", story_content="Lorem ipsum.")
+    mock_gateway = AsyncMock()
+    mock_gateway.get.side_effect = NoResultFound
+    mock_gateway.update.side_effect = lambda document, update_dict: {
+        **document,
+        **update_dict,
+    }
+    mock_strava_client = AsyncMock()
+    mock_strava_client.get_activity.return_value = activity
+    mock_story_generator = MagicMock()
+    mock_story_generator.agenerate = AsyncMock(return_value=story)
+    mock_story_generator.cache_key.return_value = "key"
+    app.dependency_overrides[get_async_gateway] = lambda: mock_gateway
+    app.dependency_overrides[get_async_strava_client] = lambda: mock_strava_client
+    app.dependency_overrides[get_story_generator] = lambda: mock_story_generator
+    app.dependency_overrides[get_async_story_cache] = lambda: StoryCache()
+
+    response = client.put("/async/activities/1/")
+    app.dependency_overrides.clear()
+
+    assert response.status_code == 200
+    assert response.json() == {**activity, **story.__dict__}
+    assert response.headers["X-Story-Cache"] == "MISS"
+    mock_gateway.save_one.assert_awaited_once_with(activity)
+    mock_story_generator.agenerate.assert_awaited_once_with(activity)
+
+
+def test_async_update_activity_with_story_404():
+    mock_gateway = AsyncMock()
+    mock_gateway.get.side_effect = NoResultFound
+    mock_strava_client = AsyncMock()
+    mock_strava_client.get_activity.side_effect = ActivityNotFoundError
+    app.dependency_overrides[get_async_gateway] = lambda: mock_gateway
+    app.dependency_overrides[get_async_strava_client] = lambda: mock_strava_client
+    app.dependency_overrides[get_story_generator] = lambda: MagicMock()
+
+    response = client.put("/async/activities/1/")
+    app.dependency_overrides.clear()
+
+    assert response.status_code == 404
+
+
+@pytest.mark.parametrize(
+    "error, status_code, retry_after",
+    [
+        (RateLimitExceededError("Strava rate limit is exceeded.", 120), 429, "120"),
+        (StravaServerError("Bad Gateway"), 503, "30"),
+    ],
+)
+def test_async_update_activity_with_story_strava_errors(
+    error, status_code, retry_after
+):
+    mock_gateway = AsyncMock()
+    mock_gateway.get.side_effect = NoResultFound
+    mock_strava_client = AsyncMock()
+    mock_strava_client.get_activity.side_effect = error
+    app.dependency_overrides[get_async_gateway] = lambda: mock_gateway
+    app.dependency_overrides[get_async_strava_client] = lambda: mock_strava_client
+    app.dependency_overrides[get_story_generator] = lambda: MagicMock()
+
+    response = client.put("/async/activities/1/")
+    app.dependency_overrides.clear()
+
+    assert response.status_code == status_code
+    assert response.headers["Retry-After"] == retry_after
+
+
+@pytest.mark.parametrize(
+    "error, detail",
+    [
+        (
+            ClientAuthenticationError("Authentication has failed."),
+            "Strava rejected the credentials of the athlete: Authentication has failed.",
+        ),
+        (
+            ActivityBadRequestError("invalid id"),
+            "Strava rejected the request: invalid id",
+        ),
+    ],
+)
+def test_update_activity_with_story_strava_rejects_502(error, detail):
+    mock_gateway = MagicMock()
+    mock_gateway.get.side_effect = NoResultFound
+    mock_strava_client = MagicMock()
+    mock_strava_client.get_activity.side_effect = error
+    app.dependency_overrides[get_gateway] = lambda: mock_gateway
+    app.dependency_overrides[get_strava_client] = lambda: mock_strava_client
+    app.dependency_overrides[get_story_generator] = lambda: MagicMock()
+
+    response = client.put("/activities/1/")
+    app.dependency_overrides.clear()
+
+    assert response.status_code == 502
+    assert response.json() == {"detail": detail}
+
+
+def test_update_activity_with_story_generation_worker_error_502():
+    mock_gateway = MagicMock()
+    mock_gateway.get.return_value = {"activity_id": 1, "speed": 1.0}
+    mock_story_generator = MagicMock()
+    mock_story_generator.cache_key.return_value = "key"
+    mock_story_generator.generate.side_effect = GenerationWorkerError(
+        "Generation worker exited"
+    )
+    app.dependency_overrides[get_gateway] = lambda: mock_gateway
+    app.dependency_overrides[get_story_generator] = lambda: mock_story_generator
+
+    response = client.put("/activities/1/?use_cache=false")
+    app.dependency_overrides.clear()
+
+    assert response.status_code == 502
+    assert response.json() == {
+        "detail": "Story generation failed: Generation worker exited"
+    }
+    mock_gateway.update.assert_not_called()
+
+
+def test_async_get_all_processed_activities_200():
+    activities = [
+        {
+            "activity_id": 1,
+            "time": 120,
+            "elevation": 50.5,
+            "speed": 60,
+            "distance": 35,
+            "story_title": "A sunny day run",
+            "story_content": "Lorem ipsum.",
+        }
+    ]
+    mock_gateway = AsyncMock()
+    mock_gateway.get_processed_activities.return_value = activities
+    app.dependency_overrides[get_async_gateway] = lambda: mock_gateway
+
+    response = client.get("/async/activities/processed/")
+    app.dependency_overrides.clear()
+
+    assert response.status_code == 200
+    assert response.json() == activities
+    mock_gateway.get_processed_activities.assert_awaited_once_with(
+        fields=PROCESSED_ACTIVITY_FIELDS, athlete_id=None
+    )
+
+
+def test_async_get_all_processed_activities_404():
+    mock_gateway = AsyncMock()
+    mock_gateway.get_processed_activities.return_value = []
+    app.dependency_overrides[get_async_gateway] = lambda: mock_gateway
+
+    response = client.get("/async/activities/processed/")
+    app.dependency_overrides.clear()
+
+    assert response.status_code == 404
+    assert response.json() == {"detail": "No processed activities"}
+
+
+@patch("src.batch.BatchStoryGenerator.generate")
+def test_generate_stories_in_batch_200(mock_generate):
+    mock_generate.return_value = [
+        {
+            "activity_id": 1,
+            "status": "generated",
+            "story_title": "A sunny day run",
+            "story_content": "Lorem ipsum.",
+        },
+        {"activity_id": 2, "status": "not_found", "detail": "Activity 2 not found"},
+    ]
+    app.dependency_overrides[get_async_gateway] = lambda: AsyncMock()
+    app.dependency_overrides[get_async_strava_client] = lambda: AsyncMock()
+    app.dependency_overrides[get_story_generator] = lambda: MagicMock()
+
+    response = client.post(
+        "/activities/stories:batch", json={"activity_ids": [1, 2], "concurrency": 2}
+    )
+    app.dependency_overrides.clear()
+
+    assert response.status_code == 200
+    assert [item["status"] for item in response.json()] == ["generated", "not_found"]
+    mock_generate.assert_called_once_with([1, 2])
+
+
+def test_generate_stories_in_batch_422():
+    app.dependency_overrides[get_async_gateway] = lambda: AsyncMock()
+    app.dependency_overrides[get_async_strava_client] = lambda: AsyncMock()
+    app.dependency_overrides[get_story_generator] = lambda: MagicMock()
+
+    response = client.post("/activities/stories:batch", json={})
+    app.dependency_overrides.clear()
+
+    assert response.status_code == 422
+
+
+def test_enqueue_story_job_202():
+    mock_job_queue = MagicMock()
+    mock_job_queue.enqueue.return_value = {"job_id": "abc", "status": "queued"}
+    app.dependency_overrides[get_job_queue] = lambda: mock_job_queue
+
+    response = client.post("/activities/1/story-jobs/")
+    app.dependency_overrides.clear()
+
+    assert response.status_code == 202
+    assert response.json() == {"job_id": "abc", "status": "queued"}
+    assert response.headers["Location"] == "/jobs/abc"
+    mock_job_queue.enqueue.assert_called_once_with(1, athlete_id=None)
+
+
+def test_get_job_404():
+    mock_job_queue = MagicMock()
+    mock_job_queue.get.side_effect = JobNotFound
+    app.dependency_overrides[get_job_queue] = lambda: mock_job_queue
+
+    response = client.get("/jobs/abc")
+    app.dependency_overrides.clear()
+
+    assert response.status_code == 404
+
+
+@patch("src.gateway.MongoDBGateway.get_processed_activities")
+def test_get_processed_activities_page(mock_get_processed_activities):
+    activities = [
+        {
+            "activity_id": idx,
+            "time": 120,
+            "elevation": 50.5,
+            "speed": 60,
+            "distance": 35,
+            "story_title": "A sunny day run",
+            "story_content": "Lorem ipsum.",
+        }
+        for idx in (3, 4)
+    ]
+    mock_get_processed_activities.return_value = activities
+
+    response = client.get("/activities/processed/?limit=2&after=2")
+
+    assert response.status_code == 200
+    assert response.json() == activities
+    assert response.headers["X-Next-After"] == "4"
+    mock_get_processed_activities.assert_called_once_with(
+        limit=2, after=2, fields=PROCESSED_ACTIVITY_FIELDS, athlete_id=None
+    )
+
+
+@patch("src.gateway.MongoDBGateway.iter_processed_activities")
+def test_stream_processed_activities(mock_iter_processed_activities):
+    activities = [
+        {"activity_id": 1, "story_title": "title", "story_content": "content"},
+        {"activity_id": 2, "story_title": "title", "story_content": "content"},
+    ]
+    mock_iter_processed_activities.return_value = iter(activities)
+
+    response = client.get("/activities/processed/?stream=true&batch_size=100")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert [json.loads(line) for line in response.text.splitlines()] == activities
+    mock_iter_processed_activities.assert_called_once_with(
+        batch_size=100, after=None, fields=PROCESSED_ACTIVITY_FIELDS, athlete_id=None
+    )
+
+
+def test_stream_processed_activities_only_reads_response_fields():
+    activity = {
+        "activity_id": 1,
+        "speed": 5.0,
+        "distance": 1000.0,
+        "elevation": 10.0,
+        "time": 600,
+        "story_title": "title",
+        "story_content": "content",
+    }
+    get_gateway().save_one({**activity, "athlete_id": 10, "type": "Run"})
+
+    streamed = client.get("/activities/processed/?stream=true")
+    listed = client.get("/activities/processed/")
+
+    assert [json.loads(line) for line in streamed.text.splitlines()] == [activity]
+    assert listed.json() == [activity]
+
+
+@patch("src.gateway.MongoDBGateway.get_processed_activities")
+def test_get_processed_activities_fields(mock_get_processed_activities):
+    activities = [{"activity_id": 1, "story_title": "A sunny day run"}]
+    mock_get_processed_activities.return_value = activities
+
+    response = client.get(
+        "/activities/processed/?fields=activity_id&fields=story_title&limit=1"
+    )
+
+    assert response.status_code == 200
+    assert response.json() == activities
+    assert response.headers["X-Next-After"] == "1"
+    mock_get_processed_activities.assert_called_once_with(
+        limit=1, after=None, fields=["activity_id", "story_title"], athlete_id=None
+    )
+
+
+def test_get_processed_activities_unknown_fields():
+    response = client.get("/activities/processed/?fields=password")
+
+    assert response.status_code == 422
+
+
+def test_get_strava_rate_limit_stats():
+    response = client.get("/activities/strava-rate-limit/stats/")
+
+    assert response.status_code == 200
+    assert {"short_remaining", "daily_remaining", "retries"} <= set(response.json())
+
+
+@patch("src.gateway.MongoDBGateway.bulk_save")
+@patch("src.strava_client.StravaClient.get_most_recent_activities")
+def test_save_recent_activities_of_athlete(
+    mock_get_most_recent_activities, mock_bulk_save
+):
+    mock_strava_client_pool = MagicMock()
+    mock_strava_client_pool.get.return_value.get_most_recent_activities.return_value = [
+        {"activity_id": 3}
+    ]
+    app.dependency_overrides[get_strava_client_pool] = lambda: mock_strava_client_pool
+    mock_bulk_save.return_value = BulkSaveResult(conflicts=1)
+
+    response = client.post("/activities/?athlete_id=42")
+    app.dependency_overrides.clear()
+
+    assert response.status_code == 201
+    assert response.json()["conflicts"] == 1
+    mock_strava_client_pool.get.assert_called_once_with(42)
+    mock_get_most_recent_activities.assert_not_called()
+    mock_bulk_save.assert_called_once_with([{"activity_id": 3, "athlete_id": 42}])
+
+
+@patch("src.strava_client.StravaClient.iter_activities_after")
+@patch("src.strava_client.StravaClient.get_athlete_id")
+@patch("src.strava_client.StravaClient.get_most_recent_activities")
+def test_sync_claims_activities_saved_without_athlete(
+    mock_get_most_recent_activities, mock_get_athlete_id, mock_iter_activities_after
+):
+    mock_get_most_recent_activities.return_value = [
+        {"activity_id": 3, "start_date": 300}
+    ]
+    mock_get_athlete_id.return_value = 42
+    mock_iter_activities_after.return_value = iter(
+        [{"activity_id": 3, "start_date": 300}, {"activity_id": 4, "start_date": 400}]
+    )
+
+    client.post("/activities/")
+    response = client.post("/activities/?since_last_sync=true")
+
+    assert response.json() == {
+        "message": "Successfully saved 2 activities.",
+        "saved": 2,
+        "conflicts": 0,
+    }
+    assert get_gateway().get_many([3, 4], athlete_id=42) == [
+        {"activity_id": 3, "start_date": 300, "athlete_id": 42},
+        {"activity_id": 4, "start_date": 400, "athlete_id": 42},
+    ]
+
+
+@patch("src.strava_client.StravaClient.get_activity")
+def test_update_activity_of_another_athlete_409(mock_get_activity):
+    gateway = get_gateway()
+    gateway.save_one({"activity_id": 7, "athlete_id": 1, "speed": 60})
+    app.dependency_overrides[get_strava_client_pool] = lambda: MagicMock()
+    app.dependency_overrides[get_story_generator] = lambda: MagicMock()
+
+    response = client.put("/activities/7/?athlete_id=2")
+    app.dependency_overrides.clear()
+
+    assert response.status_code == 409
+    assert response.json() == {"detail": "Activity 7 belongs to another athlete"}
+    mock_get_activity.assert_not_called()
+    assert gateway.get(7, athlete_id=1)["athlete_id"] == 1
+
+
+def test_async_routes_are_scoped_by_athlete():
+    mock_gateway = AsyncMock()
+    mock_gateway.get.return_value = {
+        "activity_id": 7,
+        "athlete_id": 42,
+        "time": 120,
+        "elevation": 50.5,
+        "speed": 60,
+        "distance": 35,
+    }
+    mock_gateway.update.side_effect = lambda activity, story: {**activity, **story}
+    mock_gateway.get_processed_activities.return_value = []
+    mock_strava_client_pool = MagicMock()
+    story_generator = AIStoryGenerator(llm=StubLLM())
+    app.dependency_overrides[get_async_gateway] = lambda: mock_gateway
+    app.dependency_overrides[get_strava_client_pool] = lambda: mock_strava_client_pool
+    app.dependency_overrides[get_story_generator] = lambda: story_generator
+
+    client.put("/async/activities/7/?athlete_id=42&use_cache=false")
+    client.get("/async/activities/processed/?athlete_id=42")
+    app.dependency_overrides.clear()
+
+    mock_strava_client_pool.get.assert_called_with(42)
+    mock_gateway.get.assert_awaited_once_with(7, athlete_id=42)
+    assert mock_gateway.get_processed_activities.await_args.kwargs["athlete_id"] == 42
+
+
+def test_enqueue_story_job_of_unauthorized_athlete_404():
+    mock_job_queue = MagicMock()
+    app.dependency_overrides[get_job_queue] = lambda: mock_job_queue
+
+    response = client.post("/activities/1/story-jobs/?athlete_id=42")
+    app.dependency_overrides.clear()
+
+    assert response.status_code == 404
+    mock_job_queue.enqueue.assert_not_called()
+
+
+@patch("src.token_manager.StravaTokenManager._request_refresh")
+def test_activities_of_unauthorized_athlete_404(mock_request_refresh):
+    response = client.post("/activities/?athlete_id=42")
+
+    assert response.status_code == 404
+    assert response.json() == {"detail": "Athlete 42 is not authorized"}
+    mock_request_refresh.assert_not_called()
+    assert get_gateway()._token_collection.count_documents({}) == 0
+
+
+def test_authorize_athlete_201():
+    mock_strava_client_pool = MagicMock()
+    mock_strava_client_pool.authenticate.return_value = 42
+    app.dependency_overrides[get_strava_client_pool] = lambda: mock_strava_client_pool
+
+    response = client.post("/athletes/", json={"code": "code"})
+    app.dependency_overrides.clear()
+
+    assert response.status_code == 201
+    assert response.json() == {"athlete_id": 42}
+    mock_strava_client_pool.authenticate.assert_called_once_with("code")
+
+
+def _sse_events(body: str) -> list[tuple[str, dict]]:
+    events = []
+    for message in body.strip().split("\n\n"):
+        event, data = message.split("\n")
+        events.append(
+            (event.removeprefix("event: "), json.loads(data.removeprefix("data: ")))
+        )
+    return events
+
+
+@patch("src.gateway.MongoDBGateway.update")
+@patch("src.gateway.MongoDBGateway.get")
+def test_stream_activity_story_200(mock_get, mock_update):
+    activity = {
+        "activity_id": 1,
+        "time": 120,
+        "elevation": 50.5,
+        "speed": 60,
+        "distance": 35,
+    }
+    mock_get.return_value = activity
+    mock_update.side_effect = lambda document, update_dict: {
+        **document,
+        **update_dict,
+    }
+    story_generator = AIStoryGenerator(llm=StubLLM(continuation_paragraphs=3))
+    app.dependency_overrides[get_story_generator] = lambda: story_generator
+
+    response = client.get("/activities/1/story/stream")
+    app.dependency_overrides.clear()
+
+    events = _sse_events(response.text)
+    names = [event for event, _ in events]
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    # title is sent while the story is still being generated
+    assert names.index("title") < len(names) - 2
+    assert names[-1] == "story"
+    assert events[names.index("title")][1] == {"story_title": "A Stub Story"}
+    assert "".join(data["text"] for event, data in events if event == "token") == (
+        "".join(story_generator.stream(activity))
+    )
+    story = events[-1][1]
+    assert story["story_title"] == "A Stub Story"
+    assert "The next day" not in story["story_content"]
+    mock_update.assert_called_once_with(
+        activity,
+        {"story_title": story["story_title"], "story_content": story["story_content"]},
+    )
+
+
+@patch("src.gateway.MongoDBGateway.update")
+@patch("src.gateway.MongoDBGateway.get")
+def test_stream_activity_story_error_event(mock_get, mock_update):
+    mock_get.return_value = {"activity_id": 1, "speed": 60}
+    story_generator = AIStoryGenerator(llm=StubLLM(error_rate=1.0))
+    app.dependency_overrides[get_story_generator] = lambda: story_generator
+
+    response = client.get("/activities/1/story/stream")
+    app.dependency_overrides.clear()
+
+    assert [event for event, _ in _sse_events(response.text)] == ["error"]
+    mock_update.assert_not_called()
+
+
+@patch("src.gateway.MongoDBGateway.get")
+def test_update_activity_with_story_429_when_generation_pool_is_full(mock_get):
+    mock_get.return_value = {"activity_id": 1, "speed": 60}
+    mock_story_generator = MagicMock()
+    mock_story_generator.cache_key.return_value = "key"
+    mock_story_generator.generate.side_effect = GenerationPoolFull(
+        retry_after_seconds=3
+    )
+    app.dependency_overrides[get_story_generator] = lambda: mock_story_generator
+
+    response = client.put("/activities/1/")
+    app.dependency_overrides.clear()
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "3"
+
+
+def test_story_pool_health_404_without_pool():
+    app.dependency_overrides[get_story_generator] = lambda: MagicMock()
+
+    response = client.get("/activities/story-pool/health/")
+    app.dependency_overrides.clear()
+
+    assert response.status_code == 404
+
+
+def test_startup_connects_nothing():
+    get_story_generator.cache_clear()
+    mock_gateway = MagicMock(ensure_indexes=AsyncMock())
+    app.dependency_overrides[get_async_gateway] = lambda: mock_gateway
+
+    with TestClient(app) as started_client:
+        response = started_client.get("/activities/story-cache/stats/")
+        built = {
+            dependency.__name__: dependency.cache_info().currsize
+            for dependency in (get_gateway, get_strava_client, get_story_generator)
+        }
+    app.dependency_overrides.clear()
+
+    assert response.status_code == 200
+    assert built == {
+        "get_gateway": 0,
+        "get_strava_client": 0,
+        "get_story_generator": 0,
+    }
+    mock_gateway.ensure_indexes.assert_awaited_once()
+
+
+@patch("src.strava_client.StravaClient.get_activity")
+def test_metrics_cover_story_generation_stages(mock_get_activity):
+    mock_get_activity.return_value = {
+        "activity_id": 7,
+        "time": 120,
+        "elevation": 50.5,
+        "speed": 60,
+        "distance": 35,
+    }
+    story_generator = AIStoryGenerator(llm=StubLLM())
+    app.dependency_overrides[get_story_generator] = lambda: story_generator
+
+    response = client.put("/activities/7/")
+    metrics = client.get("/metrics")
+    app.dependency_overrides.clear()
+
+    assert response.status_code == 200
+    assert metrics.headers["content-type"].startswith("text/plain; version=0.0.4")
+    for stage in (
+        "mongo_get",
+        "strava_get_activity",
+        "llm_generate",
+        "parse",
+        "mongo_update",
+    ):
+        assert f'story_stage_seconds_count{{stage="{stage}"}}' in metrics.text
+    assert 'mongo_operation_seconds_count{operation="update"}' in metrics.text
+    assert 'llm_generated_tokens_total{llm="stub"}' in metrics.text
+    assert 'story_cache_lookups_total{result="miss"}' in metrics.text
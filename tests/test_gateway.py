@@ -1,14 +1,41 @@
+from unittest.mock import patch
+
+import mongomock
 import pytest
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
 
-from src.gateway import MongoDBGateway, NoResultFound
+from src.gateway import (
+    ActivityConflict,
+    BulkSaveResult,
+    MongoDBGateway,
+    NoResultFound,
+    _processed_activities_filter,
+)
 from src.generators import Story
 
 
-pytestmark = pytest.mark.skip(reason="requires MongoDB running locally")
-# TODO implement unit tests by mocking MongoDBGateway current tests requires MongoDB up and running locally
+requires_mongo = pytest.mark.skip(reason="requires MongoDB running locally")
 # TODO make tests independent
 
 
+def _mongod_is_running() -> bool:
+    try:
+        with MongoClient(
+            "mongodb://localhost:27017", serverSelectionTimeoutMS=200
+        ) as client:
+            client.admin.command("ping")
+        return True
+    except PyMongoError:
+        return False
+
+
+# mongomock does not plan queries, query plans are only checked against a real mongod
+requires_mongod = pytest.mark.skipif(
+    not _mongod_is_running(), reason="requires mongod running locally"
+)
+
+
 @pytest.fixture(scope="module")
 def gateway():
     return MongoDBGateway(
@@ -18,6 +45,7 @@ def gateway():
     )
 
 
+@requires_mongo
 def test_bulk_save(gateway):
     activities = [
         {"activity_id": 1},
@@ -36,10 +64,10 @@ def test_bulk_save(gateway):
     gateway.bulk_save(activities)
 
     for idx, activity in enumerate(activities):
-        activity.pop("_id")
         assert gateway.get(idx + 1) == activity
 
 
+@requires_mongo
 def test_get_processed_activities(gateway):
     res = gateway.get_processed_activities()
 
@@ -56,10 +84,12 @@ def test_get_processed_activities(gateway):
     }
 
 
+@requires_mongo
 def test_get_success(gateway):
     assert gateway.get(1) == {"activity_id": 1}
 
 
+@requires_mongo
 def test_update(gateway):
     activity = {"activity_id": 1}
     story = Story("title", "story content")
@@ -69,6 +99,7 @@ def test_update(gateway):
     assert gateway.get(1) == activity
 
 
+@requires_mongo
 def test_save_one(gateway):
     activity = {"activity_id": 47}
     gateway.save_one(activity)
@@ -76,6 +107,238 @@ def test_save_one(gateway):
     assert gateway.get(47) == {"activity_id": 47}
 
 
+@requires_mongo
 def test_get_fails(gateway):
     with pytest.raises(NoResultFound):
         gateway.get(1000)
+
+
+@requires_mongo
+def test_watermark(gateway):
+    assert gateway.get_watermark(42) is None
+
+    gateway.set_watermark(42, 1518792774, 5)
+    gateway.set_watermark(42, 1518799999, 6)
+
+    assert gateway.get_watermark(42) == {
+        "athlete_id": 42,
+        "start_date": 1518799999,
+        "activity_id": 6,
+    }
+
+
+@pytest.fixture
+def mock_gateway():
+    with patch("src.gateway.MongoClient", mongomock.MongoClient):
+        yield MongoDBGateway(
+            uri="mongodb://localhost:27017",
+            db_name="activities",
+            collection_name="activity_collection",
+            batch_size=2,
+        )
+
+
+def test_bulk_save_is_idempotent(mock_gateway):
+    activities = [{"activity_id": idx, "distance": 10.0} for idx in range(5)]
+
+    first = mock_gateway.bulk_save([activity.copy() for activity in activities])
+    activities[0]["distance"] = 20.0
+    second = mock_gateway.bulk_save([activity.copy() for activity in activities])
+
+    assert first == BulkSaveResult(inserted=5, updated=0, unchanged=0)
+    assert second == BulkSaveResult(inserted=0, updated=1, unchanged=4)
+    assert mock_gateway._collection.count_documents({}) == 5
+    assert mock_gateway.get(0) == {"activity_id": 0, "distance": 20.0}
+
+
+def test_writes_do_not_move_activities_of_other_athletes(mock_gateway):
+    mock_gateway.save_one({"activity_id": 7, "athlete_id": 1, "distance": 10.0})
+
+    with pytest.raises(ActivityConflict):
+        mock_gateway.save_one({"activity_id": 7, "athlete_id": 2, "distance": 20.0})
+    with pytest.raises(NoResultFound):
+        mock_gateway.update({"activity_id": 7, "athlete_id": 2}, {"story_title": "t"})
+    result = mock_gateway.bulk_save(
+        [{"activity_id": 7, "athlete_id": 2}, {"activity_id": 8, "athlete_id": 2}]
+    )
+
+    assert result == BulkSaveResult(inserted=1, updated=0, unchanged=0, conflicts=1)
+    assert mock_gateway.get(7, athlete_id=1) == {
+        "activity_id": 7,
+        "athlete_id": 1,
+        "distance": 10.0,
+    }
+
+
+def test_bulk_save_keeps_story(mock_gateway):
+    mock_gateway.save_one({"activity_id": 1, "distance": 10.0})
+    mock_gateway.update({"activity_id": 1}, Story("title", "content").__dict__)
+
+    mock_gateway.bulk_save([{"activity_id": 1, "distance": 10.0}])
+
+    assert mock_gateway.get(1) == {
+        "activity_id": 1,
+        "distance": 10.0,
+        "story_title": "title",
+        "story_content": "content",
+    }
+
+
+def test_activity_id_index_is_unique(mock_gateway):
+    index = mock_gateway._collection.index_information()["activity_id_1"]
+
+    assert index["unique"]
+
+
+def test_get_many_and_bulk_update(mock_gateway):
+    mock_gateway.bulk_save([{"activity_id": idx} for idx in range(3)])
+
+    modified = mock_gateway.bulk_update(
+        {0: Story("title", "content").__dict__, 2: Story("other", "content").__dict__}
+    )
+
+    assert modified == 2
+    assert mock_gateway.get_many([0, 1, 5]) == [
+        {"activity_id": 0, "story_title": "title", "story_content": "content"},
+        {"activity_id": 1},
+    ]
+    assert mock_gateway.get_unprocessed_activities() == [{"activity_id": 1}]
+
+
+def test_processed_activities_keyset_pagination(mock_gateway):
+    mock_gateway.bulk_save(
+        [
+            {"activity_id": idx, "story_title": "title", "story_content": "content"}
+            for idx in (5, 1, 4, 2)
+        ]
+        + [{"activity_id": 3}]
+    )
+
+    first_page = mock_gateway.get_processed_activities(limit=2)
+    second_page = mock_gateway.get_processed_activities(
+        limit=2, after=first_page[-1]["activity_id"]
+    )
+
+    assert [activity["activity_id"] for activity in first_page] == [1, 2]
+    assert [activity["activity_id"] for activity in second_page] == [4, 5]
+    assert [
+        activity["activity_id"]
+        for activity in mock_gateway.iter_processed_activities(batch_size=1, after=2)
+    ] == [4, 5]
+
+
+def test_processed_activities_projection(mock_gateway):
+    mock_gateway.bulk_save(
+        [{"activity_id": 1, "distance": 1.0, "story_title": "t", "story_content": "c"}]
+    )
+
+    result = mock_gateway.get_processed_activities(
+        fields=["activity_id", "story_title"]
+    )
+
+    assert result == [{"activity_id": 1, "story_title": "t"}]
+
+
+def test_processed_activities_partial_index(mock_gateway):
+    index = mock_gateway._collection.index_information()["processed_activities"]
+
+    assert index["key"] == [("activity_id", 1), ("story_title", 1)]
+    assert index["partialFilterExpression"] == {
+        "story_title": {"$exists": True},
+        "story_content": {"$exists": True},
+    }
+
+
+def test_activities_are_scoped_by_athlete(mock_gateway):
+    mock_gateway.bulk_save(
+        [
+            {"activity_id": 1, "athlete_id": 10},
+            {"activity_id": 2, "athlete_id": 20},
+        ]
+    )
+    mock_gateway.update(
+        {"activity_id": 1}, {"story_title": "title", "story_content": "content"}
+    )
+    mock_gateway.update(
+        {"activity_id": 2}, {"story_title": "title", "story_content": "content"}
+    )
+
+    assert mock_gateway.get(1, athlete_id=10)["activity_id"] == 1
+    with pytest.raises(ActivityConflict):
+        mock_gateway.get(1, athlete_id=20)
+    with pytest.raises(NoResultFound):
+        mock_gateway.get(3, athlete_id=20)
+    assert [
+        activity["activity_id"]
+        for activity in mock_gateway.get_processed_activities(athlete_id=20)
+    ] == [2]
+    assert len(mock_gateway.get_processed_activities()) == 2
+
+
+def test_activities_without_athlete_are_claimed(mock_gateway):
+    # saved by a single-athlete sync, before the athlete was known
+    mock_gateway.bulk_save([{"activity_id": 1}, {"activity_id": 2}, {"activity_id": 3}])
+
+    result = mock_gateway.bulk_save([{"activity_id": 1, "athlete_id": 10}])
+    assert mock_gateway.get(2, athlete_id=10)["athlete_id"] == 10
+    assert mock_gateway.get_many([2, 3], athlete_id=20) == [
+        {"activity_id": 3, "athlete_id": 20}
+    ]
+
+    assert result == BulkSaveResult(updated=1)
+    assert [
+        activity["athlete_id"] for activity in mock_gateway.get_many([1, 2, 3])
+    ] == [10, 10, 20]
+
+
+def test_token_lock(mock_gateway):
+    assert mock_gateway.try_lock_token(10, "first", ttl_seconds=30)
+    assert not mock_gateway.try_lock_token(10, "second", ttl_seconds=30)
+    assert mock_gateway.try_lock_token(20, "second", ttl_seconds=30)
+
+    mock_gateway.release_token_lock(10, "first")
+
+    assert mock_gateway.try_lock_token(10, "second", ttl_seconds=30)
+    assert mock_gateway.get_token(10) is None
+
+
+def _stages(plan: dict) -> list[str]:
+    # stages of a winning plan from the root down to the index scans
+    stages = [plan["stage"]]
+    for child in [plan.get("inputStage")] + plan.get("inputStages", []):
+        if child:
+            stages += _stages(child)
+    return stages
+
+
+@requires_mongod
+def test_processed_activities_query_plan():
+    gateway = MongoDBGateway(
+        uri="mongodb://localhost:27017",
+        db_name="test_activities",
+        collection_name="explain_activity_collection",
+    )
+    try:
+        gateway.bulk_save(
+            [
+                {"activity_id": idx, "story_title": "t", "story_content": "c"}
+                for idx in range(10)
+            ]
+            + [{"activity_id": idx} for idx in range(10, 20)]
+        )
+        explain = gateway._collection.find(
+            _processed_activities_filter(),
+            {"_id": 0, "activity_id": 1, "story_title": 1},
+            sort=[("activity_id", 1)],
+        ).explain()
+        plan = explain["queryPlanner"]["winningPlan"]
+        stages = _stages(plan.get("queryPlan", plan))
+
+        # walks the partial index in `activity_id` order, `story_content` is checked on the fetched documents
+        assert "IXSCAN" in stages
+        assert "SORT" not in stages
+        assert "FETCH" in stages
+        assert "processed_activities" in str(plan)
+    finally:
+        gateway._collection.drop()
+        gateway.close()
@@ -0,0 +1,89 @@
+import asyncio
+import os
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from src.generation_pool import (
+    GenerationPool,
+    GenerationPoolFull,
+    GenerationWorkerError,
+)
+from src.generators import AIStoryGenerator
+
+ACTIVITY = {"activity_id": 1, "speed": 60, "distance": 35, "time": 120, "elevation": 50}
+
+
+def broken_generator():
+    raise RuntimeError("model is missing")
+
+
+def wait_until(predicate, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "condition not met in time"
+        time.sleep(0.05)
+
+
+@pytest.fixture(scope="module")
+def stub_env():
+    # spawned workers inherit the environment and build the stub backend
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setenv("STORY_LLM_BACKEND", "stub")
+        monkeypatch.setenv("STORY_LLM_STUB_LATENCY", "0.5")
+        yield
+
+
+@pytest.fixture(scope="module")
+def pool(stub_env):
+    pool = GenerationPool(num_workers=1, max_queue_size=1, task_timeout_seconds=30)
+    yield pool
+    pool.close()
+
+
+def test_generation_pool_generates_and_streams(pool):
+    story = pool.generate(ACTIVITY)
+    async_story = asyncio.run(pool.agenerate(ACTIVITY))
+    streamed = "".join(pool.stream(ACTIVITY))
+
+    assert story.story_title == async_story.story_title == "A Stub Story"
+    assert streamed.startswith("Title: A Stub Story")
+    # keys are built in the API process with the parameters of the worker generators
+    assert pool.cache_key(ACTIVITY) == AIStoryGenerator().cache_key(ACTIVITY)
+
+
+def test_generation_pool_rejects_stories_when_full(pool):
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [executor.submit(pool.generate, ACTIVITY) for _ in range(2)]
+        wait_until(lambda: pool.health()["in_flight"] == 2)
+
+        with pytest.raises(GenerationPoolFull) as exc_info:
+            pool.generate(ACTIVITY)
+        stories = [future.result() for future in futures]
+
+    assert exc_info.value.retry_after_seconds >= 1
+    assert [story.story_title for story in stories] == ["A Stub Story"] * 2
+
+
+def test_generation_pool_respawns_crashed_worker(pool):
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(pool.generate, ACTIVITY)
+        wait_until(lambda: pool.health()["workers"][0]["busy"])
+        os.kill(pool.health()["workers"][0]["pid"], signal.SIGKILL)
+
+        with pytest.raises(GenerationWorkerError):
+            future.result()
+
+    wait_until(lambda: pool.health()["ready_workers"] == 1)
+    assert pool.health()["workers"][0]["restarts"] == 1
+    assert pool.generate(ACTIVITY).story_title == "A Stub Story"
+
+
+def test_generation_pool_fails_when_no_worker_starts():
+    start = time.monotonic()
+
+    with pytest.raises(GenerationWorkerError):
+        GenerationPool(num_workers=2, generator_factory=broken_generator)
+    assert time.monotonic() - start < 30
@@ -1,4 +1,18 @@
+import asyncio
+import time
+from unittest.mock import patch
+
+import pytest
+from langchain_community.llms import FakeListLLM, HuggingFaceHub
+
 from src.generators import AIStoryGenerator
+from src.llm_backends import (
+    StubLLM,
+    StubLLMError,
+    build_llm,
+    count_tokens,
+    supports_streaming,
+)
 
 
 def test_generate_story():
@@ -16,3 +30,189 @@ def test_generate_story():
     for key, value in activity.items():
         if key != "activity_id":
             assert str(int(value)) in res.story_content
+
+
+def test_render_metrics_ignores_non_metric_keys():
+    activity = {
+        "activity_id": 1,
+        "speed": 60.0,
+        "distance": 100.0,
+        "time": 120,
+        "elevation": 200,
+        "start_date": 1518792774,
+        "story_title": "title",
+        "story_content": "content",
+    }
+
+    res = AIStoryGenerator._render_metrics(activity)
+
+    assert res == "speed 60.0, distance 100.0, time 120, elevation 200"
+
+
+def test_generate_stories_with_stub_backend():
+    activities = [
+        {"activity_id": idx, "speed": 10.0, "distance": 100.0 * idx, "time": 120}
+        for idx in range(1, 4)
+    ]
+    story_generator = AIStoryGenerator(llm=StubLLM())
+
+    with patch.object(
+        StubLLM, "_generate", wraps=story_generator._llm_model._generate
+    ) as mock_generate:
+        stories = story_generator.generate_many(activities)
+
+    mock_generate.assert_called_once()
+    assert [story.story_title for story in stories] == ["A Stub Story"] * 3
+    for activity, story in zip(activities, stories):
+        assert f"distance {activity['distance']}" in story.story_content
+    assert story_generator.generate(activities[0]) == stories[0]
+
+
+def test_build_llm_from_env(monkeypatch):
+    monkeypatch.setenv("STORY_LLM_BACKEND", "stub")
+
+    assert isinstance(build_llm(), StubLLM)
+    with pytest.raises(ValueError):
+        build_llm("unknown")
+
+
+def test_cache_key_depends_on_backend_params():
+    activity = {"activity_id": 1, "speed": 10.0}
+
+    assert AIStoryGenerator(llm=StubLLM()).cache_key(activity) != AIStoryGenerator(
+        llm=StubLLM(latency_seconds=1.0)
+    ).cache_key(activity)
+
+
+def test_stub_backend_errors_are_deterministic():
+    def failures(llm: StubLLM) -> list[bool]:
+        results = []
+        for _ in range(20):
+            try:
+                llm.invoke("prompt")
+                results.append(False)
+            except StubLLMError:
+                results.append(True)
+        return results
+
+    first = failures(StubLLM(error_rate=0.3, seed=1))
+
+    assert first == failures(StubLLM(error_rate=0.3, seed=1))
+    assert 0 < sum(first) < 20
+    assert not any(failures(StubLLM(error_rate=0.0)))
+
+
+def test_generate_retries_low_confidence_story():
+    llm = FakeListLLM(
+        responses=["no title and no end", "Title: Found\n\nA story.", "unused"]
+    )
+    story_generator = AIStoryGenerator(llm=llm, max_attempts=3)
+
+    story = story_generator.generate({"activity_id": 1, "speed": 1.0})
+
+    assert story.story_title == "Found"
+    assert story.story_content == "A story."
+    assert llm.i == 2
+
+
+def test_generate_many_retries_only_low_confidence_stories():
+    llm = FakeListLLM(
+        responses=[
+            "Title: First\n\nGood story.",
+            "no title and no end",
+            "Title: Second\n\nBetter story.",
+            "unused",
+        ]
+    )
+    story_generator = AIStoryGenerator(llm=llm, max_attempts=2)
+
+    stories = story_generator.generate_many(
+        [{"activity_id": 1, "speed": 1.0}, {"activity_id": 2, "speed": 2.0}]
+    )
+
+    assert [story.story_title for story in stories] == ["First", "Second"]
+    assert llm.i == 3
+
+
+def test_generate_stops_at_stop_sequence_and_max_new_tokens():
+    activity = {"activity_id": 1, "speed": 1.0}
+    llm = StubLLM(continuation_paragraphs=3)
+
+    story_generator = AIStoryGenerator(llm=llm, stop=["\n\nThe next day"])
+
+    assert "The next day" not in story_generator._complete("speed 1.0")
+    assert story_generator.generate(activity).story_title == "A Stub Story"
+    assert (
+        count_tokens(
+            AIStoryGenerator(llm=StubLLM(max_new_tokens=5))._complete("speed 1.0")
+        )
+        == 5
+    )
+    assert story_generator.cache_key(activity) != AIStoryGenerator(llm=llm).cache_key(
+        activity
+    )
+
+
+def test_stream_stops_reading_after_two_sentences():
+    llm = StubLLM(continuation_paragraphs=3)
+    story_generator = AIStoryGenerator(llm=llm, stream=True)
+
+    text = story_generator._complete("speed 1.0")
+    atext = asyncio.run(story_generator._acomplete("speed 1.0"))
+
+    assert text == atext
+    assert count_tokens(text) < count_tokens(llm.invoke("speed 1.0"))
+    assert story_generator.generate({"activity_id": 1, "speed": 1.0}).story_title == (
+        "A Stub Story"
+    )
+
+
+def test_default_backend_streams_whole_output():
+    # built without validation, validation calls Hugging Face API
+    hub = HuggingFaceHub.construct(repo_id="openchat/openchat-3.5-0106")
+    output = "Title: Hub Story\n\nA first sentence. A second sentence."
+
+    with patch.object(HuggingFaceHub, "_call", return_value=output) as mock_call:
+        story_generator = AIStoryGenerator(llm=hub, stream=True)
+        chunks = list(story_generator.stream({"activity_id": 1, "speed": 1.0}))
+        story = story_generator.generate({"activity_id": 1, "speed": 1.0})
+
+    assert not supports_streaming(hub)
+    assert supports_streaming(StubLLM())
+    assert not story_generator._stream
+    assert chunks == [output]
+    assert story.story_title == "Hub Story"
+    assert mock_call.call_count == 2
+
+
+def test_stub_agenerate_does_not_block_the_event_loop():
+    story_generator = AIStoryGenerator(llm=StubLLM(latency_seconds=0.2))
+    activities = [{"activity_id": idx, "speed": 1.0} for idx in range(50)]
+
+    async def generate_all():
+        with patch.object(StubLLM, "_call") as mock_call:
+            stories = await asyncio.gather(
+                *(story_generator.agenerate(activity) for activity in activities)
+            )
+        mock_call.assert_not_called()
+        return stories
+
+    start = time.perf_counter()
+    stories = asyncio.run(generate_all())
+
+    # 50 calls of 0.2 seconds would take 2 seconds on a single thread
+    assert time.perf_counter() - start < 1.0
+    assert {story.story_title for story in stories} == {"A Stub Story"}
+
+
+def test_generation_params_from_env(monkeypatch):
+    monkeypatch.setenv("STORY_LLM_BACKEND", "stub")
+    monkeypatch.setenv("STORY_LLM_MAX_NEW_TOKENS", "64")
+    monkeypatch.setenv("STORY_LLM_STOP", '["\\n\\nThe next day"]')
+    monkeypatch.setenv("STORY_LLM_STREAM", "true")
+
+    story_generator = AIStoryGenerator()
+
+    assert story_generator._llm_model.max_new_tokens == 64
+    assert story_generator._stop == ["\n\nThe next day"]
+    assert story_generator._stream
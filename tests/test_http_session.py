@@ -0,0 +1,63 @@
+import math
+from unittest.mock import patch
+
+from benchmarks.strava_stub import StravaStubServer
+from src.http_session import PooledSession
+from src.strava_client import StravaClient
+from src.token_manager import StravaTokenManager
+
+
+def _stub_client(stub: StravaStubServer, session: PooledSession) -> StravaClient:
+    return StravaClient(
+        stub.activity_uri,
+        stub.athlete_activities_uri,
+        token_manager=StravaTokenManager(access_token="stub", expires_at=math.inf),
+        session=session,
+    )
+
+
+def test_connections_are_reused():
+    with StravaStubServer(num_activities=10) as stub:
+        client = _stub_client(stub, PooledSession())
+
+        for activity_id in range(1, 11):
+            client.get_activity(activity_id)
+        client.close()
+
+    assert stub.request_count == 10
+    assert stub.connection_count == 1
+
+
+def test_keep_alive_can_be_disabled():
+    with StravaStubServer(num_activities=10) as stub:
+        client = _stub_client(stub, PooledSession(keep_alive=False))
+
+        for activity_id in range(1, 4):
+            client.get_activity(activity_id)
+
+    assert stub.connection_count == 3
+
+
+def test_default_timeout():
+    session = PooledSession(timeout=(1.0, 2.0))
+
+    with patch("requests.Session.request") as mock_request:
+        session.get("https://mock_uri")
+        session.get("https://mock_uri", timeout=5.0)
+
+    assert mock_request.call_args_list[0].kwargs["timeout"] == (1.0, 2.0)
+    assert mock_request.call_args_list[1].kwargs["timeout"] == 5.0
+
+
+def test_from_env(monkeypatch):
+    monkeypatch.setenv("STRAVA_HTTP_POOL_SIZE", "20")
+    monkeypatch.setenv("STRAVA_HTTP_READ_TIMEOUT", "15")
+    monkeypatch.setenv("STRAVA_HTTP_MAX_RETRIES", "5")
+
+    session = PooledSession.from_env()
+    adapter = session.get_adapter("https://www.strava.com")
+
+    assert session.timeout == (3.05, 15.0)
+    assert adapter._pool_maxsize == 20
+    assert adapter.max_retries.total == 5
+    assert adapter.max_retries.status == 0
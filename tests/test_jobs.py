@@ -0,0 +1,213 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from unittest.mock import patch, MagicMock
+
+import mongomock
+import pytest
+from pymongo.errors import PyMongoError
+
+from src.gateway import ActivityConflict, NoResultFound
+from src.generators import Story
+from src.jobs import JobQueue, JobNotFound, StoryJobWorker
+from src.strava_client import ActivityNotFoundError
+
+
+NOW = datetime(2024, 1, 1, 12, 0, 0)
+
+
+@pytest.fixture
+def clock():
+    with patch("src.jobs.JobQueue._now") as mock_now:
+        mock_now.return_value = NOW
+        yield mock_now
+
+
+@pytest.fixture
+def queue(clock):
+    with patch("src.jobs.MongoClient", mongomock.MongoClient):
+        yield JobQueue(
+            uri="mongodb://localhost:27017",
+            db_name="activities",
+            visibility_timeout=60,
+            max_attempts=2,
+            backoff_seconds=10,
+        )
+
+
+def test_enqueue_lease_complete(queue):
+    job = queue.enqueue(1)
+
+    leased = queue.lease("worker")
+    assert queue.lease("other worker") is None
+    queue.complete(leased, {"activity_id": 1})
+
+    result = queue.get(job["job_id"])
+    assert leased["attempts"] == 1
+    assert result["status"] == "succeeded"
+    assert result["result"] == {"activity_id": 1}
+
+
+def test_expired_lease_is_retried_with_backoff_then_fails(queue, clock):
+    job = queue.enqueue(1)
+    queue.lease("worker")
+
+    clock.return_value = NOW + timedelta(seconds=61)
+    assert queue.lease("other worker") is None
+    assert queue.get(job["job_id"])["status"] == "queued"
+    clock.return_value = NOW + timedelta(seconds=71)
+    leased = queue.lease("other worker")
+    assert leased["job_id"] == job["job_id"]
+    assert leased["attempts"] == 2
+
+    clock.return_value = NOW + timedelta(seconds=132)
+    assert queue.lease("worker") is None
+    result = queue.get(job["job_id"])
+    assert result["status"] == "failed"
+    assert result["attempts"] == 2
+    assert result["error"] == "Lease of worker other worker expired"
+
+
+def test_extended_lease_is_not_leased_again(queue, clock):
+    job = queue.enqueue(1)
+    leased = queue.lease("worker")
+
+    clock.return_value = NOW + timedelta(seconds=50)
+    assert queue.extend_lease(leased)
+    clock.return_value = NOW + timedelta(seconds=61)
+    assert queue.lease("other worker") is None
+    assert queue.get(job["job_id"])["status"] == "running"
+
+    queue.complete(leased, {"activity_id": 1})
+    assert not queue.extend_lease(leased)
+
+
+def test_fail_retries_with_backoff_then_fails(queue, clock):
+    job = queue.enqueue(1)
+    queue.fail(queue.lease("worker"), "model is loading")
+
+    assert queue.get(job["job_id"])["status"] == "queued"
+    assert queue.lease("worker") is None
+    clock.return_value = NOW + timedelta(seconds=10)
+    queue.fail(queue.lease("worker"), "model is loading")
+
+    result = queue.get(job["job_id"])
+    assert result["status"] == "failed"
+    assert result["attempts"] == 2
+    assert result["error"] == "model is loading"
+
+
+def test_get_fails(queue):
+    with pytest.raises(JobNotFound):
+        queue.get("missing")
+
+
+def test_worker_process_one(queue):
+    gateway = MagicMock()
+    gateway.get.side_effect = NoResultFound
+    gateway.update.side_effect = lambda document, update_dict: {
+        **document,
+        **update_dict,
+    }
+    strava_client = MagicMock()
+    strava_client.get_activity.return_value = {"activity_id": 1}
+    story_generator = MagicMock()
+    story_generator.generate.return_value = Story("title", "content")
+    worker = StoryJobWorker(queue, gateway, strava_client, story_generator)
+    job = queue.enqueue(1)
+
+    assert worker.process_one()
+    assert not worker.process_one()
+
+    gateway.save_one.assert_called_once_with({"activity_id": 1})
+    assert queue.get(job["job_id"])["result"] == {
+        "activity_id": 1,
+        "story_title": "title",
+        "story_content": "content",
+    }
+
+
+def test_worker_does_not_retry_missing_activity(queue):
+    gateway = MagicMock()
+    gateway.get.side_effect = NoResultFound
+    strava_client = MagicMock()
+    strava_client.get_activity.side_effect = ActivityNotFoundError
+    worker = StoryJobWorker(queue, gateway, strava_client, MagicMock())
+    job = queue.enqueue(1)
+
+    worker.process_one()
+
+    assert queue.get(job["job_id"])["status"] == "failed"
+
+
+def test_worker_scopes_job_to_its_athlete(queue):
+    gateway = MagicMock()
+    gateway.get.side_effect = [NoResultFound, ActivityConflict("Activity 2")]
+    gateway.update.side_effect = lambda activity, story: {**activity, **story}
+    strava_client_pool = MagicMock()
+    strava_client_pool.get.return_value.get_activity.return_value = {"activity_id": 1}
+    story_generator = MagicMock()
+    story_generator.generate.return_value = Story("title", "content")
+    worker = StoryJobWorker(
+        queue,
+        gateway,
+        MagicMock(),
+        story_generator,
+        strava_client_pool=strava_client_pool,
+    )
+    job = queue.enqueue(1, athlete_id=7)
+    conflicting_job = queue.enqueue(2, athlete_id=7)
+
+    worker.process_one()
+    worker.process_one()
+
+    gateway.get.assert_any_call(1, athlete_id=7)
+    strava_client_pool.get.assert_called_once_with(7)
+    gateway.save_one.assert_called_once_with({"activity_id": 1, "athlete_id": 7})
+    assert queue.get(job["job_id"])["status"] == "succeeded"
+    result = queue.get(conflicting_job["job_id"])
+    assert result["status"] == "failed"
+    assert result["error"] == "Activity 2"
+
+
+def test_worker_extends_lease_while_job_runs(queue):
+    gateway = MagicMock()
+    gateway.update.side_effect = lambda activity, story: {**activity, **story}
+    story_generator = MagicMock()
+    story_generator.generate.side_effect = lambda activity: time.sleep(0.1) or Story(
+        "title", "content"
+    )
+    worker = StoryJobWorker(
+        queue, gateway, MagicMock(), story_generator, heartbeat_interval=0.01
+    )
+    job = queue.enqueue(1)
+
+    with patch.object(queue, "extend_lease", wraps=queue.extend_lease) as extend:
+        worker.process_one()
+        beats = extend.call_count
+        time.sleep(0.05)
+
+    assert beats >= 2
+    # heartbeat stops with the job
+    assert extend.call_count == beats
+    assert queue.get(job["job_id"])["status"] == "succeeded"
+
+
+def test_worker_run_survives_queue_errors():
+    queue = MagicMock()
+    queue.visibility_timeout = 60
+    stop_event = threading.Event()
+    worker = StoryJobWorker(
+        queue, MagicMock(), MagicMock(), MagicMock(), poll_interval=0
+    )
+
+    def lease(worker_id):
+        if queue.lease.call_count == 1:
+            raise PyMongoError("MongoDB is unreachable")
+        stop_event.set()
+        return None
+
+    queue.lease.side_effect = lease
+    worker.run(stop_event)
+
+    assert queue.lease.call_count == 2
@@ -0,0 +1,59 @@
+import asyncio
+import threading
+
+from src.metrics import MetricsRegistry, timed
+
+
+def test_render_prometheus_text_format():
+    registry = MetricsRegistry()
+    requests = registry.counter("requests_total", "Requests", ("status_code",))
+    latency = registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1.0))
+
+    requests.inc(status_code=200)
+    requests.inc(2, status_code=200)
+    requests.inc(status_code=429)
+    for value in (0.05, 0.1, 0.5, 3.0):
+        latency.observe(value)
+
+    assert registry.render().splitlines() == [
+        "# HELP requests_total Requests",
+        "# TYPE requests_total counter",
+        'requests_total{status_code="200"} 3',
+        'requests_total{status_code="429"} 1',
+        "# HELP latency_seconds Latency",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{le="0.1"} 2',
+        'latency_seconds_bucket{le="1.0"} 3',
+        'latency_seconds_bucket{le="+Inf"} 4',
+        "latency_seconds_sum 3.65",
+        "latency_seconds_count 4",
+    ]
+
+
+def test_timed_context_manager_and_decorators():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("stage_seconds", "Stages", ("stage",))
+
+    @timed(histogram, stage="sync")
+    def work():
+        return 1
+
+    @timed(histogram, stage="async")
+    async def awork():
+        await asyncio.sleep(0.01)
+        return 2
+
+    with timed(histogram, stage="block"):
+        pass
+    threads = [threading.Thread(target=work) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert asyncio.run(awork()) == 2
+    assert histogram.count(stage="block") == 1
+    assert histogram.count(stage="sync") == 10
+    assert histogram.count(stage="async") == 1
+    # coroutine is timed until it returns, not until it is created
+    assert 'stage_seconds_bucket{stage="async",le="0.005"} 0' in registry.render()
@@ -0,0 +1,174 @@
+import asyncio
+import threading
+import time
+from unittest.mock import patch
+
+import mongomock
+from fastapi.testclient import TestClient
+
+from app.dependencies import get_gateway, get_story_generator, get_strava_client
+from app.main import app
+from app.middleware import ProfilingMiddleware
+from app.slow_requests import format_profile
+from src.generators import AIStoryGenerator
+from src.llm_backends import StubLLM
+from src.metrics import timed, timing_recorder, STAGE_SECONDS
+from src.profiling import FileProfileStore, RequestProfile, StackSampler
+
+
+class ListProfileStore:
+    def __init__(self):
+        self.profiles = []
+        self.saved = threading.Event()
+
+    def save(self, profile: dict) -> None:
+        self.profiles.append(profile)
+        self.saved.set()
+
+
+def busy_loop(stop: threading.Event, profile: RequestProfile):
+    token = timing_recorder.set(profile)
+    with timed(STAGE_SECONDS, stage="busy"):
+        while not stop.is_set():
+            pass
+    timing_recorder.reset(token)
+
+
+def test_stack_sampler_samples_registered_threads():
+    profile = RequestProfile()
+    # background sampling is too slow to interfere, the test samples by itself
+    sampler = StackSampler(interval_seconds=3600)
+    stop = threading.Event()
+    thread = threading.Thread(target=busy_loop, args=(stop, profile))
+    thread.start()
+    while not profile.threads():
+        time.sleep(0.001)
+    sampler.start(profile)
+
+    for _ in range(5):
+        sampler.sample()
+    sampler.stop(profile)
+    stop.set()
+    thread.join()
+    document = profile.to_document()
+
+    assert document["samples"] == 5
+    assert document["stages"]["stage=busy"]["count"] == 1
+    assert sum(count for _, count in document["stacks"]) == 5
+    for stack, _ in document["stacks"]:
+        assert stack.startswith("threading:_bootstrap;")
+        assert "tests.test_profiling:busy_loop" in stack
+
+
+def test_threads_are_unregistered_when_they_leave_the_request():
+    profile = RequestProfile()
+    token = timing_recorder.set(profile)
+
+    with timed(STAGE_SECONDS, stage="outer"):
+        with timed(STAGE_SECONDS, stage="inner"):
+            pass
+        assert profile.threads() == (threading.get_ident(),)
+    timing_recorder.reset(token)
+
+    # a pooled thread that serves the next request is not sampled for this one
+    assert profile.threads() == ()
+
+
+def test_stack_sampler_samples_only_the_running_task_of_the_event_loop():
+    spinning, waiting = RequestProfile(), RequestProfile()
+    sampler = StackSampler(interval_seconds=3600)
+    spinning_entered, stop = threading.Event(), threading.Event()
+
+    async def spin():
+        timing_recorder.set(spinning)
+        with timed(STAGE_SECONDS, stage="spin"):
+            spinning_entered.set()
+            while not stop.is_set():
+                pass
+
+    async def wait(done: asyncio.Event):
+        timing_recorder.set(waiting)
+        with timed(STAGE_SECONDS, stage="wait"):
+            await done.wait()
+
+    async def requests():
+        # both requests run on the event loop thread, only one of them at a time
+        done = asyncio.Event()
+        waiting_task = asyncio.create_task(wait(done))
+        await asyncio.sleep(0)
+        await asyncio.create_task(spin())
+        done.set()
+        await waiting_task
+
+    def sample():
+        spinning_entered.wait()
+        sampler.start(spinning)
+        sampler.start(waiting)
+        for _ in range(5):
+            sampler.sample()
+        stop.set()
+
+    thread = threading.Thread(target=sample)
+    thread.start()
+    asyncio.run(requests())
+    thread.join()
+
+    assert spinning.samples == 5
+    for stack, _ in spinning.to_document()["stacks"]:
+        assert "tests.test_profiling:spin" in stack
+    assert waiting.samples == 0
+    assert spinning.owners() == waiting.owners() == ()
+
+
+def test_file_profile_store_rotates_and_returns_slowest(tmp_path):
+    store = FileProfileStore(str(tmp_path), max_bytes=200)
+
+    for duration_ms in (5.0, 50.0, 1.0, 20.0, 10.0):
+        store.save({"duration_ms": duration_ms, "path": "/activities/1/"})
+
+    # every profile is 47 bytes, the fifth one does not fit and starts a new file
+    assert (tmp_path / "profiles.jsonl.1").read_text().count("\n") == 4
+    assert (tmp_path / "profiles.jsonl").read_text().count("\n") == 1
+    assert [p["duration_ms"] for p in store.slowest(3)] == [50.0, 20.0, 10.0]
+
+
+@patch("src.strava_client.StravaClient.get_activity")
+def test_profiling_middleware_saves_slow_request(mock_get_activity):
+    mock_get_activity.return_value = {
+        "activity_id": 7,
+        "time": 120,
+        "elevation": 50.5,
+        "speed": 60,
+        "distance": 35,
+    }
+    story_generator = AIStoryGenerator(llm=StubLLM())
+    app.dependency_overrides[get_story_generator] = lambda: story_generator
+    store = ListProfileStore()
+    client = TestClient(
+        ProfilingMiddleware(app, store=store, sample_rate=0.0, slow_ms=0.0)
+    )
+
+    with patch("src.gateway.MongoClient", mongomock.MongoClient):
+        response = client.put("/activities/7/?trace=1")
+    app.dependency_overrides.clear()
+    get_gateway.cache_clear()
+    get_strava_client.cache_clear()
+
+    assert response.status_code == 200
+    assert store.saved.wait(timeout=5)
+    (profile,) = store.profiles
+    assert profile["method"] == "PUT"
+    assert profile["path"] == "/activities/7/"
+    assert profile["query"] == "trace=1"
+    assert profile["status_code"] == 200
+    assert profile["reason"] == "slow"
+    for stage in (
+        "stage=mongo_get",
+        "stage=strava_get_activity",
+        "stage=llm_generate",
+        "stage=parse",
+        "stage=mongo_update",
+    ):
+        assert profile["stages"][stage]["count"] == 1
+    assert profile["stages"]["stage=llm_generate"]["ms"] <= profile["duration_ms"]
+    assert "stage=llm_generate" in format_profile(1, profile, num_stacks=3)
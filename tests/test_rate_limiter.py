@@ -0,0 +1,136 @@
+import math
+import time
+from unittest.mock import patch
+
+import pytest
+
+from benchmarks.strava_stub import StravaStubServer
+from src.rate_limiter import (
+    StravaRateLimiter,
+    RateLimitExceededError,
+    retry_after_seconds,
+)
+from src.strava_client import StravaClient
+from src.token_manager import StravaTokenManager
+
+
+@pytest.fixture
+def clock():
+    with patch("src.rate_limiter.StravaRateLimiter._now") as mock_now:
+        mock_now.return_value = 0.0
+        yield mock_now
+
+
+def test_reserve_paces_after_burst(clock):
+    rate_limiter = StravaRateLimiter(short_limit=2, daily_limit=100, short_window=10)
+
+    waits = [rate_limiter.reserve() for _ in range(4)]
+
+    assert waits == [0.0, 0.0, 5.0, 10.0]
+    clock.return_value = 10.0
+    assert rate_limiter.reserve() == 5.0
+
+
+def test_reserve_fails_fast_instead_of_waiting_long(clock):
+    rate_limiter = StravaRateLimiter(
+        short_limit=2, daily_limit=100, short_window=10, max_backoff_seconds=5.0
+    )
+    waits = [rate_limiter.reserve() for _ in range(3)]
+
+    with pytest.raises(RateLimitExceededError) as exc_info:
+        rate_limiter.reserve()
+
+    assert waits == [0.0, 0.0, 5.0]
+    assert exc_info.value.retry_after_seconds == 10
+    # the rejected request did not take a token
+    assert rate_limiter.metrics()["tokens"] == -1.0
+    assert rate_limiter.metrics()["daily_usage"] == 3
+
+
+def test_daily_limit(clock):
+    rate_limiter = StravaRateLimiter(short_limit=10, daily_limit=1)
+    rate_limiter.reserve()
+
+    with pytest.raises(RateLimitExceededError) as exc_info:
+        rate_limiter.reserve()
+    assert 1 <= exc_info.value.retry_after_seconds <= 24 * 60 * 60
+
+
+def test_update_from_headers(clock):
+    rate_limiter = StravaRateLimiter(short_limit=100, daily_limit=1000)
+
+    rate_limiter.update(
+        {"X-RateLimit-Limit": "600,30000", "X-RateLimit-Usage": "598,27536"}
+    )
+
+    metrics = rate_limiter.metrics()
+    assert metrics["short_remaining"] == 2
+    assert metrics["daily_remaining"] == 30000 - 27536
+    assert metrics["tokens"] == 2
+
+
+def test_retry_delay():
+    rate_limiter = StravaRateLimiter(
+        max_retries=2, backoff_seconds=1.0, max_backoff_seconds=60.0
+    )
+
+    assert rate_limiter.retry_delay(200, 1) is None
+    assert rate_limiter.retry_delay(404, 1) is None
+    assert 0 <= rate_limiter.retry_delay(503, 2) <= 2.0
+    assert 5.0 <= rate_limiter.retry_delay(429, 1, {"Retry-After": "5"}) <= 6.0
+    assert rate_limiter.retry_delay(429, 1, {"Retry-After": "600"}) is None
+    assert rate_limiter.retry_delay(503, 3) is None
+    assert rate_limiter.metrics()["retries"] == 2
+
+
+@patch("src.rate_limiter.time.time")
+def test_retry_delay_of_rate_limited_response(mock_time):
+    rate_limiter = StravaRateLimiter(max_backoff_seconds=60.0, short_window=900)
+
+    # waits for the next window only if it is close
+    mock_time.return_value = 900 * 10 + 870.0
+    assert 30.0 <= rate_limiter.retry_delay(429, 1) <= 31.0
+    mock_time.return_value = 900 * 10 + 300.0
+    assert rate_limiter.retry_delay(429, 1) is None
+
+    # never waits when the daily limit is used up
+    mock_time.return_value = 900 * 10 + 870.0
+    rate_limiter.update(
+        {"X-RateLimit-Limit": "600,30000", "X-RateLimit-Usage": "600,30000"}
+    )
+    assert rate_limiter.retry_delay(429, 1) is None
+
+
+@patch("src.rate_limiter.time.time")
+def test_retry_after_seconds(mock_time):
+    mock_time.return_value = 24 * 60 * 60 * 3 + 900 * 10 + 300.0
+    limits = {"X-RateLimit-Limit": "600,30000"}
+
+    assert retry_after_seconds({"Retry-After": "7"}) == 7
+    assert retry_after_seconds({**limits, "X-RateLimit-Usage": "600,100"}) == 600
+    assert (
+        retry_after_seconds({**limits, "X-RateLimit-Usage": "600,30000"})
+        == 24 * 60 * 60 - 900 * 10 - 300
+    )
+
+
+def test_client_stays_within_stub_server_limits():
+    with StravaStubServer(num_activities=50, short_limit=5, window_seconds=0.5) as stub:
+        rate_limiter = StravaRateLimiter(
+            short_limit=5, daily_limit=1000, short_window=0.5, backoff_seconds=0.05
+        )
+        client = StravaClient(
+            stub.activity_uri,
+            stub.athlete_activities_uri,
+            rate_limiter=rate_limiter,
+            token_manager=StravaTokenManager(access_token="1234", expires_at=math.inf),
+        )
+
+        start = time.perf_counter()
+        activities = [client.get_activity(idx) for idx in range(1, 16)]
+        elapsed = time.perf_counter() - start
+
+    assert [activity["activity_id"] for activity in activities] == list(range(1, 16))
+    # 5 requests are allowed per 0.5 seconds, 15 requests need at least 2 refills
+    assert elapsed >= 0.9
+    assert rate_limiter.metrics()["short_limit"] == 5
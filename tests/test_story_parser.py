@@ -0,0 +1,129 @@
+import json
+import random
+from pathlib import Path
+
+import pytest
+
+from src.story_parser import parse_story, story_is_complete, streamed_title
+
+RECORDED_OUTPUTS_PATH = (
+    Path(__file__).resolve().parent.parent / "benchmarks" / "data" / "llm_outputs.json"
+)
+
+with open(RECORDED_OUTPUTS_PATH) as f:
+    RECORDED_OUTPUTS = json.load(f)
+
+
+@pytest.mark.parametrize(
+    "text, title, content",
+    [
+        (
+            "Title: The Swift Descent\n\nI raced down. Trees whispered.",
+            "The Swift Descent",
+            "I raced down. Trees whispered.",
+        ),
+        (
+            "## Coastal Sprint\n\nI flew along the cliffs.",
+            "Coastal Sprint",
+            "I flew along the cliffs.",
+        ),
+        ('"Rain on the Ridge"\n\nI kept going.', "Rain on the Ridge", "I kept going."),
+        (
+            "**Title:** Night Owl Run\n\n**Story:** The city slept.",
+            "Night Owl Run",
+            "The city slept.",
+        ),
+    ],
+)
+def test_parse_title_formats(text, title, content):
+    parsed = parse_story(text)
+
+    assert parsed.story_title == title
+    assert parsed.story_content == content
+    assert parsed.confidence >= 0.7
+
+
+def test_parse_trims_unfinished_sentence():
+    parsed = parse_story(
+        "Title: Morning Ride\n\nI pedaled 25 km. The river sparkled.\n\nThe next day, I decided to"
+    )
+
+    assert parsed.story_content == "I pedaled 25 km. The river sparkled."
+    assert parsed.confidence == 1.0
+
+    parsed = parse_story("Title: Fog\n\nThe fog swallowed 5.5 km. The trail ahead and")
+
+    assert parsed.story_content == "The fog swallowed 5.5 km."
+    assert parsed.content_score == 0.8
+
+
+def test_parse_without_title_has_low_confidence():
+    parsed = parse_story("I jogged around the park. Ducks glided across the pond.")
+
+    assert parsed.story_title == "I jogged around the park"
+    assert parsed.confidence < 0.5
+
+
+@pytest.mark.parametrize("text", ["", "Title: Only A Title", "\n\n\n"])
+def test_parse_without_story_has_zero_confidence(text):
+    assert parse_story(text).confidence == 0.0
+
+
+def _mutate(text: str, rng: random.Random) -> str:
+    mutation = rng.randrange(6)
+    if mutation == 0:
+        return text[: rng.randrange(len(text) + 1)]
+    if mutation == 1:
+        return text.replace("Title: ", "")
+    if mutation == 2:
+        position = rng.randrange(len(text) + 1)
+        noise = "".join(rng.choice("\n #*\"'.:!?-Title") for _ in range(10))
+        return text[:position] + noise + text[position:]
+    if mutation == 3:
+        return text.replace("\n", rng.choice(["\r\n", " ", "\n\n\n"]))
+    if mutation == 4:
+        return "".join(chr(rng.randrange(32, 0x2FFF)) for _ in range(rng.randrange(50)))
+    return rng.choice(RECORDED_OUTPUTS) + text
+
+
+def test_parse_fuzzed_recorded_outputs():
+    rng = random.Random(0)
+
+    for _ in range(2000):
+        text = _mutate(rng.choice(RECORDED_OUTPUTS), rng)
+        parsed = parse_story(text)
+
+        assert 0.0 <= parsed.confidence <= 1.0
+        assert "\n" not in parsed.story_title
+        assert "\n" not in parsed.story_content
+        assert parsed.story_content.strip() == parsed.story_content
+        # story is made of the words of the output
+        assert set(parsed.story_content.split()) <= set(text.split())
+
+
+@pytest.mark.parametrize(
+    "text, complete",
+    [
+        ("Title: Fog\n\nThe fog swallowed the trail.", False),
+        ("Title: Fog\n\nThe fog swallowed 5.", False),
+        ("Title: Fog\n\nThe fog swallowed 5.5 km. Trees", False),
+        ("Title: Fog\n\nThe fog swallowed 5.5 km. Trees whispered. ", True),
+        ("Title: Fog\n\nThe fog swallowed 5.5 km. Trees whispered.\n\nThe", True),
+        ("The fog swallowed 5.5 km. Trees whispered. ", False),
+    ],
+)
+def test_story_is_complete(text, complete):
+    assert story_is_complete(text) == complete
+
+
+@pytest.mark.parametrize(
+    "text, title",
+    [
+        ("Title: The Swift", None),
+        ("Title: The Swift Descent\n", "The Swift Descent"),
+        ("Title:\nThe Swift Descent\n\nI raced", "The Swift Descent"),
+        ("I raced down the trail.\n\n", None),
+    ],
+)
+def test_streamed_title(text, title):
+    assert streamed_title(text) == title
@@ -1,22 +1,36 @@
+import asyncio
+import math
+import time
+from unittest.mock import MagicMock, patch
+
+import httpx
 import pytest
 import responses
 
+from src.rate_limiter import RateLimitExceededError, StravaRateLimiter
+from src.token_manager import StravaTokenManager
 from src.strava_client import (
+    AsyncStravaClient,
     StravaClient,
+    StravaClientPool,
     ActivityNotFoundError,
     ActivityBadRequestError,
     ClientAuthenticationError,
 )
 
 
+def _valid_token_manager():
+    return StravaTokenManager(access_token="1234", expires_at=math.inf)
+
+
 @pytest.mark.skip(reason="Integration test")
 def test_authenticate():
     client = StravaClient()
 
     client.authenticate()
 
-    assert StravaClient._access_token
-    assert StravaClient._refresh_token
+    assert StravaClient._token_manager.access_token
+    assert StravaClient._token_manager.refresh_token
     assert not StravaClient._first_call
 
 
@@ -26,7 +40,7 @@ def test_refresh_token():
 
     client.refresh_token()
 
-    assert StravaClient._access_token is not None
+    assert StravaClient._token_manager.access_token is not None
 
 
 @pytest.mark.skip(reason="Integration test")
@@ -95,7 +109,7 @@ def setup_mock_success(setup_data):
 def test_get_activity_200(setup_mock_success, setup_data):
     activity_uri, activity_id = setup_data
     client = StravaClient(activity_uri)
-    client._access_token = "1234"
+    client._token_manager = _valid_token_manager()
 
     result = client.get_activity(activity_id)
 
@@ -122,7 +136,7 @@ def setup_mock_not_found(setup_data):
 def test_get_activity_404(setup_data, setup_mock_not_found):
     activity_uri, activity_id = setup_data
     client = StravaClient(activity_uri)
-    client._access_token = "1234"
+    client._token_manager = _valid_token_manager()
 
     with pytest.raises(ActivityNotFoundError):
         _ = client.get_activity(activity_id)
@@ -141,7 +155,7 @@ def setup_mock_bad_request(setup_data):
 def test_get_activity_400(setup_data, setup_mock_bad_request):
     activity_uri, activity_id = setup_data
     client = StravaClient(activity_uri)
-    client._access_token = "1234"
+    client._token_manager = _valid_token_manager()
 
     with pytest.raises(ActivityBadRequestError):
         _ = client.get_activity(activity_id)
@@ -157,10 +171,282 @@ def setup_mock_authentication_failed(setup_data):
 
 
 @responses.activate
-def test_get_activity_401(setup_data, setup_mock_authentication_failed):
+@patch("src.token_manager.StravaTokenManager.refresh")
+def test_get_activity_401(_, setup_data, setup_mock_authentication_failed):
     activity_uri, activity_id = setup_data
     client = StravaClient(activity_uri)
-    client._access_token = "1234"
+    client._token_manager = _valid_token_manager()
 
     with pytest.raises(ClientAuthenticationError):
         _ = client.get_activity(activity_id)
+
+
+def _raw_activity(activity_id):
+    return {
+        "id": activity_id,
+        "max_speed": 10.0,
+        "distance": 1000.0,
+        "moving_time": 300,
+        "total_elevation_gain": 5.0,
+    }
+
+
+@responses.activate
+@patch("src.strava_client.time.time", return_value=1700000000)
+def test_get_most_recent_activities_stops_after_enough_pages(_):
+    activity_uri = "https://mock_uri/athlete/activities"
+    for page, ids in enumerate([[9, 8], [7, 6], [5, 4]], start=1):
+        responses.add(
+            responses.GET,
+            f"{activity_uri}?before=1700000000&page={page}&per_page=2",
+            json=[_raw_activity(activity_id) for activity_id in ids],
+            status=200,
+        )
+    client = StravaClient(athlete_activities_uri=activity_uri)
+    client._token_manager = _valid_token_manager()
+
+    result = client.get_most_recent_activities(num_recent_activities=3, per_page=2)
+
+    assert [activity["activity_id"] for activity in result] == [9, 8, 7]
+    assert len(responses.calls) == 2
+    # third page is never requested
+
+
+@responses.activate
+@patch("src.strava_client.time.time", return_value=1700000000)
+def test_get_most_recent_activities_short_history(_):
+    activity_uri = "https://mock_uri/athlete/activities"
+    responses.add(
+        responses.GET,
+        f"{activity_uri}?before=1700000000&page=1&per_page=3",
+        json=[_raw_activity(1)],
+        status=200,
+    )
+    client = StravaClient(athlete_activities_uri=activity_uri)
+    client._token_manager = _valid_token_manager()
+
+    result = client.get_most_recent_activities()
+
+    assert [activity["activity_id"] for activity in result] == [1]
+    assert len(responses.calls) == 1
+
+
+@responses.activate
+def test_iter_activities_after():
+    activity_uri = "https://mock_uri/athlete/activities"
+    raw_activity = _raw_activity(5)
+    raw_activity["start_date"] = "2018-02-16T14:52:54Z"
+    responses.add(
+        responses.GET,
+        f"{activity_uri}?after=1518792000&page=1&per_page=200",
+        json=[raw_activity],
+        status=200,
+    )
+    client = StravaClient(athlete_activities_uri=activity_uri)
+    client._token_manager = _valid_token_manager()
+
+    result = list(client.iter_activities_after(1518792000))
+
+    assert result == [
+        {
+            "activity_id": 5,
+            "speed": 10.0,
+            "distance": 1000.0,
+            "time": 300,
+            "elevation": 5.0,
+            "start_date": 1518792774,
+        }
+    ]
+
+
+@responses.activate
+def test_get_athlete_id_is_cached():
+    athlete_uri = "https://mock_uri/athlete"
+    responses.add(responses.GET, athlete_uri, json={"id": 42}, status=200)
+    client = StravaClient(athlete_uri=athlete_uri)
+    client._token_manager = _valid_token_manager()
+
+    assert client.get_athlete_id() == 42
+    assert client.get_athlete_id() == 42
+    assert len(responses.calls) == 1
+
+
+def _mock_async_client(activity_uri, handler):
+    client = AsyncStravaClient(
+        activity_uri=activity_uri, athlete_activities_uri=activity_uri
+    )
+    client._token_manager = _valid_token_manager()
+    client._http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return client
+
+
+def test_async_get_activity_200(setup_data):
+    activity_uri, activity_id = setup_data
+
+    def handler(request):
+        assert request.headers["Authorization"] == "Bearer 1234"
+        return httpx.Response(200, json=_raw_activity(activity_id))
+
+    client = _mock_async_client(activity_uri, handler)
+
+    result = asyncio.run(client.get_activity(activity_id))
+
+    assert result == {
+        "activity_id": activity_id,
+        "speed": 10.0,
+        "distance": 1000.0,
+        "time": 300,
+        "elevation": 5.0,
+    }
+
+
+def test_async_get_activity_404(setup_data):
+    activity_uri, activity_id = setup_data
+    client = _mock_async_client(activity_uri, lambda request: httpx.Response(404))
+
+    with pytest.raises(ActivityNotFoundError):
+        asyncio.run(client.get_activity(activity_id))
+
+
+def test_async_get_most_recent_activities_stops_early():
+    activity_uri = "https://mock_uri/athlete/activities"
+    requested_pages = []
+
+    def handler(request):
+        page = int(request.url.params["page"])
+        requested_pages.append(page)
+        ids = [2 * (10 - page) + 1, 2 * (10 - page)]
+        return httpx.Response(200, json=[_raw_activity(idx) for idx in ids])
+
+    client = _mock_async_client(activity_uri, handler)
+
+    result = asyncio.run(
+        client.get_most_recent_activities(num_recent_activities=3, per_page=2)
+    )
+
+    assert [activity["activity_id"] for activity in result] == [19, 18, 17]
+    assert requested_pages == [1, 2]
+
+
+@responses.activate
+def test_get_activity_refreshes_rejected_token_once(setup_data):
+    activity_uri, activity_id = setup_data
+    url = f"{activity_uri}{activity_id}?include_all_efforts=false"
+    responses.add(responses.GET, url, status=401)
+    responses.add(responses.GET, url, json=_raw_activity(activity_id), status=200)
+    token_manager = _valid_token_manager()
+    client = StravaClient(activity_uri, token_manager=token_manager)
+
+    with patch.object(token_manager, "refresh") as mock_refresh:
+        result = client.get_activity(activity_id)
+
+    assert result["activity_id"] == activity_id
+    mock_refresh.assert_called_once_with(stale_access_token="1234")
+
+
+def test_client_pool_evicts_least_recently_used():
+    pool = StravaClientPool(MagicMock(), max_size=2)
+
+    first = pool.get(1)
+    pool.get(2)
+    assert pool.get(1) is first
+    pool.get(3)
+
+    assert pool.get(1) is first
+    assert pool.get(2) is not None
+    assert len(pool._clients) == 2
+    assert pool.get(1)._http is pool.get(3)._http
+
+
+@responses.activate
+def test_client_pool_authenticate():
+    gateway = MagicMock()
+    responses.add(
+        responses.POST,
+        StravaClient._access_token_uri,
+        json={
+            "access_token": "access",
+            "refresh_token": "refresh",
+            "expires_at": 0,
+            "athlete": {"id": 10},
+        },
+        status=200,
+    )
+    pool = StravaClientPool(gateway)
+
+    assert pool.authenticate("code") == 10
+    gateway.save_token.assert_called_once()
+    assert gateway.save_token.call_args.args[0] == 10
+
+
+@responses.activate
+def test_get_activities_keeps_order_and_errors(setup_data):
+    activity_uri, _ = setup_data
+    for activity_id in (1, 3):
+        responses.add(
+            responses.GET,
+            f"{activity_uri}{activity_id}",
+            json=_raw_activity(activity_id),
+            status=200,
+        )
+    responses.add(responses.GET, f"{activity_uri}2", status=404)
+    client = StravaClient(
+        activity_uri=activity_uri, token_manager=_valid_token_manager()
+    )
+
+    results = client.get_activities([1, 2, 3], concurrency=2)
+
+    assert [result["activity_id"] for result in (results[0], results[2])] == [1, 3]
+    assert isinstance(results[1], ActivityNotFoundError)
+
+
+@responses.activate
+def test_get_activities_fails_fast_when_rate_limit_is_used_up(setup_data):
+    activity_uri, _ = setup_data
+    for activity_id in range(1, 11):
+        responses.add(
+            responses.GET,
+            f"{activity_uri}{activity_id}",
+            json=_raw_activity(activity_id),
+            status=200,
+        )
+    # 2 requests per 15 minutes, the third one would wait 7.5 minutes
+    rate_limiter = StravaRateLimiter(short_limit=2, max_backoff_seconds=1.0)
+    client = StravaClient(
+        activity_uri=activity_uri,
+        token_manager=_valid_token_manager(),
+        rate_limiter=rate_limiter,
+    )
+
+    start = time.perf_counter()
+    results = client.get_activities(list(range(1, 11)), concurrency=4)
+
+    assert time.perf_counter() - start < 5
+    assert sum(isinstance(result, dict) for result in results) == 2
+    assert sum(isinstance(result, RateLimitExceededError) for result in results) == 8
+    assert len(responses.calls) == 2
+
+
+def test_async_get_activities_keeps_order_and_errors(setup_data):
+    activity_uri, _ = setup_data
+    in_flight = 0
+    max_in_flight = 0
+
+    async def handler(request):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        activity_id = int(request.url.path.rsplit("/", 1)[-1])
+        if activity_id % 2 == 0:
+            return httpx.Response(404, json={"message": "Record Not Found"})
+        return httpx.Response(200, json=_raw_activity(activity_id))
+
+    client = _mock_async_client(activity_uri, handler)
+
+    results = asyncio.run(client.get_activities(list(range(1, 11)), concurrency=3))
+
+    assert max_in_flight == 3
+    assert [result["activity_id"] for result in results[::2]] == [1, 3, 5, 7, 9]
+    assert all(isinstance(result, ActivityNotFoundError) for result in results[1::2])
@@ -0,0 +1,175 @@
+import threading
+import time
+
+from unittest.mock import patch
+
+import mongomock
+import pytest
+import responses
+
+from src.gateway import MongoDBGateway
+from src.token_manager import (
+    ClientAuthenticationError,
+    FileTokenStore,
+    MongoTokenStore,
+    StravaTokenManager,
+)
+
+
+ACCESS_TOKEN_URI = "https://mock_uri/oauth/token"
+
+
+@pytest.fixture
+def store(tmp_path):
+    return FileTokenStore(str(tmp_path / "token.json"))
+
+
+def _add_refresh_response(access_token, refresh_token, expires_in=21600):
+    responses.add(
+        responses.POST,
+        ACCESS_TOKEN_URI,
+        json={
+            "access_token": access_token,
+            "refresh_token": refresh_token,
+            "expires_at": int(time.time()) + expires_in,
+        },
+        status=200,
+    )
+
+
+@responses.activate
+def test_refreshes_proactively_before_expiry(store):
+    _add_refresh_response("new access", "new refresh")
+    token_manager = StravaTokenManager(
+        refresh_token="refresh",
+        access_token="access",
+        expires_at=time.time() + 60,
+        store=store,
+        refresh_margin=300,
+        access_token_uri=ACCESS_TOKEN_URI,
+    )
+
+    assert token_manager.get_access_token() == "new access"
+    assert token_manager.get_access_token() == "new access"
+    assert len(responses.calls) == 1
+    assert store.load()["refresh_token"] == "new refresh"
+
+
+@responses.activate
+def test_concurrent_refreshes_are_single_flight(store):
+    _add_refresh_response("new access", "new refresh")
+    token_manager = StravaTokenManager(
+        refresh_token="refresh",
+        store=store,
+        access_token_uri=ACCESS_TOKEN_URI,
+    )
+    tokens = []
+
+    threads = [
+        threading.Thread(target=lambda: tokens.append(token_manager.get_access_token()))
+        for _ in range(10)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert tokens == ["new access"] * 10
+    assert len(responses.calls) == 1
+
+
+@responses.activate
+def test_stale_token_is_refreshed_once(store):
+    _add_refresh_response("new access", "new refresh")
+    token_manager = StravaTokenManager(
+        refresh_token="refresh",
+        access_token="rejected",
+        expires_at=time.time() + 3600,
+        store=store,
+        access_token_uri=ACCESS_TOKEN_URI,
+    )
+
+    token_manager.refresh(stale_access_token="rejected")
+    token_manager.refresh(stale_access_token="rejected")
+
+    assert token_manager.access_token == "new access"
+    assert len(responses.calls) == 1
+
+
+@responses.activate
+def test_rejected_refresh_raises(store):
+    responses.add(
+        responses.POST,
+        ACCESS_TOKEN_URI,
+        json={
+            "message": "Bad Request",
+            "errors": [
+                {
+                    "resource": "RefreshToken",
+                    "field": "refresh_token",
+                    "code": "invalid",
+                }
+            ],
+        },
+        status=400,
+    )
+    token_manager = StravaTokenManager(
+        refresh_token="revoked",
+        store=store,
+        access_token_uri=ACCESS_TOKEN_URI,
+    )
+
+    with pytest.raises(ClientAuthenticationError, match="400.*Bad Request"):
+        token_manager.get_access_token()
+    # the lock is released and the next call tries again
+    with pytest.raises(ClientAuthenticationError):
+        token_manager.get_access_token()
+    assert len(responses.calls) == 2
+    assert token_manager.refresh_token == "revoked"
+    assert store.load() is None
+
+
+@responses.activate
+def test_persisted_token_is_reused(store):
+    store.save(
+        {
+            "access_token": "persisted access",
+            "refresh_token": "persisted refresh",
+            "expires_at": time.time() + 3600,
+        }
+    )
+    token_manager = StravaTokenManager(
+        refresh_token="env refresh", store=store, access_token_uri=ACCESS_TOKEN_URI
+    )
+
+    assert token_manager.get_access_token() == "persisted access"
+    assert len(responses.calls) == 0
+
+
+@responses.activate
+def test_mongo_token_store_is_per_athlete():
+    _add_refresh_response("new access", "new refresh")
+    with patch("src.gateway.MongoClient", mongomock.MongoClient):
+        gateway = MongoDBGateway(
+            uri="mongodb://localhost:27017",
+            db_name="activities",
+            collection_name="activity_collection",
+        )
+    gateway.save_token(
+        10, {"access_token": "access", "refresh_token": "refresh", "expires_at": 0}
+    )
+    gateway.save_token(
+        20,
+        {
+            "access_token": "other access",
+            "refresh_token": "other refresh",
+            "expires_at": time.time() + 3600,
+        },
+    )
+    token_manager = StravaTokenManager(
+        store=MongoTokenStore(gateway, 10), access_token_uri=ACCESS_TOKEN_URI
+    )
+
+    assert token_manager.get_access_token() == "new access"
+    assert gateway.get_token(10)["refresh_token"] == "new refresh"
+    assert gateway.get_token(20)["access_token"] == "other access"